@@ -4,6 +4,9 @@
 # https://github.com/k4kfh/alibre-neutralizer
 # Released under the LGPL 3.0 License
 
+# print() works the same in Alibre Script's IronPython and in the CPython used by the ``verify`` command
+from __future__ import print_function
+
 # import for auto-completion/code hints in development
 from AlibreScript import *
 
@@ -12,6 +15,386 @@ import os
 import re
 import xml.etree.ElementTree as ET
 import csv
+import time
+import hashlib
+import shutil
+import sys
+import json
+import mmap
+import threading
+import struct
+import math
+import tempfile
+import zlib
+import gzip
+import tarfile
+import array
+import binascii
+import itertools
+import zipfile
+from xml.sax.saxutils import quoteattr, escape, unescape
+try:
+    import Queue as queue # IronPython / Python 2
+except ImportError:
+    import queue # Python 3, for the verify command
+
+# optional dependencies
+try:
+    import numpy
+except ImportError:
+    numpy = None # Not available in Alibre Script's IronPython. Everything that uses it has a pure-Python fallback.
+
+def _bool_from_elem(elem, default=True):
+    """Read a boolean flag from an XML config element, falling back to ``default`` if the element is missing or empty."""
+    # type: (ET.Element | None, bool) -> bool
+    if elem is None or elem.text is None:
+        return default
+    val = elem.text.strip().lower()
+    return val in ("true", "1", "yes", "y")
+
+def _float_from_elem(elem, default):
+    """Read a number from an XML config element, falling back to ``default`` if the element is missing or empty."""
+    # type: (ET.Element | None, float) -> float
+    if elem is None or elem.text is None or elem.text.strip() == "":
+        return default
+    return float(elem.text.strip())
+
+def _default_worker_count():
+    """Return a sensible number of worker threads for I/O and hashing work.
+    IronPython has no ``multiprocessing`` module, so we can't use ``cpu_count()`` from there."""
+    # type: () -> int
+    try:
+        cpu_count = int(os.environ.get("NUMBER_OF_PROCESSORS", "0"))
+    except ValueError:
+        cpu_count = 0
+    if cpu_count <= 0:
+        cpu_count = 4
+    return max(2, min(cpu_count, 16))
+
+def _run_in_thread_pool(function, items, worker_count=None):
+    """Call ``function(item)`` for every item using a pool of threads, and return the results in the same order as ``items``.
+    If any call raises an exception, the first one is re-raised once all the threads have finished.
+
+    IronPython has no GIL (and no process pools), so threads give us real parallelism there.
+    On CPython (e.g. the verify command), hashing and file I/O release the GIL, so it still helps."""
+    # type: (callable, list, int | None) -> list
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    work = queue.Queue()
+    for i, item in enumerate(items):
+        work.put((i, item))
+
+    def _worker():
+        while True:
+            try:
+                i, item = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[i] = function(item)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=_worker) for _ in range(min(worker_count or _default_worker_count(), max(1, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
+
+class BackgroundTaskPool:
+    """A few long-lived worker threads that run tasks in the background, while the main thread carries on talking to Alibre.
+
+    Alibre Script only lets us drive Alibre from the main thread, and IronPython has no process pools, so CPU-heavy post-processing
+    (like mesh decimation) is handed off to these threads. IronPython has no GIL, so they really do run in parallel."""
+
+    def __init__(self, worker_count=None):
+        # type: (BackgroundTaskPool, int | None) -> None
+        self.worker_count = worker_count or _default_worker_count()
+        self._work = queue.Queue()
+        self._threads = []
+        self._results = []
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """Queue up ``function(*args)`` to run on a background thread. The worker threads are started the first time this is called.
+        Tasks can submit more tasks, and ``wait()`` waits for those too."""
+        # type: (BackgroundTaskPool, callable, ...) -> None
+        with self._lock:
+            if len(self._threads) == 0:
+                for _ in range(self.worker_count):
+                    thread = threading.Thread(target=self._worker)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+            self._results.append(None)
+            self._work.put((len(self._results) - 1, function, args))
+
+    def wait(self):
+        """Block until every submitted task has finished, and return their results in the order they were submitted.
+        If any task raised an exception, the first one is re-raised. Either way, the pool is ready for a new batch of tasks afterwards."""
+        # type: (BackgroundTaskPool) -> list
+        self._work.join()
+        with self._lock:
+            results, errors = self._results, self._errors
+            self._results, self._errors = [], []
+        if errors:
+            raise errors[0]
+        return results
+
+    def _worker(self):
+        while True:
+            i, function, args = self._work.get()
+            try:
+                self._results[i] = function(*args)
+            except Exception as e:
+                self._errors.append(e)
+            finally:
+                self._work.task_done()
+
+# -- LOGGING --
+
+class LogLevels:
+    """Log levels. Like ``ExportTypes``, this fudges an enum, since IronPython doesn't have the Enum library."""
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+    _NAMES = {DEBUG : "DEBUG", INFO : "INFO", WARNING : "WARNING", ERROR : "ERROR"}
+
+    @staticmethod
+    def convert_to_string(level):
+        """Given an integer log level, return its name (e.g. "WARNING")."""
+        # type: (int) -> str
+        return LogLevels._NAMES[level]
+
+    @staticmethod
+    def convert_from_string(name):
+        """Given the name of a log level (any case), return its integer value."""
+        # type: (str) -> int
+        for level, level_name in LogLevels._NAMES.items():
+            if level_name == name.strip().upper():
+                return level
+        raise Exception("Unknown log level: {0}. Use DEBUG, INFO, WARNING or ERROR.".format(name))
+
+class LogFileSink:
+    """Writes log records to a file, as plain text or as JSON lines (one JSON object per line).
+    Lines are buffered and written out in batches, so logging every export doesn't mean a write for every line."""
+
+    def __init__(self, path, level=LogLevels.DEBUG, json_lines=False, buffer_size=200):
+        # type: (LogFileSink, str, int, bool, int) -> None
+        self.path = path
+        self.level = level
+        self.json_lines = json_lines
+        self.buffer_size = buffer_size
+        self._buffer = []
+        log_dir = os.path.dirname(path)
+        if log_dir != "" and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        self._file = open(path, 'wb')
+
+    def write(self, level, record):
+        """Buffer a record (a dictionary with at least ``time``, ``level`` and ``message``), if ``level`` is at this sink's level or above."""
+        # type: (LogFileSink, int, dict) -> None
+        if level < self.level:
+            return
+        if self.json_lines:
+            line = json.dumps(record, sort_keys=True, separators=(",", ":"))
+        else:
+            extra = "".join(" {0}={1}".format(key, record[key]) for key in sorted(record.keys()) if key not in ("time", "level", "message"))
+            line = u"{0} {1:<7} {2}{3}".format(record["time"], record["level"], record["message"], extra)
+        self._buffer.append(line if isinstance(line, bytes) else line.encode("utf-8"))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        # type: (LogFileSink) -> None
+        if len(self._buffer) > 0:
+            self._file.write(b"\n".join(self._buffer) + b"\n")
+            self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        # type: (LogFileSink) -> None
+        self.flush()
+        self._file.close()
+
+class Logger:
+    """Where all of Alibre Neutralizer's messages go. Messages at ``console_level`` or above are printed, and every message
+    at a file sink's level or above goes to that file (see ``LogFileSink``).
+
+    Alibre Script's console redraws itself on every line, which adds up on big trees, so per-export messages are logged at DEBUG
+    (which isn't printed by default) and the console gets a single progress line instead, updated at most once every ``progress_interval`` seconds.
+    Logging is thread-safe, since background tasks log too."""
+
+    def __init__(self, console_level=LogLevels.INFO, progress_interval=1.0):
+        # type: (Logger, int, float) -> None
+        self.console_level = console_level
+        self.progress_interval = progress_interval
+        self.sinks = []
+        self._lock = threading.Lock()
+        self._last_progress_time = None
+        self._progress_width = 0 # Length of the progress line that's currently on the console, if it can be overwritten
+
+    def configure(self, console_level=LogLevels.INFO, progress_interval=1.0, sinks=None):
+        """Replace the console settings and file sinks. Any old sinks are flushed and closed."""
+        # type: (Logger, int, float, list[LogFileSink] | None) -> None
+        with self._lock:
+            for sink in self.sinks:
+                sink.close()
+            self.console_level = console_level
+            self.progress_interval = progress_interval
+            self.sinks = sinks or []
+
+    def log(self, level, message, **fields):
+        """Log a message. Any keyword arguments (like ``path`` or ``component``) are kept as separate fields in JSON lines."""
+        # type: (Logger, int, str, ...) -> None
+        record = {"time" : time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()), "level" : LogLevels.convert_to_string(level), "message" : message}
+        for key, value in fields.items():
+            if value is not None:
+                record[key] = value
+        with self._lock:
+            for sink in self.sinks:
+                sink.write(level, record)
+            if level >= self.console_level:
+                self._end_progress_line()
+                if level >= LogLevels.WARNING:
+                    print("{0}: {1}".format(record["level"], message))
+                else:
+                    print(message)
+
+    def debug(self, message, **fields):
+        self.log(LogLevels.DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        self.log(LogLevels.INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        self.log(LogLevels.WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        self.log(LogLevels.ERROR, message, **fields)
+
+    def progress(self, message):
+        """Show ``message`` on the console's progress line, unless the progress line was updated less than ``progress_interval`` seconds ago.
+        On a terminal, the line is overwritten in place. Elsewhere (like Alibre Script's console), each update is a new line."""
+        # type: (Logger, str) -> None
+        if self.console_level > LogLevels.INFO:
+            return
+        now = time.time()
+        with self._lock:
+            if self._last_progress_time is not None and now - self._last_progress_time < self.progress_interval:
+                return
+            self._last_progress_time = now
+            isatty = getattr(sys.stdout, "isatty", None)
+            if isatty is not None and isatty():
+                sys.stdout.write("\r" + message.ljust(self._progress_width))
+                sys.stdout.flush()
+                self._progress_width = len(message)
+            else:
+                print(message)
+
+    def flush(self):
+        """Write out everything the file sinks have buffered, and finish the progress line. Call this at the end of each run."""
+        # type: (Logger) -> None
+        with self._lock:
+            self._end_progress_line()
+            self._last_progress_time = None
+            for sink in self.sinks:
+                sink.flush()
+
+    def close(self):
+        """Flush and close every file sink."""
+        # type: (Logger) -> None
+        self.flush()
+        self.configure(self.console_level, self.progress_interval)
+
+    def _end_progress_line(self):
+        if self._progress_width > 0:
+            sys.stdout.write("\n")
+            self._progress_width = 0
+
+# Every message goes through this. AlibreNeutralizer configures it from the <Logging> settings.
+log = Logger()
+
+def get_shard_name(file_name, prefix_length):
+    """Return the name of the shard directory a file goes in: the first ``prefix_length`` hex digits of the SHA-1 of its name (UTF-8)."""
+    # type: (str, int) -> str
+    name = file_name if isinstance(file_name, bytes) else file_name.encode("utf-8")
+    return hashlib.sha1(name).hexdigest()[:prefix_length]
+
+def _sha256_of_file(file_path):
+    """Return the SHA-256 hex digest of a file, reading it through a memory map so the OS can page it in efficiently."""
+    # type: (str) -> str
+    chunk_size = 8 * 1024 * 1024
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return sha.hexdigest() # mmap can't map empty files
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # Some filesystems (e.g. certain network shares) can't be memory-mapped. Fall back to plain reads.
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                sha.update(chunk)
+            return sha.hexdigest()
+        try:
+            for offset in range(0, size, chunk_size):
+                sha.update(mapped[offset:offset + chunk_size])
+        finally:
+            mapped.close()
+    return sha.hexdigest()
+
+def _replace_file(source_path, destination_path):
+    """Move ``source_path`` to ``destination_path``, replacing it if it already exists.
+    On Windows, ``os.rename`` won't overwrite an existing file, so we remove it first."""
+    # type: (str, str) -> None
+    try:
+        os.rename(source_path, destination_path)
+    except OSError:
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        os.rename(source_path, destination_path)
+
+def link_tree(source_dir, destination_dir):
+    """Recreate the directory tree at ``source_dir`` in ``destination_dir``, hard-linking every file instead of copying it.
+    Files are copied instead where hard links aren't supported (e.g. some network shares, or Pythons without ``os.link``).
+
+    :return: ``(linked, copied)`` file counts.
+    :rtype: tuple[int, int]
+    """
+    # type: (str, str) -> tuple[int, int]
+    linked = 0
+    copied = 0
+    use_hard_links = hasattr(os, "link")
+    for root, _, files in os.walk(source_dir):
+        destination_root = os.path.join(destination_dir, os.path.relpath(root, source_dir))
+        if not os.path.isdir(destination_root):
+            os.makedirs(destination_root)
+        for file in files:
+            source_path = os.path.join(root, file)
+            destination_path = os.path.join(destination_root, file)
+            if use_hard_links:
+                try:
+                    os.link(source_path, destination_path)
+                    linked += 1
+                    continue
+                except OSError:
+                    use_hard_links = False # No point trying again for every file
+            shutil.copy2(source_path, destination_path)
+            copied += 1
+    return linked, copied
 
 class ExportTypes:
     """AlibreScript's IronPython interpreter doesn't have the Enum library available, so this was my best shot at fudging enum-ish behavior."""
@@ -22,11 +405,15 @@ class ExportTypes:
     IGES = 5
     CSV_Properties = 6
     CSV_Parameters = 7
+    GLB = 8
 
     # Static utility method
     @staticmethod
-    def get_file_extensions(export_type):
-        """Given an integer representing an export file type, return a list of possible file extensions corresponding to that export file type."""
+    def get_file_extensions(export_type, include_compressed=False):
+        """Given an integer representing an export file type, return a list of possible file extensions corresponding to that export file type.
+        With ``include_compressed``, gzip-compressed extensions (see ``get_compressed_file_extensions``) are included too."""
+        if include_compressed:
+            return ExportTypes.get_file_extensions(export_type) + ExportTypes.get_compressed_file_extensions(export_type)
         if (export_type == ExportTypes.STEP203) or (export_type == ExportTypes.STEP214):
             return [".stp", ".step"]
         elif (export_type == ExportTypes.SAT):
@@ -37,9 +424,22 @@ class ExportTypes:
             return [".iges", ".igs"]
         elif (export_type == ExportTypes.CSV_Properties) or (export_type == ExportTypes.CSV_Parameters):
             return [".csv"]
+        elif (export_type == ExportTypes.GLB):
+            return [".glb"]
         else:
             raise Exception("Invalid export type provided.")
     
+    @staticmethod
+    def get_compressed_file_extensions(export_type):
+        """Given an integer export type, return the extensions gzip-compressed files of that type can have (the first one is what we write).
+        Only STEP and IGES files can be compressed."""
+        if (export_type == ExportTypes.STEP203) or (export_type == ExportTypes.STEP214):
+            return [".stpZ", ".stp.gz", ".step.gz"]
+        elif (export_type == ExportTypes.IGES):
+            return [".igs.gz", ".iges.gz"]
+        else:
+            return []
+
     @staticmethod
     def convert_to_string(export_type):
         """Given an integer export type, return a string (like 'STEP203')."""
@@ -57,13 +457,206 @@ class ExportTypes:
             return "CSV of Component Properties"
         elif export_type == ExportTypes.CSV_Parameters:
             return "CSV of Component Parameters"
+        elif export_type == ExportTypes.GLB:
+            return "GLB"
+
+def _get_occurrence_state(occurrence):
+    """Return a ``(suppressed, hidden)`` tuple for an occurrence in an assembly. Either one is None if it can't be read.
+
+    Alibre Script's ``SuppressPart``/``HidePart`` family only lets you *set* the state, and the documented API has no read-only
+    counterpart, so this only works where the occurrence happens to expose a state property. See ``ComponentFilter.is_active_occurrence()``."""
+    # type: (AssembledPart | AssembledSubAssembly) -> tuple[bool | None, bool | None]
+    suppressed = None
+    for attribute_name in ("IsSuppressed", "Suppressed"):
+        value = getattr(occurrence, attribute_name, None)
+        if value is not None and not callable(value):
+            suppressed = bool(value)
+            break
+
+    hidden = None
+    for attribute_name, inverted in (("IsHidden", False), ("Hidden", False), ("IsVisible", True), ("Visible", True)):
+        value = getattr(occurrence, attribute_name, None)
+        if value is not None and not callable(value):
+            hidden = (not bool(value)) if inverted else bool(value)
+            break
+
+    return (suppressed, hidden)
+
+def _get_unsaved_changes(component):
+    """Return True if ``component`` has changes in this Alibre session that aren't saved to its native file, False if it doesn't,
+    or None if it can't be read.
+
+    Alibre Script's documented API has no way to ask, so like ``_get_occurrence_state()``, this only works where the component
+    happens to expose a modified flag."""
+    # type: (Part | AssembledPart) -> bool | None
+    for attribute_name in ("IsModified", "Modified", "IsDirty", "Dirty"):
+        value = getattr(component, attribute_name, None)
+        if value is not None and not callable(value):
+            return bool(value)
+    return None
+
+def _get_alibre_version():
+    """Return a string that changes whenever Alibre Design is upgraded: the version of the program we're running in, if .NET can tell us,
+    and otherwise the path and modification time of the Python executable (which is Alibre itself, in Alibre Script)."""
+    # type: () -> str
+    try:
+        import System.Diagnostics
+        return str(System.Diagnostics.Process.GetCurrentProcess().MainModule.FileVersionInfo.FileVersion)
+    except Exception:
+        pass # Not running in IronPython
+    try:
+        return "{0}@{1}".format(sys.executable, os.path.getmtime(sys.executable))
+    except (OSError, TypeError):
+        return "unknown"
+
+class ComponentPredicate:
+    """A single rule about an Alibre Property, like ``Supplier == "McMaster"`` or ``Product startswith "OTS-"``.
+    Rules are parsed (and regular expressions compiled) once, when the config file is loaded."""
+
+    # Property names that rules are allowed to reference. These are the same ones available in export path expressions.
+    PROPERTY_NAMES = [
+        "Comment", "CostCenter", "CreatedBy", "CreatedDate", "CreatingApplication", "Density", "Description",
+        "DocumentNumber", "EngineeringApprovalDate", "EngineeringApprovedBy", "EstimatedCost", "FileName", "Keywords",
+        "LastAuthor", "LastUpdateDate", "ManufacturingApprovedBy", "ModifiedInformation", "Name", "Number", "Product",
+        "ReceivedFrom", "Revision", "StockSize", "Supplier", "Title", "Vendor", "WebLink",
+    ]
+
+    OPERATORS = ["==", "!=", "startswith", "endswith", "contains", "matches"]
+
+    _RULE_PATTERN = re.compile(r'^\s*(\w+?)\s*(==|!=|startswith|endswith|contains|matches)\s*(?:"(.*)"|\'(.*)\')\s*$')
+
+    def __init__(self, rule):
+        # type: (ComponentPredicate, str) -> None
+        """
+        :param rule: The rule, in the form ``Property operator "value"``. Valid operators are ``==``, ``!=``,
+        ``startswith``, ``endswith``, ``contains``, and ``matches`` (a regular expression search).
+        :type rule: str
+        """
+        self.rule = rule.strip()
+        match = ComponentPredicate._RULE_PATTERN.match(self.rule)
+        if match is None:
+            raise Exception("Could not understand the component filter rule '{0}'. Expected something like: Supplier == \"McMaster\"".format(self.rule))
+
+        self.property_name = match.group(1)
+        self.operator = match.group(2)
+        self.value = match.group(3) if match.group(3) is not None else match.group(4)
+
+        if self.property_name not in ComponentPredicate.PROPERTY_NAMES:
+            raise Exception("Unknown property '{0}' in component filter rule '{1}'.".format(self.property_name, self.rule))
+
+        self._regex = re.compile(self.value) if self.operator == "matches" else None
+
+    def matches(self, component):
+        """Return True if ``component``'s property satisfies this rule. Missing properties are treated as empty strings."""
+        # type: (ComponentPredicate, Part | Assembly | AssembledPart | AssembledSubAssembly) -> bool
+        component_value = getattr(component, self.property_name, None)
+        component_value = u"" if component_value is None else u"{0}".format(component_value)
+
+        if self.operator == "==":
+            return component_value == self.value
+        elif self.operator == "!=":
+            return component_value != self.value
+        elif self.operator == "startswith":
+            return component_value.startswith(self.value)
+        elif self.operator == "endswith":
+            return component_value.endswith(self.value)
+        elif self.operator == "contains":
+            return self.value in component_value
+        else:
+            return self._regex.search(component_value) is not None
+
+class ComponentFilter:
+    """A set of Include, Exclude and TreatAsLeaf rules (``ComponentPredicate`` objects) that decide which components get exported.
+
+    - A component is included if it matches any Include rule (or there are no Include rules), and matches no Exclude rules.
+    - A subassembly that matches a TreatAsLeaf rule is exported itself, but nothing inside it is.
+    - An occurrence that's suppressed (or hidden, if ``skip_hidden`` is set) in its assembly is skipped, along with everything inside it."""
+
+    def __init__(self, include_rules=None, exclude_rules=None, leaf_rules=None, skip_suppressed=True, skip_hidden=False):
+        # type: (ComponentFilter, list[ComponentPredicate], list[ComponentPredicate], list[ComponentPredicate], bool, bool) -> None
+        self.include_rules = include_rules if include_rules is not None else []
+        self.exclude_rules = exclude_rules if exclude_rules is not None else []
+        self.leaf_rules = leaf_rules if leaf_rules is not None else []
+        self.skip_suppressed = skip_suppressed
+        self.skip_hidden = skip_hidden
+
+        # (parent assembly FileName, occurrence Name) -> (suppressed, hidden), so each occurrence's state is only read once per run
+        self._occurrence_states = {}
+        self._warned_about_unreadable_state = False
+
+    @staticmethod
+    def from_config_element(filters_elem, allow_leaf_rules=True):
+        """Build a ComponentFilter from a ``<ComponentFilters>`` config element. If the element is None, the filter includes everything.
+
+        :param allow_leaf_rules: Set to False where ``<TreatAsLeaf>`` doesn't make sense (inside an Export Directive), so it's rejected instead of silently ignored.
+        :type allow_leaf_rules: bool
+        """
+        # type: (ET.Element | None, bool) -> ComponentFilter
+        if filters_elem is None:
+            return ComponentFilter()
+
+        leaf_elems = filters_elem.findall('TreatAsLeaf')
+        if len(leaf_elems) > 0 and not allow_leaf_rules:
+            raise Exception("TreatAsLeaf rules are only allowed in the top-level ComponentFilters, not inside an Export Directive.")
+
+        return ComponentFilter(
+            include_rules=[ComponentPredicate(elem.text) for elem in filters_elem.findall('Include') if elem.text is not None],
+            exclude_rules=[ComponentPredicate(elem.text) for elem in filters_elem.findall('Exclude') if elem.text is not None],
+            leaf_rules=[ComponentPredicate(elem.text) for elem in leaf_elems if elem.text is not None],
+        )
+
+    def is_active_occurrence(self, occurrence, parent):
+        """Return False if this particular occurrence should be skipped because it's suppressed (or hidden) in ``parent``, the assembly containing it.
+
+        This is a property of the occurrence, not the component: the same part can be suppressed in one assembly and active in another,
+        so this must be checked before the occurrence's FileName is marked as processed. The state is read once per occurrence,
+        until ``clear_occurrence_states()`` is called. If it can't be read at all, the occurrence is treated as active, and we warn once."""
+        # type: (ComponentFilter, AssembledPart | AssembledSubAssembly, Assembly | AssembledSubAssembly) -> bool
+        if not (self.skip_suppressed or self.skip_hidden):
+            return True
+
+        key = (parent.FileName, occurrence.Name)
+        if key not in self._occurrence_states:
+            self._occurrence_states[key] = _get_occurrence_state(occurrence)
+        suppressed, hidden = self._occurrence_states[key]
+
+        if (self.skip_suppressed and suppressed is None) or (self.skip_hidden and hidden is None):
+            if not self._warned_about_unreadable_state:
+                self._warned_about_unreadable_state = True
+                log.warning(
+                    "This version of Alibre Script doesn't tell us whether components are suppressed or hidden, so they're being exported anyway. "
+                    "Set SkipSuppressedComponents and SkipHiddenComponents to false to silence this warning."
+                )
+        if self.skip_suppressed and suppressed:
+            return False
+        if self.skip_hidden and hidden:
+            return False
+        return True
+
+    def clear_occurrence_states(self):
+        """Forget the occurrence states read so far (and whether we've warned about them), so they're read again. Call this at the end of each run."""
+        # type: (ComponentFilter) -> None
+        self._occurrence_states = {}
+        self._warned_about_unreadable_state = False
+
+    def is_included(self, component):
+        """Return True if ``component`` passes the Include and Exclude rules."""
+        # type: (ComponentFilter, Part | Assembly | AssembledPart | AssembledSubAssembly) -> bool
+        if len(self.include_rules) > 0 and not any(rule.matches(component) for rule in self.include_rules):
+            return False
+        return not any(rule.matches(component) for rule in self.exclude_rules)
+
+    def is_leaf(self, component):
+        """Return True if ``component`` matches a TreatAsLeaf rule, meaning we shouldn't descend into it."""
+        # type: (ComponentFilter, Part | Assembly | AssembledPart | AssembledSubAssembly) -> bool
+        return any(rule.matches(component) for rule in self.leaf_rules)
 
 class ExportDirective:
     """Each instance of this directs AssemblyNeutralizer to export a particular type of file, with a particular relative path and filename.
     For example, a STEP214 export to ./whatever/relative/path/{FileName}_{Revision}.stp ."""
 
-    def __init__(self, export_type, export_rel_path_expression, purge_directory_before_export=None, export_root_assembly=True, export_subassemblies=True, export_parts=True):
-        # type: (ExportDirective, int, str, None | str, bool, bool, bool) -> None
+    def __init__(self, export_type, export_rel_path_expression, purge_directory_before_export=None, export_root_assembly=True, export_subassemblies=True, export_parts=True, component_filter=None, convert_stl_to_binary=False, validate_mesh=False, keep_unchanged_geometry=False, geometry_tolerance=None, lod_resolutions=None, package_path_expression=None, keep_packaged_stls=True, package_unit="millimeter", split_assembly_step=False, synthesize_assembly_step=False, compact_step=False, compress_output=False, compression_level=6, release_bundle_path=None, max_files_per_directory=None):
+        # type: (ExportDirective, int, str, None | str, bool, bool, bool, ComponentFilter | None, bool, bool, bool, float | None, list[int] | None, str | None, bool, str, bool, bool, bool, bool, int, str | None, int | None) -> None
         """
         Define a new Export Directive. You'll need one of these for each type of file you want to export.
 
@@ -85,6 +678,66 @@ class ExportDirective:
 
         :param export_parts: Set to False to skip exporting individual parts with this Export Directive.
         :type export_parts: bool
+
+        :param component_filter: Optional Include/Exclude rules, based on Alibre Properties, limiting which components this Export Directive exports.
+        If set to None (the default), every component is exported.
+        :type component_filter: ComponentFilter | None
+
+        :param convert_stl_to_binary: For STL directives, convert ASCII STL files from Alibre to the much smaller binary STL format.
+        :type convert_stl_to_binary: bool
+
+        :param validate_mesh: For STL directives, check each exported mesh for open boundaries, non-manifold edges, degenerate triangles and inconsistent winding.
+        :type validate_mesh: bool
+
+        :param keep_unchanged_geometry: For STL and STEP directives, keep the previously exported file if the new export has the same geometry,
+        so tiny floating point differences between exports don't show up as changes in version control.
+        :type keep_unchanged_geometry: bool
+
+        :param geometry_tolerance: How far apart two coordinates (or other STEP numbers) can be and still count as the same, for ``keep_unchanged_geometry``.
+        If set to None (the default), ``DEFAULT_GEOMETRY_TOLERANCE`` is used.
+        :type geometry_tolerance: float | None
+
+        :param lod_resolutions: For STL directives, write a simplified (decimated) copy of each STL for every resolution in this list, named like
+        ``{Number}.lod1.stl``, ``{Number}.lod2.stl``, etc. Each resolution is the number of grid cells along the longest side of the part; see ``decimate_stl()``.
+        :type lod_resolutions: list[int] | None
+
+        :param package_path_expression: For STL directives, also pack every part into 3MF build-plate packages, grouped by this path expression
+        (e.g. ``./3MF/{Supplier}.3mf``), with quantities from the assembly. If set to None (the default), no packages are written.
+        :type package_path_expression: str | None
+
+        :param keep_packaged_stls: Set to False to delete the loose STLs once they've been packed into 3MF packages.
+        :type keep_packaged_stls: bool
+
+        :param package_unit: The unit the STLs are in, for the 3MF packages. One of ``THREEMF_UNITS``.
+        :type package_unit: str
+
+        :param split_assembly_step: For STEP directives, export the root assembly once and split its STEP file into a file for each part and subassembly,
+        instead of asking Alibre to export every component separately. Components that can't be found in the assembly's STEP file are exported normally.
+        :type split_assembly_step: bool
+
+        :param synthesize_assembly_step: For STEP directives, build the root assembly STEP file out of the part STEP files,
+        instead of asking Alibre to translate every part again. Can't be used with ``split_assembly_step`` or ``export_subassemblies``.
+        :type synthesize_assembly_step: bool
+
+        :param compact_step: For STEP directives, merge duplicate points, directions and vectors, and renumber entities in a canonical order,
+        so files are smaller and don't change when Alibre numbers things differently. See ``compact_step_file()``.
+        :type compact_step: bool
+
+        :param compress_output: For STEP and IGES directives, gzip each exported file (to ``.stpZ`` or ``.igs.gz``, see ``get_compressed_export_path()``)
+        and delete the uncompressed file.
+        :type compress_output: bool
+
+        :param compression_level: The compression level for ``compress_output`` and ``release_bundle_path``, from 1 (fastest) to 9 (smallest).
+        :type compression_level: int
+
+        :param release_bundle_path: Set to a path (relative to the base export path, like ``./Releases/STEP.zip``) to also pack every file this directive
+        produces into a zip or tar.gz archive at the end of each run. See ``write_release_bundle()``. If set to None (the default), no bundle is written.
+        :type release_bundle_path: str | None
+
+        :param max_files_per_directory: If a directory would get more files than this from the directive, spread them into subdirectories
+        named after the start of a hash of each file name (see ``get_shard_name()``). If set to None (the default), files go exactly where
+        ``export_rel_path_expression`` says.
+        :type max_files_per_directory: int | None
         """
         # Core Export Settings
         
@@ -101,14 +754,74 @@ class ExportDirective:
         self.export_root_assembly = export_root_assembly
         self.export_subassemblies = export_subassemblies
         self.export_parts = export_parts
+
+        # Property-based rules for which components this directive applies to
+        self.component_filter = component_filter if component_filter is not None else ComponentFilter()
+
+        # Post-processing stages
+        if convert_stl_to_binary and export_type != ExportTypes.STL:
+            raise Exception("ConvertSTLToBinary can only be used with STL Export Directives.")
+        self.convert_stl_to_binary = convert_stl_to_binary
+        if validate_mesh and export_type != ExportTypes.STL:
+            raise Exception("ValidateMesh can only be used with STL Export Directives.")
+        self.validate_mesh = validate_mesh
+        if keep_unchanged_geometry and export_type not in (ExportTypes.STL, ExportTypes.STEP203, ExportTypes.STEP214):
+            raise Exception("KeepUnchangedGeometry can only be used with STL and STEP Export Directives.")
+        self.keep_unchanged_geometry = keep_unchanged_geometry
+        self.geometry_tolerance = geometry_tolerance if geometry_tolerance is not None else DEFAULT_GEOMETRY_TOLERANCE
+        self.lod_resolutions = list(lod_resolutions) if lod_resolutions is not None else []
+        if len(self.lod_resolutions) > 0 and export_type != ExportTypes.STL:
+            raise Exception("LevelsOfDetail can only be used with STL Export Directives.")
+        if any(resolution < 1 for resolution in self.lod_resolutions):
+            raise Exception("Every LevelsOfDetail Resolution must be at least 1.")
+        if package_path_expression is not None and export_type != ExportTypes.STL:
+            raise Exception("BuildPlatePackages can only be used with STL Export Directives.")
+        if package_unit not in THREEMF_UNITS:
+            raise Exception("Invalid BuildPlatePackages Unit '{0}'. Expected one of: {1}".format(package_unit, ", ".join(THREEMF_UNITS)))
+        self.package_path_expression = package_path_expression
+        self.keep_packaged_stls = keep_packaged_stls
+        self.package_unit = package_unit
+        if split_assembly_step and export_type not in (ExportTypes.STEP203, ExportTypes.STEP214):
+            raise Exception("SplitAssemblySTEP can only be used with STEP Export Directives.")
+        self.split_assembly_step = split_assembly_step
+        if synthesize_assembly_step and export_type not in (ExportTypes.STEP203, ExportTypes.STEP214):
+            raise Exception("SynthesizeAssemblySTEP can only be used with STEP Export Directives.")
+        if synthesize_assembly_step and split_assembly_step:
+            raise Exception("SplitAssemblySTEP and SynthesizeAssemblySTEP can't be used in the same Export Directive.")
+        if synthesize_assembly_step and export_subassemblies:
+            # Alibre Script only tells us where parts are in the root assembly, so a synthesized subassembly would come out flattened, in root coordinates
+            raise Exception("SynthesizeAssemblySTEP can't be used with subassembly export. Set EnableSubassemblyExport to false in this Export Directive, "
+                            "and export subassemblies with a separate directive if you need them.")
+        self.synthesize_assembly_step = synthesize_assembly_step
+        if export_type == ExportTypes.GLB and export_subassemblies:
+            # Same problem as SynthesizeAssemblySTEP: a subassembly's scene would come out in root coordinates
+            raise Exception("GLB Export Directives can't be used with subassembly export. Set EnableSubassemblyExport to false in this Export Directive.")
+        if compact_step and export_type not in (ExportTypes.STEP203, ExportTypes.STEP214):
+            raise Exception("CompactSTEP can only be used with STEP Export Directives.")
+        self.compact_step = compact_step
+        if compress_output and export_type not in (ExportTypes.STEP203, ExportTypes.STEP214, ExportTypes.IGES):
+            raise Exception("CompressOutput can only be used with STEP and IGES Export Directives.")
+        if compression_level < 1 or compression_level > 9:
+            raise Exception("The CompressionLevel must be between 1 and 9.")
+        self.compress_output = compress_output
+        self.compression_level = compression_level
+        if release_bundle_path is not None and get_release_bundle_format(release_bundle_path) is None:
+            raise Exception("Invalid ReleaseBundle Path '{0}'. Release bundles have to be .zip, .tar.gz or .tgz files.".format(release_bundle_path))
+        self.release_bundle_path = release_bundle_path
+        if max_files_per_directory is not None and max_files_per_directory < 1:
+            raise Exception("MaxFilesPerDirectory must be at least 1.")
+        self.max_files_per_directory = max_files_per_directory
     
-    def get_export_path(self, component):
+    def get_export_path(self, component, path_expression=None):
         """Given a Part or Subassembly or Assembly, return the relative Export path based on the expression in ``export_rel_path_expression``.
         
         :type self: ExportDirective
 
         :param component: The component (Part or Assembly) whose export path you want to evaluate.
         :type component: Assembly | Part | Subassembly | AssembledPart
+
+        :param path_expression: Evaluate this expression instead of ``export_rel_path_expression`` (e.g. for ``package_path_expression``).
+        :type path_expression: str | None
         """
         # A smidge of type enforcement
         if not (
@@ -122,8 +835,11 @@ class ExportDirective:
         # At this point we can safely assume we have an Alibre Part/Assembly
         component_properties_prettified = self.get_prettified_component_properties(component)
         
+        if path_expression is None:
+            path_expression = self.export_rel_path_expression
+
         path_unsanitized = os.path.normpath(
-            self.export_rel_path_expression.format(
+            path_expression.format(
                 Comment = component_properties_prettified["Comment"],
                 CostCenter = component_properties_prettified["CostCenter"],
                 CreatedBy = component_properties_prettified["CreatedBy"],
@@ -247,76 +963,2968 @@ class ExportDirective:
         
         return component_prettified_properties
 
+    def get_lod_export_paths(self, export_path):
+        """Given the path of an exported STL, return the paths of its levels of detail (one for each entry in ``lod_resolutions``)."""
+        # type: (ExportDirective, str) -> list[str]
+        stem, extension = os.path.splitext(export_path)
+        return ["{0}.lod{1}{2}".format(stem, i + 1, extension) for i in range(len(self.lod_resolutions))]
+
     def get_extensions_to_purge(self):
         """Return the list of extensions which should be purged before a new export.
         If the purge functionality is disabled, return an empty list."""
         # type: (ExportDirective) -> list[str]
+        # Compressed files are always purged, so they don't hang around after you turn compression off
         if self.purge_before_export == None:
             return [] # Returning an empty list means "purge no files"
+        elif self.package_path_expression is not None:
+            return ExportTypes.get_file_extensions(self.export_type, include_compressed=True) + [".3mf"]
         else:
-            return ExportTypes.get_file_extensions(self.export_type)
+            return ExportTypes.get_file_extensions(self.export_type, include_compressed=True)
 
-class AlibreNeutralizer:
-    """Create an instance of this, with an Alibre Assembly passed in, to handle the backend logic of recursively exporting files."""
+    def get_compressed_export_path(self, export_path):
+        """Given the path of an exported file, return the path of its compressed copy (``{Number}.stpZ`` for ``{Number}.stp``,
+        or ``{Number}.igs.gz`` for ``{Number}.igs``)."""
+        # type: (ExportDirective, str) -> str
+        if self.export_type in (ExportTypes.STEP203, ExportTypes.STEP214):
+            return os.path.splitext(export_path)[0] + ExportTypes.get_compressed_file_extensions(self.export_type)[0]
+        return export_path + ".gz"
 
-    def __init__(self, component, config_file_path):
-        # type: (AlibreNeutralizer, Assembly | AssembledSubAssembly, str) -> None
-        """Create and configure an instance of AlibreNeutralizer from an XML configuration file.
-        
-        :type self: AlibreNeutralizer
+class DependencyIndex:
+    """Reverse-dependency index of an assembly tree.
 
-        :param component: The top-level assembly that you want to recursively export.
-        :type component: Assembly | AssembledSubAssembly
+    Maps every component's ``FileName`` to the assemblies that directly contain it, so we can quickly work out
+    which assemblies are affected (and need re-exporting) when a single native file changes."""
 
-        :param config_file_path: Path to the XML configuration file that defines the export configuration.
-        :type config_file_path: str
+    def __init__(self, root_assembly, component_filter=None):
+        # type: (DependencyIndex, Assembly, ComponentFilter | None) -> None
+        """Walk ``root_assembly`` once and index every part and subassembly in it.
+
+        :param root_assembly: The top-level assembly to index.
+        :type root_assembly: Assembly
+
+        :param component_filter: Optional global filter. Excluded components (and everything inside excluded subassemblies) are left out
+        of the index, and leaf subassemblies are indexed without descending into them.
+        :type component_filter: ComponentFilter | None
         """
+        self.component_filter = component_filter if component_filter is not None else ComponentFilter()
+        self.root_file_name = root_assembly.FileName
 
-        # Store the root assembly or part, our main connection point to Alibre
-        if isinstance(component, Assembly):
-            self.root_component = component
+        # FileName -> the first component object we found with that FileName.
+        # Like export_all(), we use FileName rather than Name, since Name includes the instance ID ("<37>").
+        self.components = {self.root_file_name : root_assembly}
+
+        # FileName -> set of FileNames of the assemblies that directly contain it (the root has no parents)
+        self.parents = {self.root_file_name : set()}
+
+        # FileName -> shallowest nesting depth we found it at (the root is depth 0)
+        self.depths = {self.root_file_name : 0}
+
+        # FileNames of every assembly (root and subassemblies) in the tree
+        self.assemblies = set()
+
+        # Assembly FileName -> FileNames of the occurrences directly inside it, with one entry per occurrence
+        self.occurrences = {}
+
+        self._index_assembly(root_assembly, 0)
+
+    def _index_assembly(self, assembly, depth):
+        """Recursively add the contents of ``assembly`` to the index. Each subassembly is only descended into once."""
+        # type: (DependencyIndex, Assembly | AssembledSubAssembly, int) -> None
+        self.assemblies.add(assembly.FileName)
+        occurrences = self.occurrences[assembly.FileName] = []
+
+        for part in assembly.Parts:
+            if self.component_filter.is_active_occurrence(part, assembly) and self.component_filter.is_included(part):
+                self._add(part, assembly.FileName, depth + 1)
+                occurrences.append(part.FileName)
+
+        for subassy in assembly.SubAssemblies:
+            if not (self.component_filter.is_active_occurrence(subassy, assembly) and self.component_filter.is_included(subassy)):
+                continue
+            first_visit = subassy.FileName not in self.components
+            self._add(subassy, assembly.FileName, depth + 1)
+            occurrences.append(subassy.FileName)
+            if self.component_filter.is_leaf(subassy):
+                # We still consider it an assembly, we just don't look inside it
+                self.assemblies.add(subassy.FileName)
+            elif first_visit:
+                self._index_assembly(subassy, depth + 1)
+
+    def _add(self, component, parent_file_name, depth):
+        # type: (DependencyIndex, AssembledPart | AssembledSubAssembly, str, int) -> None
+        if component.FileName not in self.components:
+            self.components[component.FileName] = component
+            self.parents[component.FileName] = set()
+            self.depths[component.FileName] = depth
+        self.parents[component.FileName].add(parent_file_name)
+        self.depths[component.FileName] = min(self.depths[component.FileName], depth)
+
+    def get_quantities(self):
+        """Return how many times each component appears in the whole tree, keyed by FileName. Everything inside a subassembly is counted
+        once for every occurrence of that subassembly, so two copies of a subassembly with four screws each means eight screws."""
+        # type: (DependencyIndex) -> dict[str, int]
+        contents = {} # Assembly FileName -> {FileName : quantity inside one copy of that assembly}
+
+        def _get_contents(file_name):
+            if file_name not in contents:
+                totals = {}
+                for child_file_name in self.occurrences.get(file_name, []):
+                    totals[child_file_name] = totals.get(child_file_name, 0) + 1
+                    for grandchild_file_name, quantity in _get_contents(child_file_name).items():
+                        totals[grandchild_file_name] = totals.get(grandchild_file_name, 0) + quantity
+                contents[file_name] = totals
+            return contents[file_name]
+
+        return dict(_get_contents(self.root_file_name))
+
+    def get_native_file_names(self):
+        """Return the FileNames of every component in the tree, including the root assembly."""
+        # type: (DependencyIndex) -> list[str]
+        return list(self.components.keys())
+
+    def get_ancestors(self, file_name):
+        """Return the FileNames of every assembly that contains ``file_name`` at any level, up to and including the root."""
+        # type: (DependencyIndex, str) -> set[str]
+        ancestors = set()
+        to_visit = list(self.parents.get(file_name, set()))
+        while to_visit:
+            parent = to_visit.pop()
+            if parent not in ancestors:
+                ancestors.add(parent)
+                to_visit.extend(self.parents.get(parent, set()))
+        return ancestors
+
+    def get_affected_file_names(self, changed_file_names):
+        """Given some changed FileNames, return them plus all of their ancestor assemblies, ordered so that
+        parts come first, then subassemblies from the deepest up, and the root assembly last.
+        FileNames that aren't part of this tree are ignored."""
+        # type: (DependencyIndex, set[str]) -> list[str]
+        affected = set()
+        for file_name in changed_file_names:
+            if file_name in self.components:
+                affected.add(file_name)
+                affected = affected.union(self.get_ancestors(file_name))
+
+        def _sort_key(file_name):
+            return (file_name in self.assemblies, -self.depths[file_name], file_name)
+
+        return sorted(affected, key=_sort_key)
+
+class ExportCache:
+    """A machine-wide cache of exported neutral files, shared by every project (and every simultaneous run) on this computer.
+
+    Entries are keyed by a hash of the native part file's bytes, plus the export type and options and the Alibre version, so the same
+    fastener used in a dozen repositories is only translated by Alibre once. Entries are written to a temporary file and renamed into place,
+    so a concurrent run never sees a partial entry. The cache size is bounded, and the least-recently-used entries are evicted first.
+
+    Only parts are cached: an assembly file doesn't contain its parts' geometry, so its bytes alone can't tell us whether its export changed.
+    Alibre exports the part as it is in the session, not as it's saved, so parts with unsaved changes (or that we can't tell about) aren't cached either."""
+
+    # Bump this if the way we export files changes, so old cache entries stop matching
+    CACHE_FORMAT_VERSION = 1
+
+    # Export types whose output depends only on the native file (CSV exports are cheap and come from the in-memory component, so they're never cached)
+    CACHEABLE_EXPORT_TYPES = [ExportTypes.STEP203, ExportTypes.STEP214, ExportTypes.SAT, ExportTypes.IGES, ExportTypes.STL]
+
+    # A lock file older than this is assumed to be left over from a crashed run
+    STALE_LOCK_SECONDS = 120
+
+    def __init__(self, cache_dir, max_size_bytes, use_hard_links=False):
+        # type: (ExportCache, str, int, bool) -> None
+        """
+        :param cache_dir: Directory to store cache entries in. It's created if it doesn't exist.
+        :type cache_dir: str
+
+        :param max_size_bytes: Once the cache grows past this size, the least-recently-used entries are deleted.
+        :type max_size_bytes: int
+
+        :param use_hard_links: Hard-link cache entries into the export directory instead of copying them, where the filesystem supports it.
+        The cache must be on the same volume as the exports for this to work; otherwise we fall back to copying.
+        :type use_hard_links: bool
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.use_hard_links = use_hard_links and hasattr(os, "link")
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # native file path -> (size, mtime, sha256 hex digest), so we only hash each native file once per run
+        self._native_hashes = {}
+
+        # Alibre's translators change between versions, so their exports can't be mixed
+        self._alibre_version = _get_alibre_version()
+        self._warned_about_unreadable_saved_state = False
+
+        # Approximate total size of the cache. Other runs may be adding to it too, so we re-measure it whenever we evict.
+        self._approximate_size = self._measure_size()
+
+    def get_key(self, component, export_type, options=""):
+        """Return the cache key for exporting ``component`` to ``export_type``, or None if this export can't be cached.
+
+        :param options: Any export options that affect the output (e.g. the SAT file version), as a string.
+        :type options: str
+        """
+        # type: (ExportCache, Part | AssembledPart, int, str) -> str | None
+        if export_type not in ExportCache.CACHEABLE_EXPORT_TYPES:
+            return None
+        if not (isinstance(component, Part) or isinstance(component, AssembledPart)):
+            return None
+
+        unsaved_changes = _get_unsaved_changes(component)
+        if unsaved_changes:
+            log.debug("- Not using the export cache, since {0} has unsaved changes".format(component.FileName))
+            return None
+        if unsaved_changes is None:
+            if not self._warned_about_unreadable_saved_state:
+                self._warned_about_unreadable_saved_state = True
+                log.warning("This version of Alibre Script doesn't tell us whether parts have unsaved changes, so the export cache isn't used.")
+            return None
+
+        native_hash = self._get_native_file_hash(component.FileName)
+        if native_hash is None:
+            return None
+
+        key_source = "{version}|{alibre_version}|{export_type}|{options}|{native_hash}".format(
+            version=ExportCache.CACHE_FORMAT_VERSION,
+            alibre_version=self._alibre_version,
+            export_type=ExportTypes.convert_to_string(export_type),
+            options=options,
+            native_hash=native_hash
+        )
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def fetch(self, key, export_path_abs):
+        """If there's a cache entry for ``key``, put a copy of it (or a hard link to it) at ``export_path_abs`` and return True.
+        Otherwise return False."""
+        # type: (ExportCache, str, str) -> bool
+        entry_path = self._get_entry_path(key, export_path_abs)
+        if not os.path.isfile(entry_path):
+            return False
+
+        try:
+            if os.path.exists(export_path_abs):
+                os.remove(export_path_abs)
+            linked = False
+            if self.use_hard_links:
+                try:
+                    os.link(entry_path, export_path_abs)
+                    linked = True
+                except OSError:
+                    pass # e.g. the cache is on a different volume
+            if not linked:
+                shutil.copyfile(entry_path, export_path_abs)
+            # Mark the entry as recently used, for LRU eviction
+            os.utime(entry_path, None)
+            return True
+        except (IOError, OSError):
+            # Most likely another run evicted the entry out from under us. Treat it as a miss.
+            return False
+
+    def store(self, key, export_path_abs):
+        """Add a freshly-exported file to the cache under ``key``, then evict old entries if the cache is too big."""
+        # type: (ExportCache, str, str) -> None
+        entry_path = self._get_entry_path(key, export_path_abs)
+        entry_dir = os.path.dirname(entry_path)
+        temp_path = "{0}.{1}.{2}.tmp".format(entry_path, os.getpid(), int(time.time() * 1000000))
+
+        try:
+            if not os.path.exists(entry_dir):
+                os.makedirs(entry_dir)
+            shutil.copyfile(export_path_abs, temp_path)
+            try:
+                os.rename(temp_path, entry_path)
+                self._approximate_size += os.path.getsize(entry_path)
+            except OSError:
+                # Another run stored the same entry first (on Windows, rename won't overwrite). Theirs is just as good.
+                os.remove(temp_path)
+        except (IOError, OSError) as e:
+            log.warning("Could not add {0} to the export cache: {1}".format(export_path_abs, e), path=export_path_abs)
+            return
+
+        if self._approximate_size > self.max_size_bytes:
+            self._evict()
+
+    def _get_native_file_hash(self, native_file_path):
+        # type: (ExportCache, str) -> str | None
+        try:
+            stat = os.stat(native_file_path)
+        except (OSError, TypeError):
+            return None # e.g. no FileName when working from PDM
+
+        cached = self._native_hashes.get(native_file_path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+
+        native_hash = _sha256_of_file(native_file_path)
+        self._native_hashes[native_file_path] = (stat.st_size, stat.st_mtime, native_hash)
+        return native_hash
+
+    def _get_entry_path(self, key, export_path_abs):
+        # type: (ExportCache, str, str) -> str
+        # Keep the extension, so entries for .stp and .step exports of the same file don't collide, and the cache is browsable.
+        # The first two characters of the key are used as a subdirectory, to keep directory sizes sane.
+        extension = os.path.splitext(export_path_abs)[1].lower()
+        return os.path.join(self.cache_dir, key[:2], key + extension)
+
+    def _measure_size(self):
+        # type: (ExportCache) -> int
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, file))
+                except OSError:
+                    pass
+        return total
+
+    def _evict(self):
+        """Delete least-recently-used entries until the cache is under 90% of its maximum size.
+        Only one run evicts at a time. If another run holds the lock, we leave the eviction to it."""
+        # type: (ExportCache) -> None
+        lock_path = os.path.join(self.cache_dir, "evict.lock")
+        try:
+            if os.path.exists(lock_path) and (time.time() - os.path.getmtime(lock_path)) > ExportCache.STALE_LOCK_SECONDS:
+                os.remove(lock_path)
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            return
+
+        try:
+            entries = []
+            for root, _, files in os.walk(self.cache_dir):
+                for file in files:
+                    if file.endswith(".tmp") or file == "evict.lock":
+                        continue
+                    entry_path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(entry_path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_size_bytes * 0.9)
+            for _, size, entry_path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(entry_path)
+                    total -= size
+                except OSError:
+                    pass # In use by another run; try the next one
+            self._approximate_size = total
+        finally:
+            os.close(lock_fd)
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+# -- STL MESH I/O --
+# Everything that reads or writes STL files goes through the functions and classes below.
+# With NumPy, triangles come and go as structured arrays of STL_TRIANGLE_DTYPE, which for binary files are views straight over a memory map.
+# Without NumPy (e.g. in Alibre Script's IronPython), triangles are tuples of 12 floats: the normal, then the three vertices.
+
+# Binary STL layout: an 80-byte header, a little-endian uint32 triangle count, then 50 bytes per triangle
+# (normal, 3 vertices, and a 2-byte "attribute byte count" that's almost always 0)
+STL_HEADER_SIZE = 84
+STL_TRIANGLE_SIZE = 50
+_STL_TRIANGLE_STRUCT = struct.Struct("<12fH")
+STL_TRIANGLE_DTYPE = numpy.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")]) if numpy is not None else None
+
+# How many triangles to process at once when streaming through a mesh (about 50 MB of binary STL)
+STL_CHUNK_TRIANGLES = 1024 * 1024
+
+# A fixed header, so converting the same mesh always gives byte-for-byte identical files. It must not start with "solid",
+# or some readers will mistake the file for ASCII.
+STL_BINARY_HEADER = b"Binary STL written by Alibre Neutralizer".ljust(80, b" ")
+
+# In an ASCII STL, every facet is exactly these 21 whitespace-separated tokens:
+# facet normal nx ny nz outer loop vertex x y z vertex x y z vertex x y z endloop endfacet
+_ASCII_STL_FACET_TOKENS = 21
+_ASCII_STL_NUMBER_COLUMNS = [2, 3, 4, 8, 9, 10, 12, 13, 14, 16, 17, 18]
+_ASCII_STL_KEYWORD_COLUMNS = [(0, b"facet"), (1, b"normal"), (5, b"outer"), (6, b"loop"), (7, b"vertex"), (11, b"vertex"), (15, b"vertex"), (19, b"endloop"), (20, b"endfacet")]
+
+def is_binary_stl(stl_path):
+    """Return True if the file at ``stl_path`` is a binary STL. We go by the file size, since binary headers often start with "solid" too."""
+    # type: (str) -> bool
+    size = os.path.getsize(stl_path)
+    if size < STL_HEADER_SIZE:
+        return False
+    with open(stl_path, 'rb') as stl_file:
+        stl_file.seek(80)
+        triangle_count = struct.unpack("<I", stl_file.read(4))[0]
+    return size == STL_HEADER_SIZE + triangle_count * STL_TRIANGLE_SIZE
+
+class BinaryStlReader:
+    """Opens a binary STL for reading without parsing it triangle by triangle.
+
+    With NumPy, ``get_triangles()`` returns the whole mesh as a structured array that's a view over a memory map of the file,
+    so nothing is copied or parsed until it's used, and ``iter_chunks()`` yields copies of one chunk of that view at a time.
+    Without NumPy, ``iter_chunks()`` reads and unpacks the file one chunk at a time.
+
+    Close the reader (or use it in a ``with`` block) before replacing the file, since Windows won't replace a memory-mapped file.
+    Drop any array returned by ``get_triangles()`` before closing: ``close()`` raises ``BufferError`` if a view of the map is still alive,
+    rather than leaving the file mapped (and locked) until the view is garbage collected."""
+
+    def __init__(self, stl_path):
+        # type: (BinaryStlReader, str) -> None
+        self.stl_path = stl_path
+        self._file = open(stl_path, 'rb')
+        self.header = self._file.read(80)
+        self.triangle_count = struct.unpack("<I", self._file.read(4))[0]
+        if os.fstat(self._file.fileno()).st_size < STL_HEADER_SIZE + self.triangle_count * STL_TRIANGLE_SIZE:
+            self._file.close()
+            raise ValueError("{0} is not a valid binary STL (the file is shorter than its triangle count says).".format(stl_path))
+        self._mmap = None
+
+    def get_triangles(self):
+        """Return every triangle as a structured array of ``STL_TRIANGLE_DTYPE``, viewing the file through a memory map. Requires NumPy."""
+        # type: (BinaryStlReader) -> numpy.ndarray
+        if numpy is None:
+            raise Exception("BinaryStlReader.get_triangles() requires NumPy. Use iter_chunks() instead.")
+        if self.triangle_count == 0:
+            return numpy.zeros(0, dtype=STL_TRIANGLE_DTYPE)
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return numpy.frombuffer(self._mmap, dtype=STL_TRIANGLE_DTYPE, count=self.triangle_count, offset=STL_HEADER_SIZE)
+
+    def iter_chunks(self, chunk_triangles=STL_CHUNK_TRIANGLES):
+        """Yield the triangles in chunks of up to ``chunk_triangles``: structured array views with NumPy, or lists of 12-float tuples without it."""
+        # type: (BinaryStlReader, int) -> iterator
+        if numpy is not None:
+            triangles = self.get_triangles()
+            try:
+                for start in range(0, self.triangle_count, chunk_triangles):
+                    # Copy each chunk, so nothing the caller keeps refers to the memory map once the reader is closed.
+                    yield triangles[start:start + chunk_triangles].copy()
+            finally:
+                del triangles
+            return
+
+        self._file.seek(STL_HEADER_SIZE)
+        unpack_from = _STL_TRIANGLE_STRUCT.unpack_from
+        remaining = self.triangle_count
+        while remaining > 0:
+            count = min(chunk_triangles, remaining)
+            data = self._file.read(count * STL_TRIANGLE_SIZE)
+            yield [unpack_from(data, i * STL_TRIANGLE_SIZE)[:12] for i in range(count)]
+            remaining -= count
+
+    def close(self):
+        # type: (BinaryStlReader) -> None
+        # If a view of the map is still alive, mmap.close() raises BufferError. Let it propagate (the file handle still gets closed).
+        try:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def iter_stl_triangle_chunks(stl_path, chunk_triangles=STL_CHUNK_TRIANGLES):
+    """Yield the triangles of any STL file (binary or ASCII) in chunks, in the same form as ``BinaryStlReader.iter_chunks()``.
+    Only one chunk is in memory at a time (plus the memory map, for binary files with NumPy)."""
+    # type: (str, int) -> iterator
+    if is_binary_stl(stl_path):
+        with BinaryStlReader(stl_path) as reader:
+            for chunk in reader.iter_chunks(chunk_triangles):
+                yield chunk
+        return
+
+    with open(stl_path, 'rb') as ascii_file:
+        for facets in _iter_ascii_stl_facet_numbers(ascii_file):
+            yield _float_rows_to_triangles(facets)
+
+def get_triangle_vertices(chunk):
+    """Return just the vertices of a chunk of triangles: an (N, 3, 3) float64 array with NumPy, or a list of ``(v1, v2, v3)`` tuples of 3-tuples without it."""
+    if numpy is not None:
+        return chunk["vertices"].astype(numpy.float64)
+    return [(triangle[3:6], triangle[6:9], triangle[9:12]) for triangle in chunk]
+
+def read_stl_vertices(stl_path):
+    """Read every triangle's vertices from an STL file, in the form returned by ``get_triangle_vertices()``.
+    Unlike the chunked functions, this holds the whole mesh in memory, so only use it for stages that need to see the whole mesh at once."""
+    # type: (str) -> numpy.ndarray | list
+    chunks = [get_triangle_vertices(chunk) for chunk in iter_stl_triangle_chunks(stl_path)]
+    if numpy is not None:
+        return numpy.concatenate(chunks) if chunks else numpy.zeros((0, 3, 3))
+    return [triangle for chunk in chunks for triangle in chunk]
+
+def _float_rows_to_triangles(rows):
+    """Convert rows of 12 numbers (as numbers or numeric byte strings) to a chunk of triangles.
+    Numbers are parsed as float64 and then rounded to float32, which gives exactly the same bytes as ``struct.pack`` would."""
+    if numpy is not None:
+        values = numpy.asarray(rows).astype(numpy.float64).astype("<f4").reshape(-1, 12)
+        triangles = numpy.zeros(len(values), dtype=STL_TRIANGLE_DTYPE)
+        triangles["normal"] = values[:, 0:3]
+        triangles["vertices"] = values[:, 3:12].reshape(-1, 3, 3)
+        return triangles
+    return [tuple(float(value) for value in row) for row in rows]
+
+def _iter_ascii_stl_facet_numbers(stl_file, block_size=16 * 1024 * 1024):
+    """Read an ASCII STL in blocks, and yield lists of facets, each facet being 12 numbers (as byte strings):
+    the normal followed by the three vertices. Only one block is in memory at a time, so this works on files larger than RAM."""
+    # type: (file, int) -> iterator[list[list[bytes]]]
+    leftover = b""
+    tokens = []
+    seen_first_facet = False
+    while True:
+        block = stl_file.read(block_size)
+        if block:
+            # Don't split a token across blocks: hold back everything after the last whitespace
+            data = leftover + block
+            cut = max(data.rfind(b" "), data.rfind(b"\n"), data.rfind(b"\r"), data.rfind(b"\t"))
+            if cut < 0:
+                leftover = data
+                continue
+            leftover = data[cut:]
+            tokens.extend(data[:cut].split())
         else:
-            raise Exception("Cannot initialize AssemblyNeutralizer without a valid Alibre Assembly object.")
+            tokens.extend(leftover.split())
 
-        # Read the configuration file
-        tree = ET.parse(config_file_path)
-        root = tree.getroot()
-        
-        # Store the config file path.
-        # This is used to interpret the "Base Path" from the config file, since it's specified RELATIVE to the config file's location.
-        self.config_file_path = config_file_path
-        # Get the base path from config
-        base_path_elem = root.find('BaseExportPath')
-        self.base_path = os.path.normpath(base_path_elem.text) if base_path_elem is not None and base_path_elem.text is not None else os.path.normpath('.')
-        
-        # Parse export directives from config
-        self.export_directives = []
-        for directive in root.find('ExportDirectiveList').findall('ExportDirective'):
-            export_type = getattr(ExportTypes, directive.find('type').text)
-            path_expression = directive.find('RelativeExportPath').text
-            purge_directory = directive.find('PurgeDirectoryBeforeExporting').text if directive.find('PurgeDirectoryBeforeExporting') is not None else None
+        if not seen_first_facet:
+            # Skip the "solid <name>" line. The name can contain spaces, so look for the first "facet" token.
+            try:
+                tokens = tokens[tokens.index(b"facet"):]
+                seen_first_facet = True
+            except ValueError:
+                tokens = []
+                if not block:
+                    return
+                continue
 
-            # Read boolean flags (default to True if the element is missing)
-            def _bool_from_elem(elem, default=True):
-                if elem is None or elem.text is None:
-                    return default
-                val = elem.text.strip().lower()
-                return val in ("true", "1", "yes", "y")
+        facet_count = len(tokens) // _ASCII_STL_FACET_TOKENS
+        if numpy is not None and facet_count > 0:
+            # Vectorized: view the tokens as a (facets, 21) table, check the keyword columns, and slice out the number columns
+            table = numpy.array(tokens[:facet_count * _ASCII_STL_FACET_TOKENS]).reshape(facet_count, _ASCII_STL_FACET_TOKENS)
+            for column, keyword in _ASCII_STL_KEYWORD_COLUMNS:
+                if not numpy.all(numpy.char.lower(table[:, column]) == keyword):
+                    raise ValueError("Unsupported ASCII STL layout: expected '{0}' in every facet".format(keyword))
+            tokens = tokens[facet_count * _ASCII_STL_FACET_TOKENS:]
+            yield table[:, _ASCII_STL_NUMBER_COLUMNS]
+            facet_count = 0
 
-            enable_root = _bool_from_elem(directive.find('EnableRootAssemblyExport'), True)
-            enable_sub = _bool_from_elem(directive.find('EnableSubassemblyExport'), True)
-            enable_part = _bool_from_elem(directive.find('EnablePartExport'), True)
+        facets = []
+        for i in range(facet_count):
+            facet = tokens[i * _ASCII_STL_FACET_TOKENS:(i + 1) * _ASCII_STL_FACET_TOKENS]
+            for column, keyword in _ASCII_STL_KEYWORD_COLUMNS:
+                if facet[column].lower() != keyword:
+                    raise ValueError("Unsupported ASCII STL layout near facet {0}: expected '{1}'".format(i, keyword))
+            facets.append([facet[column] for column in _ASCII_STL_NUMBER_COLUMNS])
+        tokens = tokens[facet_count * _ASCII_STL_FACET_TOKENS:]
+        if facets:
+            yield facets
 
-            self.export_directives.append(
-                ExportDirective(
-                    export_type=export_type,
-                    export_rel_path_expression=path_expression,
-                    purge_directory_before_export=purge_directory,
-                    export_root_assembly=enable_root,
-                    export_subassemblies=enable_sub,
-                    export_parts=enable_part
+        if not block:
+            # Anything left should just be "endsolid <name>"
+            if len(tokens) > 0 and tokens[0].lower() != b"endsolid":
+                raise ValueError("Unexpected data at the end of the ASCII STL: {0}".format(tokens[0]))
+            return
+
+class BinaryStlWriter:
+    """Streams triangles into a binary STL file, so we never need the whole mesh in memory.
+    The triangle count in the header is filled in when the writer is closed."""
+
+    def __init__(self, stl_path, header=STL_BINARY_HEADER):
+        # type: (BinaryStlWriter, str, bytes) -> None
+        self.stl_path = stl_path
+        self.triangle_count = 0
+        self._file = open(stl_path, 'wb')
+        self._file.write(header[:80].ljust(80, b" "))
+        self._file.write(struct.pack("<I", 0))
+
+    def write_triangles(self, chunk):
+        """Write a chunk of triangles: a structured array of ``STL_TRIANGLE_DTYPE`` (written straight to disk), or a list of 12-float tuples."""
+        # type: (BinaryStlWriter, numpy.ndarray | list[tuple]) -> None
+        if len(chunk) == 0:
+            return
+        if numpy is not None and isinstance(chunk, numpy.ndarray):
+            self._file.write(numpy.ascontiguousarray(chunk, dtype=STL_TRIANGLE_DTYPE).tobytes())
+        else:
+            pack = _STL_TRIANGLE_STRUCT.pack
+            self._file.write(b"".join(pack(*(tuple(triangle[:12]) + (0,))) for triangle in chunk))
+        self.triangle_count += len(chunk)
+
+    def write_float_rows(self, rows):
+        """Write triangles given as rows of 12 numbers (normal, vertex 1, vertex 2, vertex 3), as numbers or numeric byte strings.
+        The attribute byte count of every triangle is 0."""
+        # type: (BinaryStlWriter, list[list[float | bytes]]) -> None
+        self.write_triangles(_float_rows_to_triangles(rows))
+
+    def close(self):
+        # type: (BinaryStlWriter) -> None
+        self._file.seek(80)
+        self._file.write(struct.pack("<I", self.triangle_count))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def convert_ascii_stl_to_binary(stl_path):
+    """If ``stl_path`` is an ASCII STL, replace it with the equivalent binary STL. Binary files are left alone.
+
+    The conversion streams through the file in blocks, so it works on files larger than RAM, and is vectorized with NumPy when it's available.
+    The output is deterministic: converting the same ASCII file always gives exactly the same bytes, with or without NumPy.
+
+    :return: True if the file was converted, False if it was already binary.
+    :rtype: bool
+    """
+    # type: (str) -> bool
+    if is_binary_stl(stl_path):
+        return False
+
+    temp_path = stl_path + ".binary.tmp"
+    try:
+        with open(stl_path, 'rb') as ascii_file:
+            with BinaryStlWriter(temp_path) as writer:
+                for facets in _iter_ascii_stl_facet_numbers(ascii_file):
+                    writer.write_float_rows(facets)
+        _replace_file(temp_path, stl_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+# -- MESH STATISTICS --
+
+# Columns of the mesh statistics report. Units are whatever units Alibre exported the STL in.
+MESH_STATISTICS_COLUMNS = [
+    "Number", "Path", "TriangleCount",
+    "MinX", "MinY", "MinZ", "MaxX", "MaxY", "MaxZ",
+    "SurfaceArea", "Volume", "CentroidX", "CentroidY", "CentroidZ",
+]
+
+def compute_stl_statistics(stl_path):
+    """Compute the triangle count, axis-aligned bounding box, surface area, signed volume and centroid of an STL file.
+
+    The mesh is streamed in chunks, and each chunk is processed with vectorized NumPy where it's available.
+    The volume is the signed volume of the tetrahedra formed by each triangle and the origin, so it's only meaningful for closed meshes,
+    and is negative if the mesh is inside-out. The centroid is the volume centroid, or the area centroid if the volume is zero (e.g. an open surface).
+
+    :return: A dictionary with keys matching ``MESH_STATISTICS_COLUMNS`` (except Number and Path).
+    :rtype: dict
+    """
+    # type: (str) -> dict
+    triangle_count = 0
+    bbox_min = [float("inf")] * 3
+    bbox_max = [float("-inf")] * 3
+    area = 0.0
+    volume = 0.0
+    volume_moment = [0.0, 0.0, 0.0] # sum of (signed tetrahedron volume * tetrahedron centroid)
+    area_moment = [0.0, 0.0, 0.0] # sum of (triangle area * triangle centroid)
+
+    for chunk in iter_stl_triangle_chunks(stl_path):
+        vertices = get_triangle_vertices(chunk)
+        triangle_count += len(vertices)
+        if len(vertices) == 0:
+            continue
+
+        if numpy is not None:
+            a, b, c = vertices[:, 0], vertices[:, 1], vertices[:, 2]
+            flat = vertices.reshape(-1, 3)
+            bbox_min = numpy.minimum(bbox_min, flat.min(axis=0)).tolist()
+            bbox_max = numpy.maximum(bbox_max, flat.max(axis=0)).tolist()
+
+            triangle_areas = 0.5 * numpy.linalg.norm(numpy.cross(b - a, c - a), axis=1)
+            tetrahedron_volumes = numpy.einsum("ij,ij->i", a, numpy.cross(b, c)) / 6.0
+            triangle_sums = a + b + c
+            area += float(triangle_areas.sum())
+            volume += float(tetrahedron_volumes.sum())
+            volume_moment = (numpy.array(volume_moment) + (tetrahedron_volumes[:, None] * triangle_sums / 4.0).sum(axis=0)).tolist()
+            area_moment = (numpy.array(area_moment) + (triangle_areas[:, None] * triangle_sums / 3.0).sum(axis=0)).tolist()
+        else:
+            for a, b, c in vertices:
+                for axis in range(3):
+                    bbox_min[axis] = min(bbox_min[axis], a[axis], b[axis], c[axis])
+                    bbox_max[axis] = max(bbox_max[axis], a[axis], b[axis], c[axis])
+                ab = (b[0] - a[0], b[1] - a[1], b[2] - a[2])
+                ac = (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+                normal = (ab[1] * ac[2] - ab[2] * ac[1], ab[2] * ac[0] - ab[0] * ac[2], ab[0] * ac[1] - ab[1] * ac[0])
+                triangle_area = 0.5 * (normal[0] ** 2 + normal[1] ** 2 + normal[2] ** 2) ** 0.5
+                b_cross_c = (b[1] * c[2] - b[2] * c[1], b[2] * c[0] - b[0] * c[2], b[0] * c[1] - b[1] * c[0])
+                tetrahedron_volume = (a[0] * b_cross_c[0] + a[1] * b_cross_c[1] + a[2] * b_cross_c[2]) / 6.0
+                area += triangle_area
+                volume += tetrahedron_volume
+                for axis in range(3):
+                    triangle_sum = a[axis] + b[axis] + c[axis]
+                    volume_moment[axis] += tetrahedron_volume * triangle_sum / 4.0
+                    area_moment[axis] += triangle_area * triangle_sum / 3.0
+
+    if triangle_count == 0:
+        bbox_min = bbox_max = [0.0, 0.0, 0.0]
+    if volume != 0.0:
+        centroid = [moment / volume for moment in volume_moment]
+    elif area != 0.0:
+        centroid = [moment / area for moment in area_moment]
+    else:
+        centroid = [0.0, 0.0, 0.0]
+
+    def _round(value):
+        # Round to float32-ish precision, so re-exports of the same mesh produce the same report
+        return float("{0:.9g}".format(value))
+
+    return {
+        "TriangleCount" : triangle_count,
+        "MinX" : _round(bbox_min[0]), "MinY" : _round(bbox_min[1]), "MinZ" : _round(bbox_min[2]),
+        "MaxX" : _round(bbox_max[0]), "MaxY" : _round(bbox_max[1]), "MaxZ" : _round(bbox_max[2]),
+        "SurfaceArea" : _round(area),
+        "Volume" : _round(volume),
+        "CentroidX" : _round(centroid[0]), "CentroidY" : _round(centroid[1]), "CentroidZ" : _round(centroid[2]),
+    }
+
+# -- MESH VALIDATION --
+
+# Vertices closer than this (in the STL's units, along each axis) are merged before checking the mesh.
+# Alibre writes the same coordinates for shared vertices, so this only needs to absorb float32 rounding.
+STL_DEFAULT_MERGE_TOLERANCE = 1e-5
+
+# Columns of the mesh validation report
+MESH_VALIDATION_COLUMNS = [
+    "Number", "Path", "Valid", "TriangleCount", "VertexCount",
+    "OpenEdges", "NonManifoldEdges", "DegenerateTriangles", "InconsistentWindingEdges",
+]
+
+def validate_stl_mesh(stl_path, merge_tolerance=STL_DEFAULT_MERGE_TOLERANCE):
+    """Check whether an STL mesh is a valid, watertight solid, which is what slicers for 3D printers expect.
+
+    Vertices are merged by snapping them to a grid of ``merge_tolerance``, so two vertices within the tolerance can occasionally
+    land in neighbouring grid cells and stay separate. That errs on the side of reporting a problem, never hiding one.
+    Then we count how many triangles use each edge:
+
+    - **Open edges** are used by only one triangle (a hole in the surface)
+    - **Non-manifold edges** are used by more than two triangles
+    - **Inconsistently wound edges** are used by exactly two triangles, both in the same direction, meaning one of them is flipped.
+      Non-manifold edges aren't counted here, even if some of their triangles run the same way.
+    - **Degenerate triangles** have two vertices merged together, or zero area. They're left out of the edge checks.
+
+    With NumPy, all of this is vectorized (sort/unique over integer keys), so it's quick even on large meshes.
+
+    :return: A dictionary with keys matching ``MESH_VALIDATION_COLUMNS`` (except Number and Path).
+    :rtype: dict
+    """
+    # type: (str, float) -> dict
+    vertices = read_stl_vertices(stl_path)
+    triangle_count = len(vertices)
+
+    if numpy is not None:
+        # Merge vertices: snap each one to the grid, then give every distinct grid point an ID
+        grid_points = numpy.round(vertices.reshape(-1, 3) / merge_tolerance).astype(numpy.int64)
+        unique_points, vertex_ids = numpy.unique(grid_points, axis=0, return_inverse=True)
+        vertex_count = len(unique_points)
+        vertex_ids = vertex_ids.reshape(-1, 3).astype(numpy.int64)
+        a, b, c = vertex_ids[:, 0], vertex_ids[:, 1], vertex_ids[:, 2]
+
+        areas = 0.5 * numpy.linalg.norm(numpy.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0]), axis=1)
+        degenerate = (a == b) | (b == c) | (c == a) | (areas <= merge_tolerance * merge_tolerance)
+        degenerate_count = int(degenerate.sum())
+
+        # Each good triangle's three directed edges, as single integer keys (start * vertex_count + end)
+        good = ~degenerate
+        starts = numpy.concatenate([a[good], b[good], c[good]])
+        ends = numpy.concatenate([b[good], c[good], a[good]])
+        directed_keys = starts * vertex_count + ends
+        undirected_keys = numpy.minimum(starts, ends) * vertex_count + numpy.maximum(starts, ends)
+
+        unique_undirected_keys, undirected_counts = numpy.unique(undirected_keys, return_counts=True)
+        open_count = int((undirected_counts == 1).sum())
+        non_manifold_count = int((undirected_counts > 2).sum())
+        # A directed edge used twice means a flipped neighbour, but only if nothing else uses the edge (otherwise it's non-manifold)
+        unique_directed_keys, directed_counts = numpy.unique(directed_keys, return_counts=True)
+        directed_starts, directed_ends = unique_directed_keys // vertex_count, unique_directed_keys % vertex_count
+        edge_keys = numpy.minimum(directed_starts, directed_ends) * vertex_count + numpy.maximum(directed_starts, directed_ends)
+        edge_counts = undirected_counts[numpy.searchsorted(unique_undirected_keys, edge_keys)]
+        inconsistent_count = int(((directed_counts == 2) & (edge_counts == 2)).sum())
+    else:
+        vertex_id_by_point = {}
+        edge_counts = {}
+        directed_edge_counts = {}
+        degenerate_count = 0
+        for triangle in vertices:
+            ids = []
+            for point in triangle:
+                grid_point = tuple(int(round(value / merge_tolerance)) for value in point)
+                ids.append(vertex_id_by_point.setdefault(grid_point, len(vertex_id_by_point)))
+
+            v1, v2, v3 = triangle
+            ab = (v2[0] - v1[0], v2[1] - v1[1], v2[2] - v1[2])
+            ac = (v3[0] - v1[0], v3[1] - v1[1], v3[2] - v1[2])
+            normal = (ab[1] * ac[2] - ab[2] * ac[1], ab[2] * ac[0] - ab[0] * ac[2], ab[0] * ac[1] - ab[1] * ac[0])
+            area = 0.5 * (normal[0] ** 2 + normal[1] ** 2 + normal[2] ** 2) ** 0.5
+            if len(set(ids)) < 3 or area <= merge_tolerance * merge_tolerance:
+                degenerate_count += 1
+                continue
+
+            for start, end in ((ids[0], ids[1]), (ids[1], ids[2]), (ids[2], ids[0])):
+                directed_edge_counts[(start, end)] = directed_edge_counts.get((start, end), 0) + 1
+                edge = (min(start, end), max(start, end))
+                edge_counts[edge] = edge_counts.get(edge, 0) + 1
+        vertex_count = len(vertex_id_by_point)
+        open_count = len([count for count in edge_counts.values() if count == 1])
+        non_manifold_count = len([count for count in edge_counts.values() if count > 2])
+        inconsistent_count = len([
+            count for (start, end), count in directed_edge_counts.items() if count == 2 and edge_counts[(min(start, end), max(start, end))] == 2
+        ])
+
+    return {
+        "Valid" : triangle_count > 0 and open_count == 0 and non_manifold_count == 0 and degenerate_count == 0 and inconsistent_count == 0,
+        "TriangleCount" : triangle_count,
+        "VertexCount" : vertex_count,
+        "OpenEdges" : open_count,
+        "NonManifoldEdges" : non_manifold_count,
+        "DegenerateTriangles" : degenerate_count,
+        "InconsistentWindingEdges" : inconsistent_count,
+    }
+
+# -- LEVELS OF DETAIL --
+
+def decimate_stl(source_path, destination_path, resolution):
+    """Write a simplified copy of an STL, using grid-based vertex clustering, as a binary STL.
+
+    The mesh's bounding box is divided into a grid with ``resolution`` cells along its longest side. All the vertices in each cell are merged
+    into one (at their average position), triangles that collapse to a line or point are dropped, and so are duplicate triangles.
+    Small details disappear, but the overall shape stays, which is what a web viewer or docs site needs. With NumPy, this is fully vectorized.
+
+    :param resolution: Number of grid cells along the longest side of the bounding box. Lower numbers give smaller, coarser meshes.
+    :type resolution: int
+    """
+    # type: (str, str, int) -> None
+    vertices = read_stl_vertices(source_path)
+    temp_path = destination_path + ".tmp"
+
+    if numpy is not None:
+        points = vertices.reshape(-1, 3)
+        if len(points) > 0:
+            # Quantize every vertex to a grid cell, and number the cells
+            lowest = points.min(axis=0)
+            cell_size = (points.max(axis=0) - lowest).max() / resolution
+            if cell_size <= 0:
+                cell_size = 1.0
+            cells = numpy.minimum(numpy.floor((points - lowest) / cell_size).astype(numpy.int64), resolution - 1)
+            _, cell_ids, cell_counts = numpy.unique(cells, axis=0, return_inverse=True, return_counts=True)
+            cell_ids = cell_ids.reshape(-1)
+
+            # Each cell's vertex is the average of the vertices in it
+            cell_points = numpy.column_stack([
+                numpy.bincount(cell_ids, weights=points[:, axis], minlength=len(cell_counts)) for axis in range(3)
+            ]) / cell_counts[:, None]
+
+            # Remap the triangles, then drop degenerate and duplicate ones
+            faces = cell_ids.reshape(-1, 3)
+            faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+            _, first_indexes = numpy.unique(numpy.sort(faces, axis=1), axis=0, return_index=True)
+            faces = faces[numpy.sort(first_indexes)]
+            triangle_vertices = cell_points[faces]
+        else:
+            triangle_vertices = numpy.zeros((0, 3, 3))
+
+        a, b, c = triangle_vertices[:, 0], triangle_vertices[:, 1], triangle_vertices[:, 2]
+        normals = numpy.cross(b - a, c - a)
+        lengths = numpy.sqrt((normals * normals).sum(axis=1))
+        normals = normals / numpy.where(lengths > 0, lengths, 1.0)[:, None]
+        triangles = numpy.zeros(len(triangle_vertices), dtype=STL_TRIANGLE_DTYPE)
+        triangles["normal"] = normals
+        triangles["vertices"] = triangle_vertices
+    else:
+        triangles = []
+        points = [point for triangle in vertices for point in triangle]
+        if len(points) > 0:
+            lowest = [min(point[axis] for point in points) for axis in range(3)]
+            cell_size = max(max(point[axis] for point in points) - lowest[axis] for axis in range(3)) / float(resolution)
+            if cell_size <= 0:
+                cell_size = 1.0
+
+            # Number the cells in sorted order, like numpy.unique does, so both paths write the same file
+            cells = [tuple(min(int(math.floor((point[axis] - lowest[axis]) / cell_size)), resolution - 1) for axis in range(3)) for point in points]
+            cell_id_by_cell = dict((cell, i) for i, cell in enumerate(sorted(set(cells))))
+            cell_ids = [cell_id_by_cell[cell] for cell in cells]
+            sums = [[0.0, 0.0, 0.0] for _ in cell_id_by_cell]
+            counts = [0] * len(cell_id_by_cell)
+            for cell_id, point in zip(cell_ids, points):
+                for axis in range(3):
+                    sums[cell_id][axis] += point[axis]
+                counts[cell_id] += 1
+            cell_points = [[value / count for value in total] for total, count in zip(sums, counts)]
+
+            seen_faces = set()
+            for i in range(0, len(cell_ids), 3):
+                face = tuple(cell_ids[i:i + 3])
+                if len(set(face)) < 3 or tuple(sorted(face)) in seen_faces:
+                    continue
+                seen_faces.add(tuple(sorted(face)))
+                a, b, c = [cell_points[cell_id] for cell_id in face]
+                ab = (b[0] - a[0], b[1] - a[1], b[2] - a[2])
+                ac = (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+                normal = (ab[1] * ac[2] - ab[2] * ac[1], ab[2] * ac[0] - ab[0] * ac[2], ab[0] * ac[1] - ab[1] * ac[0])
+                length = math.sqrt(normal[0] * normal[0] + normal[1] * normal[1] + normal[2] * normal[2])
+                if length <= 0:
+                    length = 1.0
+                triangles.append(tuple(value / length for value in normal) + tuple(a) + tuple(b) + tuple(c))
+
+    with BinaryStlWriter(temp_path) as writer:
+        writer.write_triangles(triangles)
+    _replace_file(temp_path, destination_path)
+
+# -- GLTF SCENES --
+
+def get_occurrence_matrix(occurrence):
+    """Return the placement of a part occurrence in the *root* assembly (even if it's in a subassembly), as a column-major 4x4 matrix
+    (the way glTF wants it), or None if it's the identity or can't be read.
+
+    Alibre Script doesn't give us the occurrence's transformation directly, so we map the part's origin and the points one unit along
+    each axis through ``PartPointtoAssemblyPoint``, and build the matrix from those. Alibre Script doesn't tell us what units those points
+    or exported STLs are in, so this assumes they're the same (millimeters, by default). If they aren't, parts end up in the wrong place."""
+    # type: (AssembledPart) -> list[float] | None
+    try:
+        origin = occurrence.PartPointtoAssemblyPoint([0.0, 0.0, 0.0])
+        axis_points = [occurrence.PartPointtoAssemblyPoint(point) for point in ([1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0])]
+    except Exception:
+        return None
+    if origin is None or any(point is None for point in axis_points):
+        return None
+
+    origin = [float(value) for value in origin]
+    matrix = []
+    for point in axis_points:
+        matrix.extend([float(point[axis]) - origin[axis] for axis in range(3)] + [0.0])
+    matrix.extend(origin + [1.0])
+    if matrix == [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]:
+        return None
+    return matrix
+
+def index_triangle_mesh(vertices):
+    """Turn triangles (in the form returned by ``read_stl_vertices()``) into an indexed mesh, with every distinct vertex stored once.
+
+    :return: A ``(positions, indices)`` tuple. With NumPy, these are a float32 (N, 3) array and an int64 array of 3 indices per triangle;
+    without it, a list of (x, y, z) tuples and a list of ints. Positions are in sorted order either way, so both give the same output.
+    :rtype: tuple
+    """
+    if numpy is not None:
+        positions, indices = numpy.unique(vertices.reshape(-1, 3).astype("<f4"), axis=0, return_inverse=True)
+        return positions, indices.reshape(-1)
+
+    points = [tuple(point) for triangle in vertices for point in triangle]
+    positions = sorted(set(points))
+    index_by_point = dict((point, i) for i, point in enumerate(positions))
+    return positions, [index_by_point[point] for point in points]
+
+class GlbScene:
+    """Builds a binary glTF 2.0 (.glb) file: a tree of nodes, some of which reference indexed triangle meshes.
+
+    Meshes don't have normals, so viewers shade them flat, which is what CAD parts want anyway (and what lets us share vertices between faces).
+    Everything is written in the order it was added, and the JSON has sorted keys, so the same scene always gives the same bytes."""
+
+    # glTF constants
+    _FLOAT = 5126
+    _UNSIGNED_SHORT = 5123
+    _UNSIGNED_INT = 5125
+    _ARRAY_BUFFER = 34962
+    _ELEMENT_ARRAY_BUFFER = 34963
+    _TRIANGLES = 4
+
+    def __init__(self):
+        # type: (GlbScene) -> None
+        self.nodes = []
+        self.meshes = []
+        self.accessors = []
+        self.buffer_views = []
+        self._binary_chunks = []
+        self._binary_length = 0
+
+    def add_mesh(self, name, vertices):
+        """Add a triangle mesh (in the form returned by ``read_stl_vertices()``), and return its index for ``add_node()``."""
+        # type: (GlbScene, str, numpy.ndarray | list) -> int
+        positions, indices = index_triangle_mesh(vertices)
+        use_short_indices = len(positions) <= 65535
+
+        if numpy is not None:
+            position_bytes = numpy.ascontiguousarray(positions, dtype="<f4").tobytes()
+            index_bytes = indices.astype("<u2" if use_short_indices else "<u4").tobytes()
+            minimum = positions.min(axis=0).astype(float).tolist() if len(positions) > 0 else [0.0, 0.0, 0.0]
+            maximum = positions.max(axis=0).astype(float).tolist() if len(positions) > 0 else [0.0, 0.0, 0.0]
+        else:
+            position_bytes = struct.pack("<{0}f".format(3 * len(positions)), *[value for point in positions for value in point])
+            index_bytes = struct.pack("<{0}{1}".format(len(indices), "H" if use_short_indices else "I"), *indices)
+            minimum = [min(point[axis] for point in positions) if positions else 0.0 for axis in range(3)]
+            maximum = [max(point[axis] for point in positions) if positions else 0.0 for axis in range(3)]
+
+        position_accessor = self._add_accessor(position_bytes, self._ARRAY_BUFFER, self._FLOAT, len(positions), "VEC3", minimum, maximum)
+        index_accessor = self._add_accessor(
+            index_bytes, self._ELEMENT_ARRAY_BUFFER, self._UNSIGNED_SHORT if use_short_indices else self._UNSIGNED_INT, len(indices), "SCALAR"
+        )
+        self.meshes.append({
+            "name" : name,
+            "primitives" : [{"attributes" : {"POSITION" : position_accessor}, "indices" : index_accessor, "mode" : self._TRIANGLES}],
+        })
+        return len(self.meshes) - 1
+
+    def add_node(self, name, mesh=None, matrix=None, children=None):
+        """Add a node and return its index. ``matrix`` is column-major, and ``children`` are indexes of other nodes."""
+        # type: (GlbScene, str, int | None, list[float] | None, list[int] | None) -> int
+        node = {"name" : name}
+        if mesh is not None:
+            node["mesh"] = mesh
+        if matrix is not None:
+            node["matrix"] = matrix
+        if children:
+            node["children"] = children
+        self.nodes.append(node)
+        return len(self.nodes) - 1
+
+    def write(self, glb_path, root_nodes):
+        """Write the scene to ``glb_path``, with ``root_nodes`` (a list of node indexes) at the top."""
+        # type: (GlbScene, str, list[int]) -> None
+        document = {
+            "asset" : {"version" : "2.0", "generator" : "Alibre Neutralizer"},
+            "scene" : 0,
+            "scenes" : [{"nodes" : root_nodes}],
+            "nodes" : self.nodes,
+        }
+        if self.meshes:
+            document["meshes"] = self.meshes
+            document["accessors"] = self.accessors
+            document["bufferViews"] = self.buffer_views
+            document["buffers"] = [{"byteLength" : self._binary_length}]
+
+        # Both chunks have to be padded to a multiple of 4 bytes: JSON with spaces, binary with zeros
+        json_bytes = json.dumps(document, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        json_bytes += b" " * (-len(json_bytes) % 4)
+        total_length = 12 + 8 + len(json_bytes) + (8 + self._binary_length if self.meshes else 0)
+
+        with open(glb_path, 'wb') as glb_file:
+            glb_file.write(struct.pack("<4sII", b"glTF", 2, total_length))
+            glb_file.write(struct.pack("<I4s", len(json_bytes), b"JSON"))
+            glb_file.write(json_bytes)
+            if self.meshes:
+                glb_file.write(struct.pack("<I4s", self._binary_length, b"BIN\x00"))
+                for chunk in self._binary_chunks:
+                    glb_file.write(chunk)
+
+    def _add_accessor(self, data, target, component_type, count, accessor_type, minimum=None, maximum=None):
+        # Every buffer view starts on a 4-byte boundary
+        self._binary_chunks.append(data + b"\x00" * (-len(data) % 4))
+        self.buffer_views.append({"buffer" : 0, "byteOffset" : self._binary_length, "byteLength" : len(data), "target" : target})
+        self._binary_length += len(self._binary_chunks[-1])
+
+        accessor = {"bufferView" : len(self.buffer_views) - 1, "componentType" : component_type, "count" : count, "type" : accessor_type}
+        if minimum is not None:
+            accessor["min"] = minimum
+            accessor["max"] = maximum
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+# -- ARCHIVES --
+
+class DeterministicZipWriter:
+    """Writes zip archives whose bytes only depend on the names and contents of the entries, and the order they're written in.
+
+    Every entry gets the same timestamp (1980-01-01, the earliest a zip can store) and no permissions, and entries are compressed as they're
+    written, so we never need a whole entry in memory. Once an entry is done, we seek back and fill in the sizes and CRC in its local header.
+    That way there are no data descriptors, which streaming readers (like Java's ``ZipInputStream``) can't handle for stored entries.
+    ZIP64 isn't supported, so entries and archives are limited to 4 GB."""
+
+    _DOS_TIME = 0
+    _DOS_DATE = (1 << 5) | 1 # 1980-01-01
+    _FLAGS = 0x800 # UTF-8 names
+
+    def __init__(self, zip_path, compression_level=6):
+        # type: (DeterministicZipWriter, str, int) -> None
+        self.compression_level = compression_level
+        self._file = open(zip_path, 'wb')
+        self._offset = 0
+        self._central_directory = []
+
+    def open_entry(self, name, compress=True):
+        """Start a new entry, and return a writer for its contents. Close the writer (or use it in a ``with`` block) before opening another entry."""
+        # type: (DeterministicZipWriter, str, bool) -> _ZipEntryWriter
+        return _ZipEntryWriter(self, name, compress)
+
+    def write_entry(self, name, data, compress=True):
+        """Write a whole entry at once."""
+        # type: (DeterministicZipWriter, str, bytes, bool) -> None
+        with self.open_entry(name, compress) as entry:
+            entry.write(data)
+
+    def write_deflated_entry(self, name, deflated_path, crc, size):
+        """Write an entry whose contents were already compressed (as a raw deflate stream, see ``deflate_file()``), copying them in unchanged.
+        This lets entries be compressed in parallel, and then written in order."""
+        # type: (DeterministicZipWriter, str, str, int, int) -> None
+        entry = _ZipEntryWriter(self, name, True)
+        entry._compressor = None # Already compressed
+        with open(deflated_path, 'rb') as deflated_file:
+            while True:
+                chunk = deflated_file.read(1024 * 1024)
+                if not chunk:
+                    break
+                entry._compressed_size += len(chunk)
+                self._write(chunk)
+        entry._crc = crc
+        entry._size = size
+        entry.close()
+
+    def close(self):
+        """Write the central directory, and close the file."""
+        # type: (DeterministicZipWriter) -> None
+        central_directory = b"".join(self._central_directory)
+        self._write(central_directory)
+        self._write(struct.pack(
+            "<IHHHHIIH", 0x06054b50, 0, 0, len(self._central_directory), len(self._central_directory),
+            len(central_directory), self._offset - len(central_directory), 0
+        ))
+        self._file.close()
+
+    def _write(self, data):
+        self._file.write(data)
+        self._offset += len(data)
+        if self._offset > 0xFFFFFFFF:
+            raise Exception("Zip archives larger than 4 GB aren't supported.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+class _ZipEntryWriter:
+    """Writes the contents of one entry of a ``DeterministicZipWriter``."""
+
+    def __init__(self, archive, name, compress):
+        # type: (_ZipEntryWriter, DeterministicZipWriter, str, bool) -> None
+        self._archive = archive
+        self._name = name if isinstance(name, bytes) else name.encode("utf-8")
+        self._method = 8 if compress else 0
+        self._compressor = zlib.compressobj(archive.compression_level, zlib.DEFLATED, -15) if compress else None
+        self._local_header_offset = archive._offset
+        self._crc = 0
+        self._size = 0
+        self._compressed_size = 0
+        archive._write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, 20, DeterministicZipWriter._FLAGS, self._method,
+            DeterministicZipWriter._DOS_TIME, DeterministicZipWriter._DOS_DATE, 0, 0, 0, len(self._name), 0
+        ) + self._name)
+
+    def write(self, data):
+        # type: (_ZipEntryWriter, bytes) -> None
+        self._crc = zlib.crc32(data, self._crc) & 0xFFFFFFFF
+        self._size += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._compressed_size += len(data)
+        self._archive._write(data)
+
+    def close(self):
+        # type: (_ZipEntryWriter) -> None
+        if self._compressor is not None:
+            data = self._compressor.flush()
+            self._compressed_size += len(data)
+            self._archive._write(data)
+        if self._size > 0xFFFFFFFF:
+            raise Exception("Zip entries larger than 4 GB aren't supported.")
+        # Fill in the local header, now that we know what goes in it
+        archive_file = self._archive._file
+        archive_file.seek(self._local_header_offset + 14)
+        archive_file.write(struct.pack("<III", self._crc, self._compressed_size, self._size))
+        archive_file.seek(self._archive._offset)
+        self._archive._central_directory.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014b50, 20, 20, DeterministicZipWriter._FLAGS, self._method,
+            DeterministicZipWriter._DOS_TIME, DeterministicZipWriter._DOS_DATE, self._crc, self._compressed_size, self._size,
+            len(self._name), 0, 0, 0, 0, 0, self._local_header_offset
+        ) + self._name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+def deflate_file(source_path, deflated_path, compression_level=6, chunk_size=1024 * 1024):
+    """Compress a file to a raw deflate stream (no header), for ``DeterministicZipWriter.write_deflated_entry()``.
+
+    :return: The CRC-32 and size of the uncompressed file.
+    :rtype: tuple[int, int]
+    """
+    # type: (str, str, int, int) -> tuple[int, int]
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -15)
+    crc = 0
+    size = 0
+    with open(source_path, 'rb') as source_file:
+        with open(deflated_path, 'wb') as deflated_file:
+            while True:
+                chunk = source_file.read(chunk_size)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc) & 0xFFFFFFFF
+                size += len(chunk)
+                deflated_file.write(compressor.compress(chunk))
+            deflated_file.write(compressor.flush())
+    return crc, size
+
+def gzip_file(source_path, gzip_path, compression_level=6, chunk_size=1024 * 1024):
+    """Gzip a file, streaming it a chunk at a time. The gzip header has no timestamp or file name,
+    so the output only depends on the contents of the file (and the compression level)."""
+    # type: (str, str, int, int) -> None
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -15)
+    crc = 0
+    size = 0
+    temp_path = gzip_path + ".tmp"
+    with open(source_path, 'rb') as source_file:
+        with open(temp_path, 'wb') as gzip_file:
+            # Magic number, deflate, no flags, no timestamp, "maximum compression" hint for level 9, unknown OS
+            gzip_file.write(struct.pack("<BBBBIBB", 0x1f, 0x8b, 8, 0, 0, 2 if compression_level == 9 else 0, 255))
+            while True:
+                chunk = source_file.read(chunk_size)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc) & 0xFFFFFFFF
+                size += len(chunk)
+                gzip_file.write(compressor.compress(chunk))
+            gzip_file.write(compressor.flush())
+            gzip_file.write(struct.pack("<II", crc, size & 0xFFFFFFFF))
+    _replace_file(temp_path, gzip_path)
+
+def gunzip_file(gzip_path, output_path, chunk_size=1024 * 1024):
+    """Decompress a gzip file, streaming it a chunk at a time."""
+    # type: (str, str, int) -> None
+    with gzip.open(gzip_path, 'rb') as gzip_file:
+        with open(output_path, 'wb') as output_file:
+            while True:
+                chunk = gzip_file.read(chunk_size)
+                if not chunk:
+                    break
+                output_file.write(chunk)
+
+# -- RELEASE BUNDLES --
+
+# Bundle formats, by the end of the bundle's file name
+RELEASE_BUNDLE_FORMATS = [(".zip", "zip"), (".tar.gz", "tar.gz"), (".tgz", "tar.gz")]
+
+# Files that are already compressed, so they're stored in zip bundles as they are
+_ALREADY_COMPRESSED_EXTENSIONS = (".stpz", ".gz", ".tgz", ".zip", ".3mf")
+
+def get_release_bundle_format(bundle_path):
+    """Return the format of a release bundle (``zip`` or ``tar.gz``) from its file name, or None if it isn't one we can write."""
+    # type: (str) -> str | None
+    for suffix, bundle_format in RELEASE_BUNDLE_FORMATS:
+        if bundle_path.lower().endswith(suffix):
+            return bundle_format
+    return None
+
+def write_release_bundle(bundle_path, files, compression_level=6, worker_count=None):
+    """Write a zip or tar.gz archive of some files, which only depends on the names and contents of the files.
+
+    Entries are sorted by name, and every entry gets the same timestamp and permissions. In zip bundles, each file is compressed separately,
+    so they're compressed in parallel, and files that are already compressed (like ``.stpZ``) are stored as they are.
+    A tar.gz is a single compressed stream, so it's written in one go.
+
+    :param files: ``(name in the archive, path)`` for each file. Names use forward slashes.
+    :type files: list[tuple[str, str]]
+    """
+    # type: (str, list[tuple[str, str]], int, int | None) -> None
+    bundle_format = get_release_bundle_format(bundle_path)
+    if bundle_format is None:
+        raise Exception("Release bundles have to be .zip, .tar.gz or .tgz files.")
+    files = sorted(files)
+    bundle_dir = os.path.dirname(bundle_path)
+    if bundle_dir and not os.path.exists(bundle_dir):
+        os.makedirs(bundle_dir)
+    temp_path = bundle_path + ".tmp"
+
+    if bundle_format == "tar.gz":
+        with open(temp_path, 'wb') as raw_file:
+            gzip_stream = gzip.GzipFile(filename="", mode='wb', compresslevel=compression_level, fileobj=raw_file, mtime=0)
+            try:
+                archive = tarfile.open(fileobj=gzip_stream, mode='w', format=tarfile.GNU_FORMAT)
+                try:
+                    for name, path in files:
+                        info = tarfile.TarInfo(name)
+                        info.size = os.path.getsize(path)
+                        info.mtime = 0
+                        info.mode = 0o644
+                        info.uid = info.gid = 0
+                        info.uname = info.gname = ""
+                        with open(path, 'rb') as entry_file:
+                            archive.addfile(info, entry_file)
+                finally:
+                    archive.close()
+            finally:
+                gzip_stream.close()
+        _replace_file(temp_path, bundle_path)
+        return
+
+    # Compress everything that isn't already compressed to temporary files first, in parallel
+    temp_dir = tempfile.mkdtemp(prefix="alibre-neutralizer-bundle-", dir=bundle_dir or None)
+    try:
+        def _deflate(item):
+            position, (name, path) = item
+            if path.lower().endswith(_ALREADY_COMPRESSED_EXTENSIONS):
+                return None
+            deflated_path = os.path.join(temp_dir, str(position))
+            crc, size = deflate_file(path, deflated_path, compression_level)
+            return deflated_path, crc, size
+        deflated = _run_in_thread_pool(_deflate, list(enumerate(files)), worker_count)
+
+        with DeterministicZipWriter(temp_path, compression_level) as archive:
+            for (name, path), compressed in zip(files, deflated):
+                if compressed is not None:
+                    archive.write_deflated_entry(name, *compressed)
+                    continue
+                with open(path, 'rb') as entry_file:
+                    with archive.open_entry(name, compress=False) as entry:
+                        while True:
+                            chunk = entry_file.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            entry.write(chunk)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    _replace_file(temp_path, bundle_path)
+
+# -- 3MF BUILD-PLATE PACKAGES --
+
+# Units allowed by the 3MF spec
+THREEMF_UNITS = ["micron", "millimeter", "centimeter", "inch", "foot", "meter"]
+
+# About 5 mm in each unit. Copies are laid out this far apart, so they don't start out overlapping in the slicer.
+_THREEMF_SPACING = {"micron" : 5000.0, "millimeter" : 5.0, "centimeter" : 0.5, "inch" : 0.2, "foot" : 0.02, "meter" : 0.005}
+
+_THREEMF_CONTENT_TYPES = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    b'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    b'<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+    b'</Types>\n'
+)
+
+# Namespace for the metadata we add to packages. Readers ignore metadata they don't know.
+_THREEMF_NEUTRALIZER_NAMESPACE = "https://github.com/k4kfh/alibre-neutralizer"
+
+_THREEMF_RELATIONSHIPS = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    b'<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+    b'</Relationships>\n'
+)
+
+def write_3mf_package(package_path, objects, unit="millimeter", chunk_size=65536):
+    """Write a 3MF package with one object per STL, and one build item per copy of it.
+
+    Meshes are stored as indexed vertices and triangles (so shared vertices are only written once), and streamed into the archive a chunk at a time.
+    Copies are laid out in rows, one row per object, so they don't all start out on top of each other.
+    The names and quantities go in the model's metadata too, so ``read_3mf_package_contents()`` can tell what's in the package without reading the meshes.
+
+    :param objects: List of ``(name, STL path, quantity)`` tuples, in the order they should appear in the package.
+    :type objects: list[tuple[str, str, int]]
+
+    :param unit: The unit the STLs are in. One of ``THREEMF_UNITS``.
+    :type unit: str
+    """
+    # type: (str, list[tuple[str, str, int]], str, int) -> None
+    package_dir = os.path.dirname(package_path)
+    if not os.path.exists(package_dir):
+        os.makedirs(package_dir)
+    temp_path = package_path + ".tmp"
+
+    def _encode(text):
+        return text if isinstance(text, bytes) else text.encode("utf-8")
+
+    build_items = [] # (object id, quantity, minimum corner, maximum corner)
+    with DeterministicZipWriter(temp_path) as archive:
+        archive.write_entry("[Content_Types].xml", _THREEMF_CONTENT_TYPES)
+        archive.write_entry("_rels/.rels", _THREEMF_RELATIONSHIPS)
+        with archive.open_entry("3D/3dmodel.model") as model:
+            contents = json.dumps([[name, quantity] for name, _, quantity in objects], separators=(",", ":"))
+            model.write(_encode(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<model unit="{0}" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02" xmlns:neutralizer={1}>\n'
+                '<metadata name="neutralizer:Contents">{2}</metadata>\n'
+                '<resources>\n'.format(unit, quoteattr(_THREEMF_NEUTRALIZER_NAMESPACE), escape(contents))
+            ))
+            for name, stl_path, quantity in objects:
+                positions, indices = index_triangle_mesh(read_stl_vertices(stl_path))
+                if len(indices) == 0:
+                    log.warning("{0} has no triangles, so it was left out of {1}".format(stl_path, package_path), path=stl_path)
+                    continue
+                object_id = len(build_items) + 1
+                model.write(_encode('<object id="{0}" type="model" name={1}>\n<mesh>\n<vertices>\n'.format(object_id, quoteattr(name))))
+
+                if numpy is not None:
+                    minimum = positions.min(axis=0).astype(float).tolist()
+                    maximum = positions.max(axis=0).astype(float).tolist()
+                    triangles = indices.reshape(-1, 3)
+                else:
+                    minimum = [min(point[axis] for point in positions) for axis in range(3)]
+                    maximum = [max(point[axis] for point in positions) for axis in range(3)]
+                    triangles = [indices[i:i + 3] for i in range(0, len(indices), 3)]
+
+                for start in range(0, len(positions), chunk_size):
+                    rows = positions[start:start + chunk_size]
+                    rows = rows.astype(float).tolist() if numpy is not None else rows
+                    model.write(_encode("".join('<vertex x="%.9g" y="%.9g" z="%.9g"/>\n' % tuple(row) for row in rows)))
+                model.write(b'</vertices>\n<triangles>\n')
+                for start in range(0, len(triangles), chunk_size):
+                    rows = triangles[start:start + chunk_size]
+                    rows = rows.tolist() if numpy is not None else rows
+                    model.write(_encode("".join('<triangle v1="%d" v2="%d" v3="%d"/>\n' % tuple(row) for row in rows)))
+                model.write(b'</triangles>\n</mesh>\n</object>\n')
+                build_items.append((object_id, quantity, minimum, maximum))
+
+            model.write(b'</resources>\n<build>\n')
+            spacing = _THREEMF_SPACING.get(unit, 5.0)
+            y = 0.0
+            for object_id, quantity, minimum, maximum in build_items:
+                x = 0.0
+                for _ in range(quantity):
+                    translation = (x - minimum[0], y - minimum[1], 0.0 - minimum[2])
+                    model.write(_encode('<item objectid="{0}" transform="1 0 0 0 1 0 0 0 1 {1}"/>\n'.format(
+                        object_id, " ".join("%.9g" % value for value in translation)
+                    )))
+                    x += maximum[0] - minimum[0] + spacing
+                y += maximum[1] - minimum[1] + spacing
+            model.write(b'</build>\n</model>\n')
+    _replace_file(temp_path, package_path)
+
+def read_3mf_package_contents(package_path, chunk_size=65536):
+    """Return the ``(name, quantity)`` pairs a package was written with, as recorded by ``write_3mf_package()``.
+    Only the start of the model is read, so this is quick even for big packages.
+
+    :return: List of ``(name, quantity)`` tuples, or None if the package can't be read or wasn't written by us.
+    :rtype: list[tuple[str, int]] | None
+    """
+    # type: (str, int) -> list[tuple[str, int]] | None
+    head = b""
+    try:
+        with zipfile.ZipFile(package_path) as archive:
+            with archive.open("3D/3dmodel.model") as model:
+                while b"<resources>" not in head:
+                    chunk = model.read(chunk_size)
+                    if len(chunk) == 0:
+                        break
+                    head += chunk
+    except (IOError, OSError, KeyError, zipfile.BadZipfile):
+        return None
+    match = re.search(b'<metadata name="neutralizer:Contents">([^<]*)</metadata>', head)
+    if match is None:
+        return None
+    return [(name, quantity) for name, quantity in json.loads(unescape(match.group(1).decode("utf-8")))]
+
+# -- GEOMETRY COMPARISON --
+
+# Default for how far apart two coordinates can be and still count as the same, when comparing a new export with the previous one
+DEFAULT_GEOMETRY_TOLERANCE = 1e-5
+
+def geometry_files_match(path_a, path_b, export_type, tolerance=DEFAULT_GEOMETRY_TOLERANCE):
+    """Return True if two exports of the same type contain the same geometry, within ``tolerance``, even if their bytes differ.
+
+    Only STL and STEP files can be compared. Anything that can't be read is treated as different, so the new export wins."""
+    # type: (str, str, int, float) -> bool
+    try:
+        if export_type == ExportTypes.STL:
+            return stl_geometry_matches(path_a, path_b, tolerance)
+        elif export_type in (ExportTypes.STEP203, ExportTypes.STEP214):
+            return step_geometry_matches(path_a, path_b, tolerance)
+    except Exception as e:
+        log.warning("Could not compare {0} with the previous export: {1}".format(path_b, e), path=path_b)
+    return False
+
+def stl_geometry_matches(path_a, path_b, tolerance=DEFAULT_GEOMETRY_TOLERANCE):
+    """Return True if two STL files have the same triangles, with every coordinate within ``tolerance``.
+
+    Normals and the header are ignored, since they don't affect the shape. Triangles are compared in file order first, since Alibre usually
+    writes them in the same order. If that fails, both meshes are put in a canonical order: each triangle is rotated so its smallest vertex comes
+    first (which keeps its winding), and the triangles are sorted. The sort uses coordinates rounded to ``tolerance``, so jitter right at a rounding
+    boundary can still put the triangles in a different order. Then the meshes are reported as different, which just means the file gets rewritten."""
+    # type: (str, str, float) -> bool
+    vertices_a = read_stl_vertices(path_a)
+    vertices_b = read_stl_vertices(path_b)
+    if len(vertices_a) != len(vertices_b):
+        return False
+    if len(vertices_a) == 0:
+        return True
+
+    if numpy is not None:
+        if numpy.abs(vertices_a - vertices_b).max() <= tolerance:
+            return True
+        return numpy.abs(_canonicalize_triangles(vertices_a, tolerance) - _canonicalize_triangles(vertices_b, tolerance)).max() <= tolerance
+
+    def _triangles_match(triangles_a, triangles_b):
+        for triangle_a, triangle_b in zip(triangles_a, triangles_b):
+            for point_a, point_b in zip(triangle_a, triangle_b):
+                for value_a, value_b in zip(point_a, point_b):
+                    if abs(value_a - value_b) > tolerance:
+                        return False
+        return True
+
+    return _triangles_match(vertices_a, vertices_b) or _triangles_match(
+        _canonicalize_triangles(vertices_a, tolerance), _canonicalize_triangles(vertices_b, tolerance)
+    )
+
+def _canonicalize_triangles(vertices, tolerance):
+    """Put triangles (in the form returned by ``read_stl_vertices()``) in a canonical order, for ``stl_geometry_matches()``."""
+    if numpy is not None:
+        grid_points = numpy.round(vertices / tolerance).astype(numpy.int64)
+        rows = numpy.arange(len(vertices))[:, None]
+
+        # Rotate each triangle so its lexicographically smallest vertex comes first
+        first = numpy.lexsort((grid_points[:, :, 2], grid_points[:, :, 1], grid_points[:, :, 0]), axis=1)[:, 0]
+        rotation = (first[:, None] + numpy.arange(3)) % 3
+        vertices = vertices[rows, rotation]
+        grid_points = grid_points[rows, rotation].reshape(-1, 9)
+
+        # Then sort the triangles (lexsort takes the most significant key last)
+        return vertices[numpy.lexsort(grid_points.T[::-1])]
+
+    keyed_triangles = []
+    for triangle in vertices:
+        keys = [tuple(int(round(value / tolerance)) for value in point) for point in triangle]
+        first = keys.index(min(keys))
+        keyed_triangles.append((keys[first:] + keys[:first], tuple(triangle[first:]) + tuple(triangle[:first])))
+    keyed_triangles.sort(key=lambda keyed_triangle: keyed_triangle[0])
+    return [triangle for _, triangle in keyed_triangles]
+
+# Tokens of a STEP (ISO 10303-21) file: strings (with '' as an escaped quote), comments, numbers, entity references, enumerations, keywords, and punctuation
+_STEP_TOKEN_PATTERN = re.compile(
+    br"'(?:[^']|'')*'|/\*.*?\*/|[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?|#[0-9]+|\.[A-Za-z_][A-Za-z0-9_]*\.|[A-Za-z_][A-Za-z0-9_\-]*|\S",
+    re.S
+)
+
+# Entities whose contents change every time a file is exported, so they're left out when comparing STEP files
+STEP_VOLATILE_ENTITIES = (b"CALENDAR_DATE", b"LOCAL_TIME", b"COORDINATED_UNIVERSAL_TIME_OFFSET")
+
+def iter_step_data_tokens(step_file, block_size=16 * 1024 * 1024):
+    """Yield the tokens (as byte strings) of the DATA section of a STEP file, skipping the HEADER section, comments, and the arguments of
+    ``STEP_VOLATILE_ENTITIES``. The file is read in blocks, so only one block is in memory at a time."""
+    # type: (file, int) -> iterator[bytes]
+    leftover = b""
+    in_data = False
+    skip_until_semicolon = False
+    at_end = False
+    while not at_end:
+        block = step_file.read(block_size)
+        at_end = not block
+        buffer = leftover + block
+        leftover = b""
+        for match in _STEP_TOKEN_PATTERN.finditer(buffer):
+            token = match.group(0)
+            # A token near the end of the block might continue in the next one (e.g. "1.E" + "-5", or 'it' + 's' being 'it''s').
+            # An unterminated string or comment only matches a single character.
+            if not at_end and (match.end() > len(buffer) - 64 or token == b"'" or (token == b"/" and buffer[match.end():match.end() + 1] == b"*")):
+                leftover = buffer[match.start():]
+                break
+            if token.startswith(b"/*"):
+                continue
+            if not in_data:
+                in_data = token == b"DATA"
+                continue
+            if token == b"ENDSEC":
+                in_data = False
+                continue
+            if skip_until_semicolon:
+                if token != b";":
+                    continue
+                skip_until_semicolon = False
+            elif token in STEP_VOLATILE_ENTITIES:
+                skip_until_semicolon = True
+            yield token
+
+# A real number token (as opposed to an integer, which has to match exactly)
+_STEP_REAL_PATTERN = re.compile(br"[-+]?(?:[0-9]+\.[0-9]*|\.[0-9]+|[0-9]+(?=[eE]))(?:[eE][-+]?[0-9]+)?$")
+
+def step_geometry_matches(path_a, path_b, tolerance=DEFAULT_GEOMETRY_TOLERANCE):
+    """Return True if two STEP files have the same DATA section, with every real number within ``tolerance``.
+    The HEADER section (which has the export time in it) and date/time entities are ignored. Both files are streamed, and we stop at the first difference.
+
+    Alibre numbers entities differently from one export to the next, so entity ids don't have to match: each file's ids are renumbered in the order
+    they first appear, which matches as long as the entities are written in the same order. If they aren't, compact both files first
+    (see ``compact_step_file()``), which puts them in a canonical order. Keeping the renumbering takes about 100 bytes of memory per entity."""
+    # type: (str, str, float) -> bool
+    canonical_ids_a = {}
+    canonical_ids_b = {}
+    with open(path_a, 'rb') as file_a:
+        with open(path_b, 'rb') as file_b:
+            tokens_a = iter_step_data_tokens(file_a)
+            tokens_b = iter_step_data_tokens(file_b)
+            while True:
+                token_a = next(tokens_a, None)
+                token_b = next(tokens_b, None)
+                if token_a is None or token_b is None:
+                    return token_a is None and token_b is None
+                if token_a.startswith(b"#") and token_b.startswith(b"#"):
+                    id_a = canonical_ids_a.setdefault(int(token_a[1:]), len(canonical_ids_a))
+                    id_b = canonical_ids_b.setdefault(int(token_b[1:]), len(canonical_ids_b))
+                    if id_a != id_b:
+                        return False
+                    continue
+                if token_a == token_b:
+                    continue
+                if not (_STEP_REAL_PATTERN.match(token_a) and _STEP_REAL_PATTERN.match(token_b)) or abs(float(token_a) - float(token_b)) > tolerance:
+                    return False
+
+# -- STEP FILES --
+
+# Statement boundaries in a STEP file: semicolons, plus strings and comments (which can contain semicolons), and the start of an
+# unterminated string or comment (which means the statement continues past the end of the block we're looking at)
+_STEP_STATEMENT_PATTERN = re.compile(br"'(?:[^']|'')*'|/\*.*?\*/|'|/\*|;", re.S)
+
+# The start of an entity instance: "#123=TYPE_NAME(" or "#123=(" for complex entities
+_STEP_ENTITY_HEAD_PATTERN = re.compile(br"\s*(?:/\*.*?\*/\s*)*#([0-9]+)\s*=\s*([A-Za-z_][A-Za-z0-9_]*|\()", re.S)
+
+# Strings (so we can ignore anything that looks like a reference inside them), and entity references
+_STEP_STRING_PATTERN = re.compile(br"'((?:[^']|'')*)'")
+_STEP_REFERENCE_PATTERN = re.compile(br"#([0-9]+)")
+_STEP_STRING_OR_REFERENCE_PATTERN = re.compile(br"'(?:[^']|'')*'|#([0-9]+)")
+
+# Python 2 has no 64-bit integer arrays. Doubles hold every file offset we'll ever see exactly.
+try:
+    array.array('q')
+    _STEP_OFFSET_TYPECODE = 'q'
+except ValueError:
+    _STEP_OFFSET_TYPECODE = 'd'
+
+def get_step_references(entity_text):
+    """Return the ids of every entity referenced by a STEP entity instance (as written in the file), in order, not counting its own id."""
+    # type: (bytes) -> list[int]
+    body = _STEP_STRING_PATTERN.sub(b"''", get_step_entity_body(entity_text))
+    return [int(reference) for reference in _STEP_REFERENCE_PATTERN.findall(body)]
+
+def get_step_entity_body(entity_text):
+    """Return a STEP entity instance without its id: everything from the type name (or the ``(`` of a complex entity) on."""
+    # type: (bytes) -> bytes
+    match = _STEP_ENTITY_HEAD_PATTERN.match(entity_text)
+    if match is None:
+        raise Exception("Not a STEP entity instance: {0!r}".format(entity_text[:80]))
+    return entity_text[match.start(2):]
+
+def get_step_strings(entity_text):
+    """Return every string argument of a STEP entity instance, in order, with ``''`` unescaped."""
+    # type: (bytes) -> list[bytes]
+    return [value.replace(b"''", b"'") for value in _STEP_STRING_PATTERN.findall(entity_text)]
+
+class StepFile:
+    """Streaming reader for STEP (ISO 10303-21) files.
+
+    The file is memory-mapped where possible, and scanned a block at a time, so this works on files much larger than RAM.
+    Nothing is parsed until you ask for it: ``iter_entities()`` finds where each entity instance starts and ends,
+    and ``read()`` gets the raw bytes of whatever you need."""
+
+    def __init__(self, step_path, block_size=16 * 1024 * 1024):
+        # type: (StepFile, str, int) -> None
+        self.step_path = step_path
+        self.block_size = block_size
+        self._file = open(step_path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._mapped = None
+        if self.size > 0:
+            try:
+                self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                self._mapped = None # Some filesystems can't be memory-mapped. Fall back to seek() and read().
+
+        # Byte offsets of the sections, filled in by iter_entities()
+        self.header_end = None # just after "DATA;"
+        self.data_end = None # just before the "ENDSEC;" that closes the DATA section
+
+    def read(self, start, end):
+        """Return the bytes between two offsets."""
+        # type: (StepFile, int, int) -> bytes
+        if self._mapped is not None:
+            return self._mapped[start:end]
+        self._file.seek(start)
+        return self._file.read(end - start)
+
+    def iter_statements(self):
+        """Yield the ``(start, end)`` offsets of every statement in the file (everything up to and including each semicolon that isn't
+        inside a string or comment). The start includes any whitespace or comments before the statement."""
+        # type: (StepFile) -> iterator[tuple[int, int]]
+        offset = 0
+        read_size = self.block_size
+        while offset < self.size:
+            end = min(self.size, offset + read_size)
+            buffer = self.read(offset, end)
+            at_end = end >= self.size
+            last_end = 0
+            for match in _STEP_STATEMENT_PATTERN.finditer(buffer):
+                token = match.group(0)
+                if token == b";":
+                    yield offset + last_end, offset + match.end()
+                    last_end = match.end()
+                elif not at_end and (token == b"'" or token == b"/*" or match.end() == len(buffer)):
+                    break # This string or comment might continue in the next block
+            if at_end:
+                break
+            if last_end == 0:
+                read_size *= 2 # A single statement bigger than a block
+            else:
+                offset += last_end
+                read_size = self.block_size
+
+    def iter_entities(self):
+        """Yield ``(id, type name, start, end)`` for every entity instance in the DATA section, in file order.
+        The type name is ``b"("`` for complex entities. Also fills in ``header_end`` and ``data_end``."""
+        # type: (StepFile) -> iterator[tuple[int, bytes, int, int]]
+        in_data = False
+        for start, end in self.iter_statements():
+            head = self.read(start, min(end, start + 256))
+            if not in_data:
+                if head.strip().upper().startswith(b"DATA"):
+                    in_data = True
+                    self.header_end = end
+                continue
+            match = _STEP_ENTITY_HEAD_PATTERN.match(head)
+            if match is None:
+                if head.strip().upper().startswith(b"ENDSEC"):
+                    self.data_end = start
+                    return
+                continue
+            yield int(match.group(1)), match.group(2).upper(), start, end
+
+    def read_entity(self, start, end):
+        """Return the text of an entity instance, without the whitespace before it."""
+        # type: (StepFile, int, int) -> bytes
+        return self.read(start, end).strip()
+
+    def close(self):
+        # type: (StepFile) -> None
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class StepEntityIndex:
+    """Byte offsets of every entity in a STEP file, by entity id.
+
+    Entity ids are nearly always numbered 1 to N, so the offsets are kept in two flat arrays indexed by id, rather than a dictionary.
+    That's 16 bytes per entity, which matters when a file has tens of millions of them."""
+
+    def __init__(self):
+        # type: (StepEntityIndex) -> None
+        self._starts = array.array(_STEP_OFFSET_TYPECODE)
+        self._ends = array.array(_STEP_OFFSET_TYPECODE)
+
+    def add(self, entity_id, start, end):
+        # type: (StepEntityIndex, int, int, int) -> None
+        if entity_id >= len(self._starts):
+            growth = max(entity_id + 1, 2 * len(self._starts)) - len(self._starts)
+            self._starts.extend(array.array(_STEP_OFFSET_TYPECODE, [-1]) * growth)
+            self._ends.extend(array.array(_STEP_OFFSET_TYPECODE, [-1]) * growth)
+        self._starts[entity_id] = start
+        self._ends[entity_id] = end
+
+    def get(self, entity_id):
+        """Return the ``(start, end)`` offsets of an entity, or None if there's no entity with that id."""
+        # type: (StepEntityIndex, int) -> tuple[int, int] | None
+        if entity_id >= len(self._starts) or self._starts[entity_id] < 0:
+            return None
+        return int(self._starts[entity_id]), int(self._ends[entity_id])
+
+class StepAssemblySplitter:
+    """Splits an assembly STEP file into a standalone STEP file for each product (part or subassembly) in it.
+
+    A product's file contains everything reachable from its product structure (product, definition, shape and its representation items,
+    and for assemblies, the usages and placements of its children), plus anything that only decorates those entities, like colors and layers.
+    Entities keep their ids and order, and the header is copied from the assembly's file."""
+
+    # Entities that tie products to their shapes and to each other. We keep the references of these in memory, to walk the product structure.
+    STRUCTURE_TYPES = (
+        b"PRODUCT", b"PRODUCT_DEFINITION_FORMATION", b"PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE", b"PRODUCT_DEFINITION",
+        b"PRODUCT_DEFINITION_SHAPE", b"SHAPE_DEFINITION_REPRESENTATION", b"SHAPE_REPRESENTATION_RELATIONSHIP",
+        b"NEXT_ASSEMBLY_USAGE_OCCURRENCE", b"CONTEXT_DEPENDENT_SHAPE_REPRESENTATION",
+    )
+
+    # Entities that only decorate others. Each one is copied into a product's file if everything it decorates is in that file (see _get_decorated()),
+    # along with anything else it needs, like the colors of a STYLED_ITEM.
+    DECORATION_TYPES = (
+        b"STYLED_ITEM", b"OVER_RIDING_STYLED_ITEM", b"MECHANICAL_DESIGN_GEOMETRIC_PRESENTATION_REPRESENTATION",
+        b"PRESENTATION_LAYER_ASSIGNMENT", b"APPLICATION_PROTOCOL_DEFINITION", b"PRODUCT_RELATED_PRODUCT_CATEGORY",
+        b"DRAUGHTING_MODEL", b"PROPERTY_DEFINITION", b"PROPERTY_DEFINITION_REPRESENTATION",
+    )
+
+    def __init__(self, step_path):
+        # type: (StepAssemblySplitter, str) -> None
+        self.step = StepFile(step_path)
+        self.index = StepEntityIndex()
+        self.types = {} # id -> type name, for structure and decoration entities only
+        self.references = {} # id -> referenced ids, for structure and decoration entities only
+        self.products = [] # (id, product id string, product name string)
+        self.max_id = 0
+
+        for entity_id, type_name, start, end in self.step.iter_entities():
+            self.index.add(entity_id, start, end)
+            self.max_id = max(self.max_id, entity_id)
+            if type_name in self.STRUCTURE_TYPES or type_name in self.DECORATION_TYPES:
+                text = self.step.read_entity(start, end)
+                self.types[entity_id] = type_name
+                self.references[entity_id] = get_step_references(text)
+                if type_name == b"PRODUCT":
+                    strings = get_step_strings(text) + [b"", b""]
+                    self.products.append((entity_id, strings[0], strings[1]))
+        if self.step.header_end is None or self.step.data_end is None:
+            raise Exception("{0} doesn't look like a STEP file.".format(step_path))
+
+        # Reverse lookups for walking the product structure, keyed by the id of the entity that gets referenced
+        self._referenced_by = {}
+        for entity_id, type_name in self.types.items():
+            if type_name in self.STRUCTURE_TYPES:
+                for reference in self.references[entity_id]:
+                    self._referenced_by.setdefault(reference, []).append(entity_id)
+        for referencing_ids in self._referenced_by.values():
+            referencing_ids.sort()
+
+    def find_product(self, names):
+        """Return the id of the first PRODUCT whose id or name matches one of ``names`` (case-insensitive), or None."""
+        # type: (StepAssemblySplitter, list[str]) -> int | None
+        for name in names:
+            if not name:
+                continue
+            wanted = (name if isinstance(name, bytes) else name.encode("utf-8")).strip().lower()
+            for entity_id, product_id, product_name in self.products:
+                if product_id.strip().lower() == wanted or product_name.strip().lower() == wanted:
+                    return entity_id
+        return None
+
+    def get_top_product(self):
+        """Return the id of the first PRODUCT that isn't used inside another one (the part itself, for a part's STEP file), or None."""
+        # type: (StepAssemblySplitter) -> int | None
+        used_definitions = set(
+            self.references[entity_id][1] for entity_id, type_name in self.types.items()
+            if type_name == b"NEXT_ASSEMBLY_USAGE_OCCURRENCE" and len(self.references[entity_id]) > 1
+        )
+        for product_id, _, _ in self.products:
+            definition_id, _ = self.get_product_shape(product_id)
+            if definition_id is not None and definition_id not in used_definitions:
+                return product_id
+        return None
+
+    def get_product_shape(self, product_id):
+        """Return the ids of a product's PRODUCT_DEFINITION and SHAPE_REPRESENTATION (either can be None if the file doesn't have one)."""
+        # type: (StepAssemblySplitter, int) -> tuple[int | None, int | None]
+        for formation_id in self._referenced_by.get(product_id, []):
+            if not self.types[formation_id].startswith(b"PRODUCT_DEFINITION_FORMATION"):
+                continue
+            for definition_id in self._referenced_by.get(formation_id, []):
+                if self.types[definition_id] != b"PRODUCT_DEFINITION":
+                    continue
+                for shape_id in self._referenced_by.get(definition_id, []):
+                    if self.types[shape_id] != b"PRODUCT_DEFINITION_SHAPE":
+                        continue
+                    for shape_definition_id in self._referenced_by.get(shape_id, []):
+                        if self.types[shape_definition_id] == b"SHAPE_DEFINITION_REPRESENTATION" and len(self.references[shape_definition_id]) > 1:
+                            return definition_id, self.references[shape_definition_id][1]
+                return definition_id, None
+        return None, None
+
+    def get_entity_type(self, entity_id):
+        """Return the type name of any entity (``b"("`` for complex entities), or None if there's no entity with that id."""
+        # type: (StepAssemblySplitter, int) -> bytes | None
+        offsets = self.index.get(entity_id)
+        if offsets is None:
+            return None
+        match = _STEP_ENTITY_HEAD_PATTERN.match(self.step.read(offsets[0], min(offsets[1], offsets[0] + 256)))
+        return match.group(2).upper() if match is not None else None
+
+    def write_product(self, product_id, output_path):
+        """Write a standalone STEP file for one product."""
+        # type: (StepAssemblySplitter, int, str) -> None
+        included = self._get_closure(self._get_structure_seeds(product_id, set()))
+
+        # Decorations can decorate other decorations (e.g. a presentation representation of styled items), so keep going until nothing changes
+        decoration_ids = sorted(entity_id for entity_id, type_name in self.types.items() if type_name in self.DECORATION_TYPES)
+        added = True
+        while added:
+            added = False
+            for entity_id in decoration_ids:
+                decorated = self._get_decorated(entity_id)
+                if entity_id not in included and len(decorated) > 0 and all(reference in included for reference in decorated):
+                    included.update(self._get_closure({entity_id}))
+                    added = True
+
+        output_dir = os.path.dirname(output_path)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        temp_path = output_path + ".tmp"
+        with open(temp_path, 'wb') as output_file:
+            output_file.write(self.step.read(0, self.step.header_end).lstrip())
+            output_file.write(b"\n")
+            for entity_id in sorted(included):
+                start, end = self.index.get(entity_id)
+                output_file.write(self.step.read_entity(start, end))
+                output_file.write(b"\n")
+            output_file.write(b"ENDSEC;\nEND-ISO-10303-21;\n")
+        _replace_file(temp_path, output_path)
+
+    def _get_structure_seeds(self, product_id, visited_products):
+        """Return the structure entities of a product, and (for assemblies) of everything in it."""
+        # type: (StepAssemblySplitter, int, set[int]) -> set[int]
+        visited_products.add(product_id)
+        seeds = {product_id}
+
+        def _referencing(entity_ids, type_prefix, position=None):
+            # Entities starting with type_prefix that reference any of entity_ids (at a particular argument position, if given)
+            found = []
+            for entity_id in entity_ids:
+                for referencing_id in self._referenced_by.get(entity_id, []):
+                    if not self.types[referencing_id].startswith(type_prefix):
+                        continue
+                    if position is not None and (len(self.references[referencing_id]) <= position or self.references[referencing_id][position] != entity_id):
+                        continue
+                    found.append(referencing_id)
+            return found
+
+        formations = _referencing([product_id], b"PRODUCT_DEFINITION_FORMATION", 0)
+        definitions = _referencing(formations, b"PRODUCT_DEFINITION", 0)
+        definitions = [entity_id for entity_id in definitions if self.types[entity_id] == b"PRODUCT_DEFINITION"]
+        shapes = _referencing(definitions, b"PRODUCT_DEFINITION_SHAPE", 0)
+        shape_definitions = _referencing(shapes, b"SHAPE_DEFINITION_REPRESENTATION", 0)
+        representations = [self.references[entity_id][1] for entity_id in shape_definitions if len(self.references[entity_id]) > 1]
+        # Relationships to the representations holding the actual geometry (e.g. an ADVANCED_BREP_SHAPE_REPRESENTATION)
+        geometry_relationships = _referencing(representations, b"SHAPE_REPRESENTATION_RELATIONSHIP")
+        seeds.update(formations + definitions + shapes + shape_definitions + geometry_relationships)
+
+        # For assemblies: each child's usage, the shape of the usage, and the placement of the child, then the child itself
+        usages = _referencing(definitions, b"NEXT_ASSEMBLY_USAGE_OCCURRENCE", 0)
+        usage_shapes = _referencing(usages, b"PRODUCT_DEFINITION_SHAPE", 0)
+        placements = _referencing(usage_shapes, b"CONTEXT_DEPENDENT_SHAPE_REPRESENTATION", 1)
+        seeds.update(usages + usage_shapes + placements)
+        for usage_id in usages:
+            if len(self.references[usage_id]) < 2:
+                continue
+            child_definition = self.references[usage_id][1]
+            child_formation = self.references.get(child_definition, [None])[0]
+            child_product = self.references.get(child_formation, [None])[0] if child_formation is not None else None
+            if child_product is not None and child_product not in visited_products:
+                seeds.update(self._get_structure_seeds(child_product, visited_products))
+        return seeds
+
+    def _get_decorated(self, decoration_id):
+        """Return the ids of the entities a decoration decorates. For styled items that's the item (and the style being overridden),
+        not the styles themselves. For everything else, it's everything the decoration references."""
+        # type: (StepAssemblySplitter, int) -> list[int]
+        references = self.references[decoration_id]
+        if self.types[decoration_id] == b"STYLED_ITEM":
+            return references[-1:]
+        if self.types[decoration_id] == b"OVER_RIDING_STYLED_ITEM":
+            return references[-2:]
+        return references
+
+    def _get_closure(self, seeds):
+        """Return ``seeds`` plus every entity they reference, directly or indirectly."""
+        # type: (StepAssemblySplitter, set[int]) -> set[int]
+        included = set()
+        pending = list(seeds)
+        while pending:
+            entity_id = pending.pop()
+            if entity_id in included:
+                continue
+            offsets = self.index.get(entity_id)
+            if offsets is None:
+                continue # A dangling reference. Leave it for the importing application to complain about.
+            included.add(entity_id)
+            if entity_id in self.references:
+                references = self.references[entity_id]
+            else:
+                references = get_step_references(self.step.read_entity(*offsets))
+            pending.extend(reference for reference in references if reference not in included)
+        return included
+
+    def close(self):
+        # type: (StepAssemblySplitter) -> None
+        self.step.close()
+
+def renumber_step_entity(entity_text, offset):
+    """Add ``offset`` to the id of a STEP entity instance and to every entity it references."""
+    # type: (bytes, int) -> bytes
+    def _renumber(match):
+        if match.group(1) is None:
+            return match.group(0) # A string
+        return b"#" + str(int(match.group(1)) + offset).encode("ascii")
+    return _STEP_STRING_OR_REFERENCE_PATTERN.sub(_renumber, entity_text)
+
+def format_step_real(value):
+    """Format a number the way STEP wants it: always with a decimal point (``1.``, ``1.5E-05``), and never as negative zero."""
+    # type: (float) -> str
+    text = "%.15G" % (float(value) + 0.0)
+    if text == "-0":
+        text = "0"
+    if "." not in text:
+        text = text.replace("E", ".E") if "E" in text else text + "."
+    return text
+
+def _format_step_string(value):
+    # type: (str) -> str
+    return "'" + value.replace("'", "''") + "'"
+
+def write_step_assembly(output_path, assembly_name, occurrences):
+    """Write an assembly STEP file that places copies of existing part STEP files, without asking Alibre to translate the parts again.
+
+    Each part file is copied in once (with its entities renumbered to fit after the ones before it), and then the assembly's own product,
+    shape and one ``NEXT_ASSEMBLY_USAGE_OCCURRENCE`` per occurrence are added, the same way CAD tools write assemblies themselves.
+
+    :param occurrences: ``(part STEP path, occurrence name, placement)`` for each occurrence, where the placement is a column-major 4x4 matrix
+    (as returned by ``get_occurrence_matrix()``) or None for no transformation.
+    :type occurrences: list[tuple[str, str, list[float] | None]]
+    """
+    # type: (str, str, list[tuple[str, str, list[float] | None]]) -> None
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Read the product structure of each part file, and work out where its entities go in the new file
+    parts = {} # part STEP path -> (id offset, product definition id, shape representation id, placement axis id or None)
+    part_order = []
+    schema = b"FILE_SCHEMA(('AUTOMOTIVE_DESIGN { 1 0 10303 214 1 1 1 1 }'));"
+    geometry_context = None
+    next_id = 1
+    for part_path, _, _ in occurrences:
+        if part_path in parts:
+            continue
+        splitter = StepAssemblySplitter(part_path)
+        try:
+            product_id = splitter.get_top_product()
+            definition_id, representation_id = splitter.get_product_shape(product_id) if product_id is not None else (None, None)
+            if definition_id is None or representation_id is None:
+                raise Exception("{0} doesn't have a product with a shape.".format(part_path))
+            representation_text = splitter.step.read_entity(*splitter.index.get(representation_id))
+            representation_references = get_step_references(representation_text)
+            axis_id = None
+            for reference in representation_references[:-1]:
+                if splitter.get_entity_type(reference) == b"AXIS2_PLACEMENT_3D":
+                    axis_id = reference
+                    break
+            offset = next_id - 1
+            if geometry_context is None and len(representation_references) > 0:
+                geometry_context = representation_references[-1] + offset
+                header_match = re.search(br"FILE_SCHEMA\s*\(.*?\)\s*;", splitter.step.read(0, splitter.step.header_end), re.S)
+                if header_match is not None:
+                    schema = header_match.group(0)
+            parts[part_path] = (offset, definition_id + offset, representation_id + offset, axis_id + offset if axis_id is not None else None)
+            part_order.append(part_path)
+            next_id += splitter.max_id
+        finally:
+            splitter.close()
+
+    lines = []
+    def _add(text):
+        # Add an entity to the assembly's part of the file, and return its id
+        entity_id = next_id + len(lines)
+        lines.append("#{0}={1};".format(entity_id, text))
+        return entity_id
+
+    def _add_placement(matrix):
+        if matrix is None:
+            matrix = [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+        origin = _add("CARTESIAN_POINT('',({0}))".format(",".join(format_step_real(value) for value in matrix[12:15])))
+        axis = _add("DIRECTION('',({0}))".format(",".join(format_step_real(value) for value in matrix[8:11])))
+        ref_direction = _add("DIRECTION('',({0}))".format(",".join(format_step_real(value) for value in matrix[0:3])))
+        return _add("AXIS2_PLACEMENT_3D('',#{0},#{1},#{2})".format(origin, axis, ref_direction))
+
+    name = _format_step_string(assembly_name)
+    application_context = _add("APPLICATION_CONTEXT('automotive design')")
+    product_context = _add("PRODUCT_CONTEXT('',#{0},'mechanical')".format(application_context))
+    definition_context = _add("PRODUCT_DEFINITION_CONTEXT('part definition',#{0},'design')".format(application_context))
+    product = _add("PRODUCT({0},{0},'',(#{1}))".format(name, product_context))
+    formation = _add("PRODUCT_DEFINITION_FORMATION('','',#{0})".format(product))
+    definition = _add("PRODUCT_DEFINITION('design','',#{0},#{1})".format(formation, definition_context))
+    shape = _add("PRODUCT_DEFINITION_SHAPE('','',#{0})".format(definition))
+    placements = [_add_placement(None)] + [_add_placement(matrix) for _, _, matrix in occurrences]
+    if geometry_context is None:
+        raise Exception("There are no parts to put in {0}.".format(output_path))
+    representation = _add("SHAPE_REPRESENTATION({0},({1}),#{2})".format(name, ",".join("#{0}".format(placement) for placement in placements), geometry_context))
+    _add("SHAPE_DEFINITION_REPRESENTATION(#{0},#{1})".format(shape, representation))
+
+    for number, (part_path, occurrence_name, _) in enumerate(occurrences):
+        _, part_definition, part_representation, part_axis = parts[part_path]
+        if part_axis is None:
+            part_axis = placements[0] # The part's shape has no placement of its own, so it's placed relative to the assembly's origin
+        usage = _add("NEXT_ASSEMBLY_USAGE_OCCURRENCE('{0}',{1},'',#{2},#{3},$)".format(number + 1, _format_step_string(occurrence_name), definition, part_definition))
+        usage_shape = _add("PRODUCT_DEFINITION_SHAPE('','',#{0})".format(usage))
+        transformation = _add("ITEM_DEFINED_TRANSFORMATION('','',#{0},#{1})".format(part_axis, placements[number + 1]))
+        relationship = _add(
+            "(REPRESENTATION_RELATIONSHIP('','',#{0},#{1})REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION(#{2})SHAPE_REPRESENTATION_RELATIONSHIP())".format(
+                part_representation, representation, transformation
+            )
+        )
+        _add("CONTEXT_DEPENDENT_SHAPE_REPRESENTATION(#{0},#{1})".format(relationship, usage_shape))
+
+    temp_path = output_path + ".tmp"
+    with open(temp_path, 'wb') as output_file:
+        output_file.write(b"ISO-10303-21;\nHEADER;\nFILE_DESCRIPTION((''),'2;1');\n")
+        output_file.write("FILE_NAME({0},'',(''),(''),'Alibre Neutralizer','','');\n".format(_format_step_string(os.path.basename(output_path))).encode("utf-8"))
+        output_file.write(schema + b"\nENDSEC;\nDATA;\n")
+        for part_path in part_order:
+            offset = parts[part_path][0]
+            with StepFile(part_path) as part_step:
+                for _, _, start, end in part_step.iter_entities():
+                    output_file.write(renumber_step_entity(part_step.read_entity(start, end), offset))
+                    output_file.write(b"\n")
+        output_file.write("\n".join(lines).encode("utf-8"))
+        output_file.write(b"\nENDSEC;\nEND-ISO-10303-21;\n")
+    _replace_file(temp_path, output_path)
+
+# -- STEP COMPACTION --
+
+# Entities that are merged when they're identical. These are pure values, so it doesn't matter which copy something points to.
+# Anything else (like two identical faces) stays separate, since they might mean different things.
+STEP_MERGEABLE_ENTITIES = (b"CARTESIAN_POINT", b"DIRECTION", b"VECTOR")
+
+def compact_step_file(step_path):
+    """Merge duplicate points, directions and vectors in a STEP file, and renumber every entity in a canonical order, in place.
+
+    Every entity gets a hash of its contents, with each reference replaced by the hash of the entity it points to, so entities that only
+    differ in numbering get the same hash. Entities are then renumbered depth-first (children before parents) starting from the entities
+    nothing points to, in hash order. The result only depends on the file's contents, not how Alibre numbered it, so exporting the same
+    part twice gives the same file, and a small change to a part gives a small diff.
+
+    No entity text is kept in memory, and everything that grows with the file is kept in flat arrays: about 60 bytes per entity in all.
+    To find duplicates, entities are split into 256 buckets by the first byte of their hash, so only one bucket's worth of hashes
+    is ever in a dictionary at once. A 20 MB file with 600,000 entities needs about 40 MB, on top of the memory map of the file itself.
+
+    :return: The number of entities before and after merging.
+    :rtype: tuple[int, int]
+    """
+    # type: (str) -> tuple[int, int]
+    _HASHED, _REFERENCED, _MERGEABLE, _VISITING = 1, 2, 4, 8 # bits in flags
+
+    with StepFile(step_path) as step:
+        index = StepEntityIndex()
+        entity_ids = array.array(_STEP_OFFSET_TYPECODE) # in file order, for when two entities hash the same
+        flags = bytearray()
+        for entity_id, type_name, start, end in step.iter_entities():
+            index.add(entity_id, start, end)
+            entity_ids.append(entity_id)
+            if entity_id >= len(flags):
+                flags.extend(bytearray(max(entity_id + 1, 2 * len(flags)) - len(flags)))
+            if type_name in STEP_MERGEABLE_ENTITIES:
+                flags[entity_id] |= _MERGEABLE
+        max_id = len(flags) - 1
+        hashes = bytearray(8 * (max_id + 1)) # first 8 bytes of a SHA-1 of each entity
+
+        def _read(entity_id):
+            return step.read_entity(*index.get(entity_id))
+
+        def _canonical_body(body, reference_text):
+            # The body with each reference replaced by reference_text(id)
+            def _replace(match):
+                if match.group(1) is None:
+                    return match.group(0)
+                return reference_text(int(match.group(1)))
+            return _STEP_STRING_OR_REFERENCE_PATTERN.sub(_replace, body)
+
+        def _hash_reference(reference):
+            if index.get(reference) is None or not flags[reference] & _HASHED:
+                return "#{0}".format(reference).encode("ascii") # A dangling reference, or a cycle
+            return b"@" + binascii.hexlify(bytes(hashes[8 * reference:8 * reference + 8]))
+
+        # Hash every entity, children first
+        for entity_id in entity_ids:
+            entity_id = int(entity_id)
+            if flags[entity_id] & _HASHED:
+                continue
+            stack = [entity_id]
+            while stack:
+                current = stack[-1]
+                if flags[current] & _HASHED:
+                    stack.pop()
+                    continue
+                text = _read(current)
+                references = [reference for reference in get_step_references(text) if index.get(reference) is not None]
+                if not flags[current] & _VISITING:
+                    flags[current] |= _VISITING
+                    unhashed = [reference for reference in references if not flags[reference] & (_HASHED | _VISITING)]
+                    if len(unhashed) > 0:
+                        stack.extend(reversed(unhashed))
+                        continue
+                for reference in references:
+                    flags[reference] |= _REFERENCED
+                hashes[8 * current:8 * current + 8] = hashlib.sha1(_canonical_body(get_step_entity_body(text), _hash_reference)).digest()[:8]
+                flags[current] |= _HASHED
+                flags[current] &= ~_VISITING & 0xFF
+                stack.pop()
+
+        def _hash_of(entity_id):
+            return bytes(hashes[8 * entity_id:8 * entity_id + 8])
+
+        # Give every group of identical mergeable entities a number, one bucket (by the first byte of the hash) at a time
+        buckets = [array.array('i') for _ in range(256)]
+        for entity_id in entity_ids:
+            entity_id = int(entity_id)
+            if flags[entity_id] & _MERGEABLE:
+                buckets[hashes[8 * entity_id]].append(entity_id)
+        group_ids = array.array('i', [0]) * (max_id + 1) # 0 means not mergeable
+        group_count = 0
+        for bucket_number in range(256):
+            groups = {} # hash -> group number, for this bucket only
+            for entity_id in buckets[bucket_number]:
+                group_ids[entity_id] = groups.setdefault(_hash_of(entity_id), group_count + len(groups) + 1)
+            group_count += len(groups)
+            buckets[bucket_number] = None
+        group_new_ids = array.array(_STEP_OFFSET_TYPECODE, [0]) * (group_count + 1) # new id of each group, 0 until it's numbered
+
+        # The roots (entities nothing points to), in hash order. Sorting each bucket gives the same order as sorting them all at once.
+        root_buckets = [array.array('i') for _ in range(256)]
+        for position, entity_id in enumerate(entity_ids):
+            if not flags[int(entity_id)] & _REFERENCED:
+                root_buckets[hashes[8 * int(entity_id)]].append(position)
+
+        def _iter_roots():
+            for bucket in root_buckets:
+                for position in sorted(bucket, key=lambda position: (_hash_of(int(entity_ids[position])), position)):
+                    yield int(entity_ids[position])
+
+        # Number everything depth-first from the roots, merging duplicates as we go. Then anything only reachable through a cycle.
+        start_ids = itertools.chain(_iter_roots(), (int(entity_id) for entity_id in entity_ids))
+        new_ids = array.array(_STEP_OFFSET_TYPECODE, [0]) * (max_id + 1) # 0 means not numbered yet
+        old_ids = array.array(_STEP_OFFSET_TYPECODE, [0]) # old id of each new id
+        for start_id in start_ids:
+            if new_ids[start_id] != 0:
+                continue
+            stack = [(start_id, None)]
+            while stack:
+                current, references = stack.pop()
+                if references is None and new_ids[current] != 0:
+                    continue
+                if flags[current] & _MERGEABLE and group_new_ids[group_ids[current]] != 0:
+                    new_ids[current] = group_new_ids[group_ids[current]]
+                    continue
+                if references is None:
+                    references = [reference for reference in get_step_references(_read(current)) if index.get(reference) is not None and new_ids[reference] == 0]
+                    new_ids[current] = -1 # visiting
+                    stack.append((current, references))
+                    stack.extend((reference, None) for reference in reversed(references) if new_ids[reference] == 0)
+                    continue
+                new_ids[current] = len(old_ids)
+                old_ids.append(current)
+                if flags[current] & _MERGEABLE:
+                    group_new_ids[group_ids[current]] = len(old_ids) - 1
+
+        def _new_reference(reference):
+            if index.get(reference) is None:
+                return "#{0}".format(reference).encode("ascii") # Leave dangling references as they are
+            return "#{0}".format(int(new_ids[reference])).encode("ascii")
+
+        temp_path = step_path + ".tmp"
+        with open(temp_path, 'wb') as output_file:
+            output_file.write(step.read(0, step.header_end).lstrip())
+            output_file.write(b"\n")
+            for new_id in range(1, len(old_ids)):
+                output_file.write("#{0}=".format(new_id).encode("ascii"))
+                output_file.write(_canonical_body(get_step_entity_body(_read(int(old_ids[new_id]))), _new_reference))
+                output_file.write(b"\n")
+            output_file.write(b"ENDSEC;\nEND-ISO-10303-21;\n")
+        entity_count = len(entity_ids)
+
+    _replace_file(temp_path, step_path)
+    return entity_count, len(old_ids) - 1
+
+# -- STEP CONTENT INDEX --
+
+# Columns of the STEP index. Number and Path are filled in by the caller; the rest come from compute_step_index().
+STEP_INDEX_COLUMNS = [
+    "Number", "Path", "Schema", "ApplicationProtocol", "LengthUnits", "Products", "EntityCount", "EntityCounts", "BoundingBoxMin", "BoundingBoxMax",
+]
+
+# Application protocols, by the start of the schema name in FILE_SCHEMA
+STEP_APPLICATION_PROTOCOLS = [
+    ("CONFIG_CONTROL_DESIGN", "AP203"),
+    ("AP203", "AP203"),
+    ("AUTOMOTIVE_DESIGN", "AP214"),
+    ("AP214", "AP214"),
+    ("AP242", "AP242"),
+]
+
+# Names of SI length units, by prefix (see SI_UNIT in ISO 10303-41)
+_STEP_SI_PREFIXES = {b"$": "", b"MILLI": "milli", b"CENTI": "centi", b"DECI": "deci", b"KILO": "kilo", b"MICRO": "micro", b"NANO": "nano"}
+
+# The constituent type names of a complex entity, like "( LENGTH_UNIT() NAMED_UNIT(*) SI_UNIT(.MILLI.,.METRE.) )"
+_STEP_COMPLEX_PART_PATTERN = re.compile(br"([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+_STEP_SI_UNIT_PATTERN = re.compile(br"SI_UNIT\s*\(\s*\.?([A-Z$]+)\.?\s*,\s*\.METRE\.\s*\)")
+
+def compute_step_index(step_path, chunk_size=65536):
+    """Scan a STEP file and return its schema, length units, products, entity counts and bounding box.
+
+    The file is streamed (see ``StepFile``), so this works on files of any size. Entity counts are by type, with complex entities
+    counted under each of their types. The bounding box is the range of every 3D ``CARTESIAN_POINT`` in the file, which includes things like
+    B-spline control points, so it can be a bit bigger than the shape itself. Points aren't moved to where their parts are placed,
+    so for assemblies it's the range of the parts' own coordinates. Points are collected in chunks, and each chunk's range
+    is found with vectorized NumPy where it's available.
+
+    :return: A dictionary with keys matching ``STEP_INDEX_COLUMNS`` (except Number and Path).
+    :rtype: dict
+    """
+    # type: (str, int) -> dict
+    entity_count = 0
+    entity_counts = {}
+    products = []
+    length_units = []
+    bbox_min = [float("inf")] * 3
+    bbox_max = [float("-inf")] * 3
+    pending_points = []
+
+    def _flush_points():
+        if len(pending_points) == 0:
+            return
+        if numpy is not None:
+            points = numpy.array(pending_points, dtype=float).reshape(-1, 3)
+            bbox_min[:] = numpy.minimum(bbox_min, points.min(axis=0)).tolist()
+            bbox_max[:] = numpy.maximum(bbox_max, points.max(axis=0)).tolist()
+        else:
+            for axis in range(3):
+                values = pending_points[axis::3]
+                bbox_min[axis] = min(bbox_min[axis], min(values))
+                bbox_max[axis] = max(bbox_max[axis], max(values))
+        del pending_points[:]
+
+    with StepFile(step_path) as step:
+        for _, type_name, start, end in step.iter_entities():
+            entity_count += 1
+            if type_name == b"(":
+                text = step.read_entity(start, end)
+                type_names = [name.upper() for name in _STEP_COMPLEX_PART_PATTERN.findall(_STEP_STRING_PATTERN.sub(b"''", text))]
+                if b"LENGTH_UNIT" in type_names:
+                    unit = _get_step_length_unit_name(text, type_names)
+                    if unit not in length_units:
+                        length_units.append(unit)
+            else:
+                type_names = [type_name]
+            for name in type_names:
+                name = name.decode("ascii")
+                entity_counts[name] = entity_counts.get(name, 0) + 1
+
+            if type_name == b"CARTESIAN_POINT":
+                body = _STEP_STRING_PATTERN.sub(b"''", step.read_entity(start, end))
+                coordinates = body[body.rindex(b"(") + 1:body.index(b")", body.rindex(b"("))].split(b",")
+                if len(coordinates) == 3:
+                    pending_points.extend(float(coordinate) for coordinate in coordinates)
+                    if len(pending_points) >= 3 * chunk_size:
+                        _flush_points()
+            elif type_name == b"PRODUCT":
+                strings = get_step_strings(step.read_entity(start, end)) + [b"", b""]
+                products.append((strings[1] or strings[0]).decode("utf-8", "replace"))
+        _flush_points()
+
+        schema_match = re.search(br"FILE_SCHEMA\s*\(\s*\(\s*'((?:[^']|'')*)'", step.read(0, step.header_end or 0))
+        schema = schema_match.group(1).decode("utf-8", "replace").strip() if schema_match is not None else None
+
+    application_protocol = None
+    for prefix, protocol in STEP_APPLICATION_PROTOCOLS:
+        if schema is not None and schema.upper().startswith(prefix):
+            application_protocol = protocol
+            break
+
+    has_points = bbox_min[0] <= bbox_max[0]
+    return {
+        "Schema": schema,
+        "ApplicationProtocol": application_protocol,
+        "LengthUnits": length_units,
+        "Products": products,
+        "EntityCount": entity_count,
+        "EntityCounts": entity_counts,
+        "BoundingBoxMin": bbox_min if has_points else None,
+        "BoundingBoxMax": bbox_max if has_points else None,
+    }
+
+def _get_step_length_unit_name(entity_text, type_names):
+    """Return a readable name for a complex LENGTH_UNIT entity, like ``millimetre`` or ``INCH``."""
+    # type: (bytes, list[bytes]) -> str
+    if b"CONVERSION_BASED_UNIT" in type_names:
+        strings = get_step_strings(entity_text)
+        if len(strings) > 0:
+            return strings[0].decode("utf-8", "replace")
+    match = _STEP_SI_UNIT_PATTERN.search(entity_text.upper())
+    if match is not None and match.group(1) in _STEP_SI_PREFIXES:
+        return _STEP_SI_PREFIXES[match.group(1)] + "metre"
+    return "unknown"
+
+# -- RUN METRICS --
+
+# Upper bounds (in seconds) of the export duration histogram buckets. Most part exports take well under a second, big assemblies can take minutes.
+EXPORT_DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _format_metric_value(value):
+    """Format a number the way Prometheus expects: integers without a decimal point, floats in full."""
+    # type: (int | float) -> str
+    if value == float("inf"):
+        return "+Inf"
+    if float(value) == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+def _format_metric_labels(labels):
+    """Format a list of (name, value) label pairs as ``{name="value",...}``, escaped for the Prometheus text format."""
+    # type: (list[tuple[str, str]]) -> str
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(
+        '{0}="{1}"'.format(name, u"{0}".format(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+    ) + "}"
+
+class RunMetrics:
+    """Counts and timings for a single run, written as a Prometheus text file (for node-exporter's textfile collector) at the end of the run.
+
+    Everything describes the last run only, so counts are gauges rather than counters. Export durations are also kept as a histogram per
+    export type (see ``EXPORT_DURATION_BUCKETS``), which is what you want to alert on if exports start getting slower."""
+
+    def __init__(self):
+        # type: (RunMetrics) -> None
+        self.started = time.time()
+        self.purge_seconds = 0.0
+        self.bytes_written = 0
+        self.export_counts = {} # (export type string, "success" or "failure") -> count
+        self.export_durations = {} # export type string -> list of seconds
+        self.components_seen = set()
+        self.components_exported = set()
+        self.components_failed = set()
+
+    def record_export(self, component_file_name, export_type_string, seconds, succeeded):
+        """Record one export (including its post-processing) of a component."""
+        # type: (RunMetrics, str, str, float, bool) -> None
+        key = (export_type_string, "success" if succeeded else "failure")
+        self.export_counts[key] = self.export_counts.get(key, 0) + 1
+        self.export_durations.setdefault(export_type_string, []).append(seconds)
+        self.components_exported.add(component_file_name)
+        if not succeeded:
+            self.components_failed.add(component_file_name)
+
+    def write(self, metrics_path):
+        """Write the metrics to ``metrics_path``. The file is written next to it first and then renamed, so the collector never reads half of it."""
+        # type: (RunMetrics, str) -> None
+        lines = []
+
+        def _add(name, metric_type, help_text, samples):
+            lines.append("# HELP {0} {1}".format(name, help_text))
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append("{0}{1}{2} {3}".format(name, suffix, _format_metric_labels(labels), _format_metric_value(value)))
+
+        _add("alibre_neutralizer_exports", "gauge", "Exports in the last run, by export type and result.", [
+            ("", [("export_type", export_type), ("result", result)], count) for (export_type, result), count in sorted(self.export_counts.items())
+        ])
+
+        histogram_samples = []
+        for export_type, durations in sorted(self.export_durations.items()):
+            for bucket in EXPORT_DURATION_BUCKETS + (float("inf"),):
+                histogram_samples.append(("_bucket", [("export_type", export_type), ("le", _format_metric_value(bucket))], len([d for d in durations if d <= bucket])))
+            histogram_samples.append(("_sum", [("export_type", export_type)], sum(durations)))
+            histogram_samples.append(("_count", [("export_type", export_type)], len(durations)))
+        _add("alibre_neutralizer_export_duration_seconds", "histogram", "How long each export took in the last run, including post-processing that doesn't run in the background.", histogram_samples)
+
+        _add("alibre_neutralizer_components", "gauge", "Components in the last run that were exported (processed), had nothing to export (skipped), or had an export fail (failed).", [
+            ("", [("state", "failed")], len(self.components_failed)),
+            ("", [("state", "processed")], len(self.components_exported)),
+            ("", [("state", "skipped")], len(self.components_seen - self.components_exported)),
+        ])
+        _add("alibre_neutralizer_written_bytes", "gauge", "Total size of the files written in the last run.", [("", [], self.bytes_written)])
+        _add("alibre_neutralizer_purge_duration_seconds", "gauge", "Time the last run spent purging and removing stale exports.", [("", [], self.purge_seconds)])
+        _add("alibre_neutralizer_run_duration_seconds", "gauge", "Wall time of the last run.", [("", [], time.time() - self.started)])
+        _add("alibre_neutralizer_last_run_timestamp_seconds", "gauge", "When the last run finished, in seconds since the Unix epoch.", [("", [], int(time.time()))])
+
+        metrics_dir = os.path.dirname(metrics_path)
+        if not os.path.exists(metrics_dir):
+            os.makedirs(metrics_dir)
+        temp_path = metrics_path + ".tmp"
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+        _replace_file(temp_path, metrics_path)
+
+# -- TREE-LEVEL REPORTS --
+
+def _get_report_path(abs_path, report_dir):
+    """Return how a report at ``report_dir`` refers to ``abs_path``: relative to the report with forward slashes, or absolute if
+    there's no relative path (on Windows, when the file is on a different drive)."""
+    # type: (str, str) -> str
+    try:
+        return os.path.relpath(abs_path, report_dir).replace(os.sep, "/")
+    except ValueError:
+        return abs_path.replace(os.sep, "/")
+
+def write_report(report_path, rows_by_path, columns, merge_existing, key_column="Path", moved_paths=None):
+    """Write a tree-level report, with one row per exported file (or per ``key_column``), as CSV or JSON depending on the extension of ``report_path``.
+
+    Each row is a dictionary with a ``Path`` key holding the absolute path of the file it describes. In the report, paths are written
+    relative to the report, with forward slashes. Rows are sorted by the first column, then by path, so the report diffs nicely.
+
+    :param merge_existing: Keep rows from the existing report for files that weren't in ``rows_by_path``, as long as they still exist.
+    :type merge_existing: bool
+    :param key_column: The column that identifies a row. A row replaces any row (new or merged) with the same value in this column,
+        so with ``"Number"`` the report has one row per part number. If several new rows share a key, the one with the last path wins.
+    :type key_column: str
+    :param moved_paths: Files that moved since the existing report was written, as ``(old path, new path)`` tuples of absolute paths.
+        Merged rows for them follow them to their new paths.
+    :type moved_paths: list[tuple[str, str]] | None
+    """
+    # type: (str, dict[str, dict], list[str], bool, str, list[tuple[str, str]] | None) -> None
+    report_dir = os.path.dirname(report_path)
+    is_json = report_path.lower().endswith(".json")
+
+    rows = {}
+    if merge_existing and os.path.isfile(report_path):
+        if is_json:
+            with open(report_path, 'r') as report_file:
+                old_rows = json.load(report_file)
+        else:
+            with open(report_path, 'r') as report_file:
+                old_rows = list(csv.DictReader(report_file))
+        moved = dict((os.path.normcase(old_path), new_path) for old_path, new_path in moved_paths or [])
+        for row in old_rows:
+            path = os.path.normpath(os.path.join(report_dir, row["Path"].replace("/", os.sep)))
+            if os.path.normcase(path) in moved:
+                path = moved[os.path.normcase(path)]
+                row["Path"] = _get_report_path(path, report_dir)
+            if os.path.isfile(path):
+                rows[row[key_column]] = row
+
+    new_keys = set()
+    for abs_path in sorted(rows_by_path.keys()):
+        row = dict(rows_by_path[abs_path])
+        row["Path"] = _get_report_path(abs_path, report_dir)
+        if row[key_column] in new_keys:
+            log.warning("{0} and {1} both have the {2} {3}, so only {1} is in {4}".format(
+                rows[row[key_column]]["Path"], row["Path"], key_column, row[key_column], report_path
+            ), path=report_path)
+        new_keys.add(row[key_column])
+        rows[row[key_column]] = row
+
+    sorted_rows = sorted(rows.values(), key=lambda row: (u"{0}".format(row.get(columns[0])), row["Path"]))
+
+    if not os.path.exists(report_dir):
+        os.makedirs(report_dir)
+    temp_path = report_path + ".tmp"
+    if is_json:
+        with open(temp_path, 'w') as report_file:
+            json.dump([dict((column, row.get(column)) for column in columns) for row in sorted_rows], report_file, indent=2, sort_keys=True, separators=(",", ": "))
+    else:
+        # If you don't put "wb" here, it puts an extra blank row between every row (see _export_properties_to_csv)
+        with open(temp_path, 'wb' if sys.version_info[0] < 3 else 'w') as report_file:
+            writer = csv.writer(report_file)
+            writer.writerow(columns)
+            for row in sorted_rows:
+                writer.writerow([row.get(column) for column in columns])
+    _replace_file(temp_path, report_path)
+
+# -- SCRATCH SYNC --
+
+SYNC_CHUNK_SIZE = 4 * 1024 * 1024
+
+def copy_file_in_chunks(source_path, destination_path, chunk_size=SYNC_CHUNK_SIZE):
+    """Copy a file with big sequential reads and writes (a network share handles a few large writes much better than lots of small ones).
+    The copy is written next to ``destination_path`` first and then moved into place, so nobody sees a half-written file."""
+    # type: (str, str, int) -> None
+    destination_dir = os.path.dirname(destination_path)
+    if not os.path.isdir(destination_dir):
+        try:
+            os.makedirs(destination_dir)
+        except OSError:
+            if not os.path.isdir(destination_dir):
+                raise # Otherwise another thread just created it
+    temp_path = destination_path + ".neutralizer-tmp"
+    with open(source_path, 'rb') as source_file:
+        with open(temp_path, 'wb') as destination_file:
+            shutil.copyfileobj(source_file, destination_file, chunk_size)
+    _replace_file(temp_path, destination_path)
+
+def _read_sync_state(state_path):
+    """Read a ``sync_tree()`` state file, or return an empty state if there isn't one."""
+    # type: (str) -> dict[str, list]
+    if not os.path.isfile(state_path):
+        return {}
+    with open(state_path, 'r') as state_file:
+        return json.load(state_file)
+
+def _write_sync_state(state_path, state):
+    """Write a ``sync_tree()`` state file."""
+    # type: (str, dict[str, list]) -> None
+    temp_path = state_path + ".tmp"
+    with open(temp_path, 'w') as state_file:
+        json.dump(state, state_file, sort_keys=True)
+    _replace_file(temp_path, state_path)
+
+def _remove_empty_parents(path, stop_dir):
+    """Remove the directories between ``path`` and ``stop_dir`` (but not ``stop_dir`` itself) that are empty."""
+    # type: (str, str) -> None
+    directory = os.path.dirname(path)
+    while os.path.normcase(directory) != os.path.normcase(stop_dir) and os.path.normcase(directory).startswith(os.path.normcase(stop_dir) + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return # Not empty
+        directory = os.path.dirname(directory)
+
+def sync_tree(source_dir, destination_dir, state_path, worker_count=None, written_paths=None):
+    """Copy new and changed files from ``source_dir`` to ``destination_dir`` with a pool of threads, without undoing changes made at the destination.
+
+    ``state_path`` is a JSON file with, for every file as of the last sync, the size, modification time and SHA-256 of the copy in ``source_dir``,
+    and the size and modification time of the copy in ``destination_dir``. Files are only hashed again if their size or modification time changed.
+    A file that's never been synced is hashed at the destination too, if it's there and the same size, and skipped if it's identical.
+    For each file in ``source_dir``:
+
+    - If the copy in ``destination_dir`` is the one we left there (same size and modification time), it's replaced if the file changed here
+      since the last sync, and skipped otherwise. An unchanged file costs one stat on the destination.
+    - If someone changed the copy in ``destination_dir`` since the last sync (say, with a ``git pull``) and the file didn't change here,
+      their copy is kept, and copied back into ``source_dir``. If it changed on both sides, ours replaces theirs, with a warning.
+    - If someone deleted the copy in ``destination_dir``, it stays deleted, unless the file changed here or is in ``written_paths``.
+
+    Files that were synced before but are gone from ``source_dir`` are deleted from ``destination_dir``, unless someone changed them there
+    since the last sync. Nothing else in ``destination_dir`` is touched.
+
+    :param written_paths: Normcased absolute paths of files in ``source_dir`` that were written since the last sync, or None to treat every file as written.
+    :type written_paths: set[str] | None
+
+    :return: ``(copied, skipped, deleted, hashes)``, where ``hashes`` has the ``(size, sha256)`` of every file, keyed by the normcased absolute path of its copy in ``destination_dir``.
+    :rtype: tuple[int, int, int, dict[str, tuple[int, str]]]
+    """
+    # type: (str, str, str, int | None, set[str] | None) -> tuple[int, int, int, dict[str, tuple[int, str]]]
+    state = _read_sync_state(state_path)
+
+    relative_paths = []
+    for root, _, files in os.walk(source_dir):
+        for file in files:
+            relative_paths.append(os.path.relpath(os.path.join(root, file), source_dir).replace(os.sep, "/"))
+
+    def _sync(relative_path):
+        source_path = os.path.join(source_dir, *relative_path.split("/"))
+        destination_path = os.path.join(destination_dir, *relative_path.split("/"))
+        stat = os.stat(source_path)
+        last_sync = state.get(relative_path) # [size, mtime, sha256, destination size, destination mtime]
+        if last_sync is not None and last_sync[0] == stat.st_size and last_sync[1] == stat.st_mtime:
+            sha256 = last_sync[2]
+        else:
+            sha256 = _sha256_of_file(source_path)
+        changed_here = last_sync is None or last_sync[2] != sha256
+        try:
+            destination_stat = os.stat(destination_path)
+        except OSError:
+            destination_stat = None # It's not at the destination (anymore)
+
+        if destination_stat is None:
+            if not changed_here and written_paths is not None and os.path.normcase(source_path) not in written_paths:
+                log.debug("- Not copying {0}, since it was deleted there".format(destination_path), path=destination_path)
+                return None, last_sync, False
+            changed_there = False
+        elif last_sync is None:
+            # Never synced (e.g. the first sync into a folder that's already full of exports). If it's already there, there's nothing to copy.
+            if destination_stat.st_size == stat.st_size and _sha256_of_file(destination_path) == sha256:
+                return destination_path, [stat.st_size, stat.st_mtime, sha256, destination_stat.st_size, destination_stat.st_mtime], False
+            changed_there = True
+        elif len(last_sync) < 5:
+            changed_there = destination_stat.st_size != last_sync[0] # From before we recorded the destination's side
+        else:
+            changed_there = destination_stat.st_size != last_sync[3] or destination_stat.st_mtime != last_sync[4]
+
+        if changed_there and not changed_here:
+            # Someone else updated it, and we didn't, so theirs is the one to keep
+            log.info("- {0} changed there since the last sync, so it was copied back to {1}".format(destination_path, source_dir), path=destination_path)
+            copy_file_in_chunks(destination_path, source_path)
+            stat = os.stat(source_path)
+            sha256 = _sha256_of_file(source_path)
+            was_copied = False
+        elif changed_here or destination_stat is None:
+            if changed_there and last_sync is not None:
+                log.warning("{0} changed there since the last sync, but it was exported again, so it was replaced".format(destination_path), path=destination_path)
+            copy_file_in_chunks(source_path, destination_path)
+            destination_stat = os.stat(destination_path)
+            was_copied = True
+        else:
+            was_copied = False
+        return destination_path, [stat.st_size, stat.st_mtime, sha256, destination_stat.st_size, destination_stat.st_mtime], was_copied
+
+    results = _run_in_thread_pool(_sync, relative_paths, worker_count)
+
+    new_state = {}
+    hashes = {}
+    copied = 0
+    for relative_path, (destination_path, file_state, was_copied) in zip(relative_paths, results):
+        if file_state is not None:
+            new_state[relative_path] = file_state
+        if destination_path is not None:
+            hashes[os.path.normcase(destination_path)] = (file_state[0], file_state[2])
+        if was_copied:
+            copied += 1
+
+    deleted = 0
+    for relative_path in sorted(set(state.keys()) - set(new_state.keys())):
+        last_sync = state[relative_path]
+        destination_path = os.path.join(destination_dir, *relative_path.split("/"))
+        if not os.path.isfile(destination_path):
+            continue
+        destination_stat = os.stat(destination_path)
+        if len(last_sync) >= 5 and (destination_stat.st_size != last_sync[3] or destination_stat.st_mtime != last_sync[4]):
+            log.info("- Not deleting {0}, since it changed there since the last sync".format(destination_path), path=destination_path)
+            continue
+        try:
+            os.remove(destination_path)
+            deleted += 1
+        except OSError as e:
+            log.error("Could not delete {0}: {1}".format(destination_path, e), path=destination_path)
+            new_state[relative_path] = last_sync # Try again next time
+            continue
+        _remove_empty_parents(destination_path, destination_dir)
+
+    _write_sync_state(state_path, new_state)
+    return copied, len(relative_paths) - copied, deleted, hashes
+
+class AlibreNeutralizer:
+    """Create an instance of this, with an Alibre Assembly passed in, to handle the backend logic of recursively exporting files."""
+
+    def __init__(self, component, config_file_path):
+        # type: (AlibreNeutralizer, Assembly | AssembledSubAssembly, str) -> None
+        """Create and configure an instance of AlibreNeutralizer from an XML configuration file.
+        
+        :type self: AlibreNeutralizer
+
+        :param component: The top-level assembly that you want to recursively export.
+        :type component: Assembly | AssembledSubAssembly
+
+        :param config_file_path: Path to the XML configuration file that defines the export configuration.
+        :type config_file_path: str
+        """
+
+        # Store the root assembly or part, our main connection point to Alibre
+        if isinstance(component, Assembly):
+            self.root_component = component
+        else:
+            raise Exception("Cannot initialize AssemblyNeutralizer without a valid Alibre Assembly object.")
+
+        # Read the configuration file
+        tree = ET.parse(config_file_path)
+        root = tree.getroot()
+        
+        # Store the config file path.
+        # This is used to interpret the "Base Path" from the config file, since it's specified RELATIVE to the config file's location.
+        self.config_file_path = config_file_path
+        # Get the base path from config
+        base_path_elem = root.find('BaseExportPath')
+        self.base_path = os.path.normpath(base_path_elem.text) if base_path_elem is not None and base_path_elem.text is not None else os.path.normpath('.')
+
+        # Logging settings (optional). These come first, so everything after this is logged the way the config says. Paths are relative to the config file.
+        logging_elem = root.find('Logging')
+        console_level_elem = root.find('Logging/ConsoleLevel')
+        sinks = []
+        if logging_elem is not None:
+            for sink_elem, json_lines in [(elem, False) for elem in logging_elem.findall('File')] + [(elem, True) for elem in logging_elem.findall('JsonLines')]:
+                sink_path_elem = sink_elem.find('Path')
+                if sink_path_elem is None or sink_path_elem.text is None or sink_path_elem.text.strip() == "":
+                    raise Exception("Logging File and JsonLines settings need a Path.")
+                sink_level_elem = sink_elem.find('Level')
+                sinks.append(LogFileSink(
+                    os.path.normpath(os.path.join(os.path.dirname(os.path.normpath(config_file_path)), sink_path_elem.text.strip())),
+                    level=LogLevels.convert_from_string(sink_level_elem.text) if sink_level_elem is not None and sink_level_elem.text is not None else LogLevels.DEBUG,
+                    json_lines=json_lines
+                ))
+        log.configure(
+            console_level=LogLevels.convert_from_string(console_level_elem.text) if console_level_elem is not None and console_level_elem.text is not None else LogLevels.INFO,
+            progress_interval=_float_from_elem(root.find('Logging/ProgressIntervalSeconds'), 1.0),
+            sinks=sinks
+        )
+        
+        # Parse export directives from config
+        self.export_directives = []
+        for directive in root.find('ExportDirectiveList').findall('ExportDirective'):
+            export_type = getattr(ExportTypes, directive.find('type').text)
+            path_expression = directive.find('RelativeExportPath').text
+            purge_directory = directive.find('PurgeDirectoryBeforeExporting').text if directive.find('PurgeDirectoryBeforeExporting') is not None else None
+
+            # Read boolean flags (default to True if the element is missing)
+            enable_root = _bool_from_elem(directive.find('EnableRootAssemblyExport'), True)
+            enable_sub = _bool_from_elem(directive.find('EnableSubassemblyExport'), True)
+            enable_part = _bool_from_elem(directive.find('EnablePartExport'), True)
+
+            # Per-directive Include/Exclude rules
+            directive_filter = ComponentFilter.from_config_element(directive.find('ComponentFilters'), allow_leaf_rules=False)
+
+            # Post-processing stages (default to off if the element is missing)
+            convert_stl_to_binary = _bool_from_elem(directive.find('ConvertSTLToBinary'), False)
+            validate_mesh = _bool_from_elem(directive.find('ValidateMesh'), False)
+            keep_unchanged_geometry = _bool_from_elem(directive.find('KeepUnchangedGeometry'), False)
+            geometry_tolerance = _float_from_elem(directive.find('GeometryTolerance'), DEFAULT_GEOMETRY_TOLERANCE)
+            lod_resolutions = [int(_float_from_elem(elem, 0)) for elem in directive.findall('LevelsOfDetail/Resolution')]
+            package_path_elem = directive.find('BuildPlatePackages/RelativeExportPath')
+            package_path_expression = package_path_elem.text.strip() if package_path_elem is not None and package_path_elem.text is not None else None
+            keep_packaged_stls = _bool_from_elem(directive.find('BuildPlatePackages/KeepSTLs'), True)
+            package_unit_elem = directive.find('BuildPlatePackages/Unit')
+            package_unit = package_unit_elem.text.strip() if package_unit_elem is not None and package_unit_elem.text is not None else "millimeter"
+            split_assembly_step = _bool_from_elem(directive.find('SplitAssemblySTEP'), False)
+            synthesize_assembly_step = _bool_from_elem(directive.find('SynthesizeAssemblySTEP'), False)
+            compact_step = _bool_from_elem(directive.find('CompactSTEP'), False)
+            compress_output = _bool_from_elem(directive.find('CompressOutput'), False)
+            compression_level = int(_float_from_elem(directive.find('CompressionLevel'), 6))
+            release_bundle_elem = directive.find('ReleaseBundle/Path')
+            release_bundle_path = release_bundle_elem.text.strip() if release_bundle_elem is not None and release_bundle_elem.text is not None else None
+            max_files_elem = directive.find('MaxFilesPerDirectory')
+            max_files_per_directory = int(_float_from_elem(max_files_elem, 0)) if max_files_elem is not None else None
+
+            self.export_directives.append(
+                ExportDirective(
+                    export_type=export_type,
+                    export_rel_path_expression=path_expression,
+                    purge_directory_before_export=purge_directory,
+                    export_root_assembly=enable_root,
+                    export_subassemblies=enable_sub,
+                    export_parts=enable_part,
+                    component_filter=directive_filter,
+                    convert_stl_to_binary=convert_stl_to_binary,
+                    validate_mesh=validate_mesh,
+                    keep_unchanged_geometry=keep_unchanged_geometry,
+                    geometry_tolerance=geometry_tolerance,
+                    lod_resolutions=lod_resolutions,
+                    package_path_expression=package_path_expression,
+                    keep_packaged_stls=keep_packaged_stls,
+                    package_unit=package_unit,
+                    split_assembly_step=split_assembly_step,
+                    synthesize_assembly_step=synthesize_assembly_step,
+                    compact_step=compact_step,
+                    compress_output=compress_output,
+                    compression_level=compression_level,
+                    release_bundle_path=release_bundle_path,
+                    max_files_per_directory=max_files_per_directory
+                )
+            )
+
+        # Global Include/Exclude/TreatAsLeaf rules. Excluded subassemblies are skipped along with everything inside them,
+        # and leaf subassemblies are exported without descending into them.
+        self.component_filter = ComponentFilter.from_config_element(root.find('ComponentFilters'), allow_leaf_rules=True)
+
+        # Suppressed occurrences are skipped by default, since they're not really part of the assembly.
+        # Hidden ones are still exported unless you ask otherwise.
+        self.component_filter.skip_suppressed = _bool_from_elem(root.find('SkipSuppressedComponents'), True)
+        self.component_filter.skip_hidden = _bool_from_elem(root.find('SkipHiddenComponents'), False)
+
+        # Watch mode settings (optional). When enabled, the export keeps running after the initial export,
+        # and re-exports components as their native files change on disk.
+        watch_elem = root.find('WatchMode')
+        if watch_elem is not None:
+            self.watch_mode_enabled = _bool_from_elem(watch_elem.find('Enabled'), False)
+            self.watch_poll_interval = _float_from_elem(watch_elem.find('PollIntervalSeconds'), 2.0)
+            self.watch_debounce = _float_from_elem(watch_elem.find('DebounceSeconds'), 5.0)
+        else:
+            self.watch_mode_enabled = False
+            self.watch_poll_interval = 2.0
+            self.watch_debounce = 5.0
+
+        # Machine-wide export cache settings (optional)
+        cache_elem = root.find('ExportCache')
+        if cache_elem is not None and _bool_from_elem(cache_elem.find('Enabled'), True):
+            cache_path_elem = cache_elem.find('Path')
+            if cache_path_elem is not None and cache_path_elem.text is not None and cache_path_elem.text.strip() != "":
+                cache_dir = os.path.expandvars(os.path.expanduser(cache_path_elem.text.strip()))
+            else:
+                cache_dir = os.path.join(os.path.expanduser("~"), ".alibre-neutralizer-cache")
+            self.export_cache = ExportCache(
+                cache_dir=os.path.normpath(cache_dir),
+                max_size_bytes=int(_float_from_elem(cache_elem.find('MaxSizeMB'), 2048) * 1024 * 1024),
+                use_hard_links=_bool_from_elem(cache_elem.find('UseHardLinks'), False)
+            )
+        else:
+            self.export_cache = None
+
+        # Checksum manifest settings (optional). Paths are relative to the config file.
+        config_dir = os.path.dirname(os.path.normpath(self.config_file_path))
+        manifest_path_elem = root.find('Manifest/Path')
+        if manifest_path_elem is not None and manifest_path_elem.text is not None and manifest_path_elem.text.strip() != "":
+            self.manifest_path = os.path.normpath(os.path.join(config_dir, manifest_path_elem.text.strip()))
+        else:
+            self.manifest_path = None
+        # Extra native files to track in the manifest, like an .AD_PKG Package, since the files Alibre actually opens are usually outside the repo
+        self.manifest_extra_source_files = [
+            os.path.normpath(os.path.join(config_dir, elem.text.strip()))
+            for elem in root.findall('Manifest/SourceFile') if elem.text is not None and elem.text.strip() != ""
+        ]
+
+        # Mesh statistics report settings (optional). The path is relative to the config file.
+        mesh_statistics_path_elem = root.find('MeshStatistics/Path')
+        if mesh_statistics_path_elem is not None and mesh_statistics_path_elem.text is not None and mesh_statistics_path_elem.text.strip() != "":
+            self.mesh_statistics_path = os.path.normpath(os.path.join(config_dir, mesh_statistics_path_elem.text.strip()))
+        else:
+            self.mesh_statistics_path = None
+
+        # Mesh validation settings (optional). Validation itself is turned on per directive with <ValidateMesh>;
+        # this just sets the tolerance, and where to write the report (relative to the config file).
+        self.mesh_validation_tolerance = _float_from_elem(root.find('MeshValidation/MergeTolerance'), STL_DEFAULT_MERGE_TOLERANCE)
+        mesh_validation_path_elem = root.find('MeshValidation/Path')
+        if mesh_validation_path_elem is not None and mesh_validation_path_elem.text is not None and mesh_validation_path_elem.text.strip() != "":
+            self.mesh_validation_path = os.path.normpath(os.path.join(config_dir, mesh_validation_path_elem.text.strip()))
+        else:
+            self.mesh_validation_path = None
+
+        # STEP index settings (optional). The path is relative to the config file.
+        step_index_path_elem = root.find('StepIndex/Path')
+        if step_index_path_elem is not None and step_index_path_elem.text is not None and step_index_path_elem.text.strip() != "":
+            self.step_index_path = os.path.normpath(os.path.join(config_dir, step_index_path_elem.text.strip()))
+            if not self.step_index_path.lower().endswith(".json"):
+                raise Exception("The StepIndex Path must be a .json file.")
+        else:
+            self.step_index_path = None
+
+        # Run metrics settings (optional). The path is relative to the config file.
+        metrics_path_elem = root.find('Metrics/Path')
+        if metrics_path_elem is not None and metrics_path_elem.text is not None and metrics_path_elem.text.strip() != "":
+            self.metrics_path = os.path.normpath(os.path.join(config_dir, metrics_path_elem.text.strip()))
+            if not self.metrics_path.lower().endswith(".prom"):
+                raise Exception("The Metrics Path must be a .prom file, or node-exporter's textfile collector won't read it.")
+        else:
+            self.metrics_path = None
+
+        # Staged export settings (optional). Each directive's purge directory is built in a sibling staging directory, then swapped in with renames.
+        self.staged_export_enabled = _bool_from_elem(root.find('StagedExport/Enabled'), False)
+        if self.staged_export_enabled:
+            for edir in self.export_directives:
+                if edir.purge_before_export is None:
+                    log.warning("The {0} Export Directive doesn't have a PurgeDirectoryBeforeExporting, so it writes straight into the export tree instead of being staged.".format(
+                        ExportTypes.convert_to_string(edir.export_type)
+                    ))
+
+        # Local scratch settings (optional). Everything is exported to a local folder first, then synced to BaseExportPath at the end of each run.
+        scratch_elem = root.find('LocalScratch')
+        if scratch_elem is not None and _bool_from_elem(scratch_elem.find('Enabled'), True):
+            scratch_path_elem = scratch_elem.find('Path')
+            if scratch_path_elem is not None and scratch_path_elem.text is not None and scratch_path_elem.text.strip() != "":
+                scratch_path = os.path.expandvars(os.path.expanduser(scratch_path_elem.text.strip()))
+            else:
+                # One folder per destination, so projects don't share a scratch folder
+                destination_hash = hashlib.sha1(os.path.normcase(self._convert_base_path_to_absolute()).encode("utf-8")).hexdigest()[:12]
+                scratch_path = os.path.join(os.path.expanduser("~"), ".alibre-neutralizer-scratch", destination_hash)
+            self.scratch_path = os.path.normpath(scratch_path)
+            self.scratch_sync_worker_count = int(_float_from_elem(scratch_elem.find('SyncThreads'), _default_worker_count()))
+        else:
+            self.scratch_path = None
+            self.scratch_sync_worker_count = None
+
+        # Post-processing that doesn't need Alibre (like generating levels of detail) runs here, in the background
+        self.background_tasks = BackgroundTaskPool()
+
+        # Per-run state, reset by _start_run()
+        self._start_run()
+
+        # Selective export settings (optional). If the list of changed native files exists when we run,
+        # only the components affected by those changes are exported.
+        changed_list_elem = root.find('SelectiveExport/ChangedFilesListPath')
+        if changed_list_elem is not None and changed_list_elem.text is not None and changed_list_elem.text.strip() != "":
+            self.changed_files_list_path = os.path.normpath(
+                os.path.join(
+                    os.path.dirname(os.path.normpath(self.config_file_path)),
+                    changed_list_elem.text.strip()
                 )
             )
+        else:
+            self.changed_files_list_path = None
 
     
     def export_all(self):
@@ -328,9 +3936,18 @@ class AlibreNeutralizer:
         # Note that we use absolute paths (e.g. C:\wherever\myThing.AD_PRT) over Alibre's .Name property, because .Name includes the instance ID (the "<37>" type thing) at the end, while the filename does not.
         # May need to change this in the future if we want to export directly from PDM instead of from a package, since FileName is None in PDM.
 
-        # Step 1: Purge old files, if applicable
+        self._start_run()
+        self._seed_scratch()
+        self._begin_staging()
+        self._move_exports_into_shards()
+
+        # Step 1: Purge old files, if applicable.
+        # Directives that keep unchanged geometry need the old files to compare against, so their stale files are removed at the end instead.
+        purge_started = time.time()
         for edir in self.export_directives:
-            self._purge_according_to_export_directive(edir)
+            if not edir.keep_unchanged_geometry:
+                self._purge_according_to_export_directive(edir)
+        self._metrics.purge_seconds += time.time() - purge_started
         
         # Step 2 : Export the Root Assembly
         # if none of the export directives call for this, this function won't do anything
@@ -348,8 +3965,826 @@ class AlibreNeutralizer:
         #     exported_files.append(newly_exported_names)
         for subassy in self.root_component.SubAssemblies:
             processed_files = processed_files.union(
-                self._export_subassemblies_recursive(subassy, self.export_directives, processed_files)
+                self._export_subassemblies_recursive(subassy, self.export_directives, processed_files, self.root_component)
+            )
+
+        # Step 5: Remove stale files for the directives we didn't purge up front
+        deferred_purge_directives = [edir for edir in self.export_directives if edir.keep_unchanged_geometry]
+        if len(deferred_purge_directives) > 0:
+            purge_started = time.time()
+            index = DependencyIndex(self.root_component, self.component_filter)
+            plan = self._build_export_plan(index)
+            for edir in deferred_purge_directives:
+                self._remove_stale_exports(edir, plan, index)
+            self._metrics.purge_seconds += time.time() - purge_started
+
+        # Step 6: Record what we exported
+        self._finish_run(merge_existing=False)
+
+    def export_selective(self, changed_paths):
+        """Only export the components affected by a list of changed native files (for example, the output of ``git diff --name-only``).
+
+        Each changed path is matched against the end of every component's ``FileName``, so paths relative to the repository root work fine.
+        The affected components are the changed ones plus every assembly that contains them. Outputs that no longer belong to any component
+        (e.g. from a removed part) are deleted from the purge directories, instead of purging everything.
+
+        If a Package (``.AD_PKG``) changed, we have no way of knowing what changed inside it, so we fall back to ``export_all()``.
+
+        :param changed_paths: List of changed file paths. Paths that aren't native Alibre files are ignored.
+        :type changed_paths: list[str]
+        """
+        # type: (AlibreNeutralizer, list[str]) -> None
+
+        changed_paths = [os.path.normcase(os.path.normpath(path.strip())) for path in changed_paths if path.strip() != ""]
+        if any(path.endswith(os.path.normcase(".AD_PKG")) for path in changed_paths):
+            log.info("A Package file changed, so every component is potentially affected. Running a full export.")
+            self.export_all()
+            return
+
+        index = DependencyIndex(self.root_component, self.component_filter)
+        changed_file_names = set()
+        for file_name in index.get_native_file_names():
+            normalized_file_name = os.path.normcase(os.path.normpath(file_name))
+            for path in changed_paths:
+                if normalized_file_name == path or normalized_file_name.endswith(os.sep + path):
+                    changed_file_names.add(file_name)
+        affected_file_names = set(index.get_affected_file_names(changed_file_names))
+
+        self._start_run()
+        self._seed_scratch()
+        self._begin_staging()
+        self._move_exports_into_shards()
+        self._affected_file_names = affected_file_names
+
+        plan = self._build_export_plan(index)
+        log.info("{0} changed native files affect {1} of {2} components.".format(len(changed_paths), len(affected_file_names), len(index.components)))
+
+        # Step 1: Remove outputs that no component maps to anymore
+        purge_started = time.time()
+        for edir in self.export_directives:
+            self._remove_stale_exports(edir, plan, index)
+        self._metrics.purge_seconds += time.time() - purge_started
+
+        # Step 2: Only run the (component, directive) pairs from the plan that were affected
+        for file_name, edir, _ in plan:
+            if file_name not in affected_file_names:
+                continue
+            if file_name == index.root_file_name:
+                self._export_root_assembly_with_directive(edir)
+            else:
+                self._execute_single_export_directive(index.components[file_name], edir)
+
+        # Step 3: Update the manifest and reports, keeping the entries of everything we didn't touch
+        self._finish_run(merge_existing=True)
+
+    def _build_export_plan(self, index, sharded=True):
+        """Work out every (component, directive) pair that a full export would run, without exporting anything.
+
+        :param sharded: Set to False to get the paths before they're spread into shard directories (see ``_get_shard_prefix_lengths()``).
+        :type sharded: bool
+
+        :return: A list of ``(FileName, ExportDirective, absolute export path)`` tuples."""
+        # type: (AlibreNeutralizer, DependencyIndex, bool) -> list[tuple[str, ExportDirective, str]]
+        plan = []
+        for file_name in index.get_affected_file_names(index.get_native_file_names()):
+            component = index.components[file_name]
+            for edir in self.export_directives:
+                if file_name == index.root_file_name:
+                    applies = edir.export_root_assembly
+                elif file_name in index.assemblies:
+                    applies = edir.export_subassemblies
+                else:
+                    applies = edir.export_parts
+                if applies == True and edir.component_filter.is_included(component):
+                    export_path_abs = self._get_absolute_export_path(edir.get_export_path(component))
+                    plan.append((file_name, edir, self._shard_export_path(edir, export_path_abs) if sharded else export_path_abs))
+        return plan
+
+    def _get_directive_export_path(self, export_directive, component):
+        """Return the absolute path a directive exports a component to, in its shard directory if the directive has ``max_files_per_directory`` set."""
+        # type: (AlibreNeutralizer, ExportDirective, Part | Assembly | AssembledPart | AssembledSubAssembly) -> str
+        return self._shard_export_path(export_directive, self._get_absolute_export_path(export_directive.get_export_path(component)))
+
+    def _shard_export_path(self, export_directive, export_path_abs):
+        """Move an absolute export path into its shard directory, if its directory needs sharding."""
+        # type: (AlibreNeutralizer, ExportDirective, str) -> str
+        if export_directive.max_files_per_directory is None:
+            return export_path_abs
+        directory, file_name = os.path.split(export_path_abs)
+        prefix_length = self._get_shard_prefix_lengths().get(os.path.normcase(directory), 0)
+        if prefix_length == 0:
+            return export_path_abs
+        return os.path.join(directory, get_shard_name(file_name, prefix_length), file_name)
+
+    def _get_shard_prefix_lengths(self):
+        """Work out which export directories need sharding, and how many hex digits of hash their shard directories need (once per run).
+
+        Every directory that directives with ``max_files_per_directory`` set export to gets the shortest prefix that keeps every shard
+        within the limit (0 if it's within the limit already), based on every file a full export would write there.
+        Since shards only depend on file names, files only move when a directory grows past (or shrinks below) what its prefix can hold.
+
+        :return: Prefix lengths, keyed by the normcased absolute path of the directory.
+        :rtype: dict[str, int]
+        """
+        # type: (AlibreNeutralizer) -> dict[str, int]
+        if self._shard_prefix_lengths is not None:
+            return self._shard_prefix_lengths
+
+        self._shard_prefix_lengths = {}
+        if not any(edir.max_files_per_directory is not None for edir in self.export_directives):
+            return self._shard_prefix_lengths
+
+        # Each export can bring its levels of detail along with it
+        file_names = {} # directory -> set of file names
+        limits = {} # directory -> the smallest limit of any directive exporting there
+        index = DependencyIndex(self.root_component, self.component_filter)
+        for _, edir, export_path_abs in self._build_export_plan(index, sharded=False):
+            if edir.max_files_per_directory is None:
+                continue
+            directory, file_name = os.path.split(export_path_abs)
+            directory = os.path.normcase(directory)
+            file_names.setdefault(directory, set()).add(file_name)
+            limit = max(1, edir.max_files_per_directory // (1 + len(edir.lod_resolutions)))
+            limits[directory] = min(limits.get(directory, limit), limit)
+
+        for directory, names in file_names.items():
+            prefix_length = 0
+            while prefix_length < 8:
+                counts = {}
+                for name in names:
+                    shard = get_shard_name(name, prefix_length)
+                    counts[shard] = counts.get(shard, 0) + 1
+                if max(counts.values()) <= limits[directory]:
+                    break
+                prefix_length += 1
+            self._shard_prefix_lengths[directory] = prefix_length
+        return self._shard_prefix_lengths
+
+    def _move_exports_into_shards(self):
+        """Move files exported by earlier runs into the shard directories this run uses, with renames.
+
+        A directory's prefix length changes when it grows past (or shrinks below) what its prefix can hold, and then most of its files
+        belong in a different shard. A full export writes them all there anyway, but selective exports and watch mode only re-export the
+        affected components, so everything else has to be moved, or it would be left behind (and then removed as stale).
+        This runs at the start of every run, before anything is exported or removed. The moves are kept in ``self._moved_exports``,
+        so the manifest and reports can follow the files."""
+        # type: (AlibreNeutralizer) -> None
+        if not any(edir.max_files_per_directory is not None for edir in self.export_directives):
+            return
+
+        index = DependencyIndex(self.root_component, self.component_filter)
+        moved_count = 0
+        emptied_directories = set()
+        for _, edir, export_path_abs in self._build_export_plan(index, sharded=False):
+            if edir.max_files_per_directory is None:
+                continue
+
+            def _with_siblings(path):
+                # The export, plus whatever is written next to it
+                paths = [path] + edir.get_lod_export_paths(path)
+                if edir.compress_output:
+                    paths.append(edir.get_compressed_export_path(path))
+                return paths
+
+            sharded_path = self._shard_export_path(edir, export_path_abs)
+            directory, file_name = os.path.split(export_path_abs)
+            for prefix_length in range(9):
+                old_directory = os.path.join(directory, get_shard_name(file_name, prefix_length)) if prefix_length > 0 else directory
+                if os.path.normcase(old_directory) == os.path.normcase(os.path.dirname(sharded_path)) or not os.path.isdir(old_directory):
+                    continue
+                for old_path, new_path in zip(_with_siblings(os.path.join(old_directory, file_name)), _with_siblings(sharded_path)):
+                    if not os.path.isfile(old_path) or os.path.exists(new_path):
+                        continue
+                    if not os.path.isdir(os.path.dirname(new_path)):
+                        os.makedirs(os.path.dirname(new_path))
+                    os.rename(old_path, new_path)
+                    self._moved_exports.append((old_path, new_path))
+                    moved_count += 1
+                    if prefix_length > 0:
+                        emptied_directories.add(old_directory)
+
+        # Tidy up shard directories that don't have anything left in them
+        for directory in emptied_directories:
+            if len(os.listdir(directory)) == 0:
+                os.rmdir(directory)
+        if moved_count > 0:
+            log.info("- Moved {0} files into new shard directories".format(moved_count))
+
+    def _remove_stale_exports(self, export_directive, plan, index):
+        """Delete files in the Export Directive's purge directory that aren't produced by any entry in ``plan``
+        (``index`` is the DependencyIndex the plan was built from). If the purge functionality is disabled for this Export Directive, nothing is deleted."""
+        # type: (AlibreNeutralizer, ExportDirective, list[tuple[str, ExportDirective, str]], DependencyIndex) -> None
+        extensions = export_directive.get_extensions_to_purge()
+        if len(extensions) == 0:
+            return
+
+        planned_paths = set()
+        for file_name, edir, path in plan:
+            if edir is export_directive:
+                planned_paths.add(os.path.normcase(path))
+                planned_paths.update(os.path.normcase(lod_path) for lod_path in edir.get_lod_export_paths(path))
+                if edir.compress_output:
+                    planned_paths.add(os.path.normcase(edir.get_compressed_export_path(path)))
+                if edir.package_path_expression is not None and file_name not in index.assemblies:
+                    planned_paths.add(os.path.normcase(self._get_package_path(edir, index.components[file_name])))
+        purge_path = self._get_purge_path(export_directive)
+        for root, _, files in os.walk(purge_path):
+            for file in files:
+                file_path = os.path.join(root, file)
+                if any(file.endswith(ext) for ext in extensions) and os.path.normcase(file_path) not in planned_paths:
+                    log.info("- Removing stale export: {0}".format(file_path))
+                    try:
+                        os.remove(file_path)
+                    except OSError as e:
+                        log.error("Could not delete stale export {file_path}: {e}".format(file_path=file_path, e=e), path=file_path)
+
+    def watch(self):
+        """Watch the native files of every component in ``self.root_component`` for changes, and re-export only the
+        changed components and the assemblies that contain them. This runs until the script is stopped.
+
+        Changes are debounced: we wait until no file has changed for ``self.watch_debounce`` seconds, then export
+        everything that changed in that window at once. This way a "Save All" only triggers one re-export of each assembly."""
+        # type: (AlibreNeutralizer) -> None
+
+        index = DependencyIndex(self.root_component, self.component_filter)
+        known_mtimes = self._get_native_file_mtimes(index)
+        pending_changes = set()
+        last_change_time = None
+
+        log.info("Watching {0} native files for changes. Stop the script to exit watch mode.".format(len(known_mtimes)))
+        try:
+            while True:
+                time.sleep(self.watch_poll_interval)
+
+                current_mtimes = self._get_native_file_mtimes(index)
+                changed = set(
+                    file_name for file_name, mtime in current_mtimes.items()
+                    if known_mtimes.get(file_name) != mtime
+                )
+                known_mtimes = current_mtimes
+
+                if changed:
+                    pending_changes = pending_changes.union(changed)
+                    last_change_time = time.time()
+                elif pending_changes and (time.time() - last_change_time) >= self.watch_debounce:
+                    try:
+                        # If an assembly changed, components may have been added or removed, so re-index before exporting.
+                        # Anything that's new to the tree gets exported too.
+                        if len(pending_changes.intersection(index.assemblies)) > 0:
+                            old_file_names = set(index.get_native_file_names())
+                            index = DependencyIndex(self.root_component, self.component_filter)
+                            pending_changes = pending_changes.union(set(index.get_native_file_names()) - old_file_names)
+                            known_mtimes = self._get_native_file_mtimes(index)
+
+                        self._export_affected_components(index, pending_changes)
+                        pending_changes = set()
+                    except Exception as e:
+                        # e.g. an assembly that was only half saved, or a network drive that went away. Keep the changes, and try again
+                        # after the next debounce period, rather than ending watch mode.
+                        log.error("Could not re-export the changed components, will try again in {0} seconds: {1}".format(self.watch_debounce, e))
+                        last_change_time = time.time()
+        except KeyboardInterrupt:
+            log.info("Watch mode stopped.")
+
+    def _get_native_file_mtimes(self, index):
+        """Return a dictionary of FileName -> last modified time for every native file in the DependencyIndex.
+        Files that can't be read (e.g. deleted files) map to None."""
+        # type: (AlibreNeutralizer, DependencyIndex) -> dict[str, float | None]
+        mtimes = {}
+        for file_name in index.get_native_file_names():
+            try:
+                mtimes[file_name] = os.path.getmtime(file_name)
+            except (OSError, TypeError):
+                mtimes[file_name] = None
+        return mtimes
+
+    def _export_affected_components(self, index, changed_file_names):
+        """Re-export the changed components and every assembly that contains them, following all the Export Directives.
+        This does NOT purge anything first."""
+        # type: (AlibreNeutralizer, DependencyIndex, set[str]) -> None
+        affected_file_names = index.get_affected_file_names(changed_file_names)
+        log.info("Detected changes in {0} native files, re-exporting {1} components.".format(len(changed_file_names), len(affected_file_names)))
+        self._start_run()
+        self._seed_scratch()
+        self._begin_staging()
+        self._move_exports_into_shards()
+        self._affected_file_names = set(affected_file_names)
+
+        for file_name in affected_file_names:
+            if file_name == index.root_file_name:
+                self._export_root_assembly()
+            else:
+                for edir in self.export_directives:
+                    self._execute_single_export_directive(index.components[file_name], edir)
+
+        self._finish_run(merge_existing=True)
+
+    def _start_run(self):
+        """Reset everything we keep track of during a single run (a full export, a selective export, or one round of watch mode)."""
+        # type: (AlibreNeutralizer) -> None
+
+        # Every file written during the current run, as (absolute path, native FileName, export type string) tuples
+        self._export_records = []
+
+        # How many exports we've started in the current run, for the progress line
+        self._export_count = 0
+
+        # Counts and timings for the metrics file
+        self._metrics = RunMetrics()
+
+        # Rows for the mesh statistics and mesh validation reports, keyed by absolute STL path
+        self._mesh_statistics_rows = {}
+        self._mesh_validation_rows = {}
+
+        # Rows for the STEP index, keyed by absolute STEP path. These are filled in by background tasks.
+        self._step_index_rows = {}
+
+        # Compressed copies being written in the background, keyed by the absolute path of the uncompressed file
+        self._compressed_export_paths = {}
+
+        # How export directories are sharded (see _get_shard_prefix_lengths()). Worked out when it's first needed.
+        self._shard_prefix_lengths = None
+
+        # Files from earlier runs moved into new shard directories (see _move_exports_into_shards()), as (old path, new path) tuples
+        self._moved_exports = []
+
+        # STL files we can read part meshes from for GLB scenes, keyed by FileName, and a temporary folder for any we had to export just for that
+        self._glb_mesh_sources = {}
+        self._glb_temp_dir = None
+
+        # Exports built out of other exports (GLB scenes and synthesized assembly STEP files), waiting for everything else to be exported,
+        # as (kind, component, directive, absolute path) tuples
+        self._deferred_exports = []
+
+        # FileNames of the components this run re-exports, or None if it re-exports everything. The rest are unchanged since an earlier run.
+        self._affected_file_names = None
+
+        # Root assembly STEP files we split components out of, keyed by the id() of their directive, and a temporary folder for any we had to export just for that
+        self._assembly_step_splitters = {}
+        self._step_temp_dir = None
+
+        # Part STEP files we can build assembly STEP files from, keyed by (export type, FileName)
+        self._part_step_sources = {}
+
+        # (directory, staging directory) pairs for a staged export, set up by _begin_staging() and swapped in by _finish_run()
+        self._staging_directories = []
+
+        # (size, SHA-256) of files synced from the local scratch folder, keyed by normcased absolute path, so the manifest doesn't read them back over the network
+        self._known_file_hashes = {}
+
+    def _finish_run(self, merge_existing):
+        """Write the manifest and any tree-level reports for the current run.
+
+        :param merge_existing: Keep existing entries for files we didn't export in this run (used by selective exports and watch mode).
+        :type merge_existing: bool
+        """
+        # type: (AlibreNeutralizer, bool) -> None
+
+        self._write_deferred_exports()
+
+        # Packaging might need to export some STLs again, so it has to come before we wait for background post-processing
+        packaged_stl_paths = self._write_build_plate_packages(merge_existing)
+
+        self._wait_for_background_tasks()
+
+        # Delete the uncompressed copies of compressed files, and point everything at the compressed ones instead
+        compressed_paths = dict(
+            (os.path.normcase(export_path_abs), compressed_path) for export_path_abs, compressed_path in self._compressed_export_paths.items()
+            if os.path.isfile(compressed_path)
+        )
+        if len(compressed_paths) > 0:
+            for export_path_abs in self._compressed_export_paths:
+                if os.path.normcase(export_path_abs) in compressed_paths and os.path.isfile(export_path_abs):
+                    os.remove(export_path_abs)
+            self._export_records = [record for record in self._export_records if os.path.normcase(record[0]) not in compressed_paths]
+            for export_path_abs in list(self._step_index_rows.keys()):
+                if os.path.normcase(export_path_abs) in compressed_paths:
+                    compressed_path = compressed_paths[os.path.normcase(export_path_abs)]
+                    row = self._step_index_rows.pop(export_path_abs)
+                    row["Path"] = compressed_path
+                    self._step_index_rows[compressed_path] = row
+
+        # Delete loose STLs that directives only wanted in packages, and forget about them
+        if len(packaged_stl_paths) > 0:
+            deleted_paths = set()
+            for stl_path in packaged_stl_paths:
+                if os.path.isfile(stl_path):
+                    os.remove(stl_path)
+                deleted_paths.add(os.path.normcase(stl_path))
+            self._export_records = [record for record in self._export_records if os.path.normcase(record[0]) not in deleted_paths]
+            for rows in (self._mesh_statistics_rows, self._mesh_validation_rows):
+                for stl_path in list(rows.keys()):
+                    if os.path.normcase(stl_path) in deleted_paths:
+                        del rows[stl_path]
+
+        if self._glb_temp_dir is not None:
+            shutil.rmtree(self._glb_temp_dir, ignore_errors=True)
+            self._glb_temp_dir = None
+        for splitter in self._assembly_step_splitters.values():
+            if splitter is not None:
+                splitter.close()
+        self._assembly_step_splitters = {}
+        if self._step_temp_dir is not None:
+            shutil.rmtree(self._step_temp_dir, ignore_errors=True)
+            self._step_temp_dir = None
+
+        # Everything in the staging directories is finished, so swap them in and point everything at where the files are now
+        if len(self._staging_directories) > 0:
+            self._swap_in_staged_directories()
+            self._export_records = [(self._get_unstaged_path(record[0]),) + tuple(record[1:]) for record in self._export_records]
+            self._moved_exports = [(self._get_unstaged_path(old_path), self._get_unstaged_path(new_path)) for old_path, new_path in self._moved_exports]
+            for rows in (self._mesh_statistics_rows, self._mesh_validation_rows, self._step_index_rows):
+                for path in list(rows.keys()):
+                    row = rows.pop(path)
+                    row["Path"] = self._get_unstaged_path(path)
+                    rows[row["Path"]] = row
+            self._staging_directories = []
+            self._shard_prefix_lengths = None # These were worked out for the staging directories
+
+        self._write_release_bundles()
+        if self.scratch_path is not None:
+            self._sync_scratch()
+        self._write_manifest(merge_existing)
+        if self.mesh_statistics_path is not None:
+            write_report(self.mesh_statistics_path, self._mesh_statistics_rows, MESH_STATISTICS_COLUMNS, merge_existing, key_column="Number", moved_paths=self._moved_exports)
+            log.info("Wrote mesh statistics for {0} STL files to {1}".format(len(self._mesh_statistics_rows), self.mesh_statistics_path))
+
+        invalid_count = len([row for row in self._mesh_validation_rows.values() if not row["Valid"]])
+        if invalid_count > 0:
+            log.warning("{0} of {1} validated meshes have problems. See the warnings above{2}.".format(
+                invalid_count, len(self._mesh_validation_rows),
+                " or " + self.mesh_validation_path if self.mesh_validation_path is not None else ""
+            ))
+        if self.mesh_validation_path is not None and len(self._mesh_validation_rows) > 0:
+            write_report(self.mesh_validation_path, self._mesh_validation_rows, MESH_VALIDATION_COLUMNS, merge_existing, moved_paths=self._moved_exports)
+
+        if self.step_index_path is not None:
+            write_report(self.step_index_path, self._step_index_rows, STEP_INDEX_COLUMNS, merge_existing, moved_paths=self._moved_exports)
+            log.info("Wrote the STEP index for {0} STEP files to {1}".format(len(self._step_index_rows), self.step_index_path))
+
+        if self.metrics_path is not None:
+            for export_path_abs, _, _ in self._export_records:
+                if os.path.normcase(export_path_abs) in self._known_file_hashes:
+                    self._metrics.bytes_written += self._known_file_hashes[os.path.normcase(export_path_abs)][0]
+                elif os.path.isfile(export_path_abs):
+                    self._metrics.bytes_written += os.path.getsize(export_path_abs)
+            self._metrics.write(self.metrics_path)
+
+        # Components may be suppressed or unsuppressed before the next run (in watch mode)
+        self.component_filter.clear_occurrence_states()
+
+        log.info("Finished exporting ({0} exports in this run).".format(self._export_count))
+        log.flush()
+
+    def _wait_for_background_tasks(self):
+        """Wait for background post-processing, and record the files it wrote."""
+        # type: (AlibreNeutralizer) -> None
+        for written_files in self.background_tasks.wait():
+            for component, export_type, export_path_abs in written_files or []:
+                self._record_export(component, export_type, export_path_abs)
+
+    def _wait_for_step_compaction(self):
+        """STEP files are compacted in place, in the background (see ``_export_and_post_process()``).
+        Wait for that to finish before reading STEP files written in this run."""
+        # type: (AlibreNeutralizer) -> None
+        if any(edir.compact_step for edir in self.export_directives):
+            self._wait_for_background_tasks()
+
+    def _begin_staging(self):
+        """For a staged export, set up a staging directory next to each directive's purge directory, with every file already there hard-linked in.
+        Until ``_finish_run()`` swaps them in, everything the run writes under a purge directory goes to its staging directory instead
+        (see ``_get_staged_path()``), so anyone reading the export tree sees the last complete export the whole time.
+
+        Staging directories are siblings of the directories they replace, so they're on the same volume and the swap is just two renames.
+        Purge directories inside another purge directory are staged along with it. Directives without a purge directory aren't staged.
+        """
+        # type: (AlibreNeutralizer) -> None
+        self._staging_directories = []
+        if not self.staged_export_enabled:
+            return
+
+        directories = {}
+        for edir in self.export_directives:
+            if edir.purge_before_export is not None:
+                directory = self._get_purge_path(edir)
+                directories[os.path.normcase(directory)] = directory
+        for key in sorted(directories.keys()):
+            directory = directories[key]
+            if any(key.startswith(os.path.normcase(outer) + os.sep) for outer, _ in self._staging_directories):
+                continue
+            if os.path.dirname(directory) == directory:
+                raise Exception("Can't stage {0}, since it's the root of a drive. Point PurgeDirectoryBeforeExporting at a folder instead.".format(directory))
+
+            staging_directory = directory + ".neutralizer-staging"
+            if os.path.exists(staging_directory):
+                # Left over from a run that didn't finish
+                shutil.rmtree(staging_directory)
+            if os.path.isdir(directory):
+                linked, copied = link_tree(directory, staging_directory)
+                log.info("- Staging {0} in {1} ({2} files hard-linked, {3} copied)".format(directory, staging_directory, linked, copied))
+            else:
+                os.makedirs(staging_directory)
+                log.info("- Staging {0} in {1}".format(directory, staging_directory))
+            self._staging_directories.append((directory, staging_directory))
+
+    def _swap_in_staged_directories(self):
+        """Replace each staged directory with its staging directory. The old directory is renamed aside, the staging directory
+        renamed into its place, and then the old one is deleted. If a rename fails (on Windows, usually because a file in the directory is open),
+        the old directory is put back and the staging directory is left where it is, so nothing is lost.
+
+        Afterwards, ``self._staging_directories`` only has the directories that were swapped in."""
+        # type: (AlibreNeutralizer) -> None
+        swapped = []
+        for directory, staging_directory in self._staging_directories:
+            old_directory = directory + ".neutralizer-old"
+            if os.path.exists(old_directory):
+                shutil.rmtree(old_directory)
+            moved_aside = False
+            try:
+                if os.path.exists(directory):
+                    os.rename(directory, old_directory)
+                    moved_aside = True
+                os.rename(staging_directory, directory)
+            except OSError as e:
+                if moved_aside:
+                    os.rename(old_directory, directory)
+                log.error("Could not swap in {0}, so this export is still in {1}: {2}".format(directory, staging_directory, e), path=directory)
+                continue
+            log.info("- Swapped in {0}".format(directory))
+            swapped.append((directory, staging_directory))
+            if moved_aside:
+                shutil.rmtree(old_directory, ignore_errors=True)
+        self._staging_directories = swapped
+
+    def _get_staged_path(self, path):
+        """During a staged export, return where ``path`` is written until it's swapped in. Paths that aren't being staged are returned as-is."""
+        # type: (AlibreNeutralizer, str) -> str
+        normalized_path = os.path.normcase(path)
+        for directory, staging_directory in self._staging_directories:
+            normalized_directory = os.path.normcase(directory)
+            if normalized_path == normalized_directory or normalized_path.startswith(normalized_directory + os.sep):
+                return staging_directory + path[len(directory):]
+        return path
+
+    def _get_unstaged_path(self, path):
+        """The opposite of ``_get_staged_path()``: return where a path in a staging directory ends up once it's swapped in."""
+        # type: (AlibreNeutralizer, str) -> str
+        normalized_path = os.path.normcase(path)
+        for directory, staging_directory in self._staging_directories:
+            normalized_directory = os.path.normcase(staging_directory)
+            if normalized_path == normalized_directory or normalized_path.startswith(normalized_directory + os.sep):
+                return directory + path[len(staging_directory):]
+        return path
+
+    def _seed_scratch(self):
+        """The first time we export with a local scratch folder, fill it with a copy of what's already at ``BaseExportPath``,
+        so things like keeping unchanged geometry and selective exports have the previous export to work from."""
+        # type: (AlibreNeutralizer) -> None
+        if self.scratch_path is None or os.path.isdir(self.scratch_path):
+            return
+        os.makedirs(self.scratch_path)
+        destination = self._convert_base_path_to_absolute()
+        if os.path.isdir(destination):
+            log.info("- Copying {0} to the local scratch folder {1}".format(destination, self.scratch_path))
+            copied, _, _, _ = sync_tree(destination, self.scratch_path, self.scratch_path + ".seed.json", self.scratch_sync_worker_count)
+            log.info("- Copied {0} files".format(copied))
+            # The seed's state has the two sides the other way around. Swap them, so the first push knows every file is already there.
+            seed_state = _read_sync_state(self.scratch_path + ".seed.json")
+            _write_sync_state(self.scratch_path + ".sync.json", dict(
+                (relative_path, [entry[3], entry[4], entry[2], entry[0], entry[1]]) for relative_path, entry in seed_state.items()
+            ))
+
+    def _sync_scratch(self):
+        """Push new and changed files from the local scratch folder to ``BaseExportPath`` (see ``sync_tree()``),
+        then point everything we recorded in this run at where the files are now. Files this run wrote are pushed even if they were deleted there."""
+        # type: (AlibreNeutralizer) -> None
+        destination = self._convert_base_path_to_absolute()
+        log.info("- Syncing {0} to {1}".format(self.scratch_path, destination))
+        try:
+            written_paths = set(os.path.normcase(record[0]) for record in self._export_records)
+            copied, skipped, deleted, hashes = sync_tree(
+                self.scratch_path, destination, self.scratch_path + ".sync.json", self.scratch_sync_worker_count, written_paths
             )
+        except (IOError, OSError) as e:
+            log.error("Could not sync {0} to {1}, so this export is only in the local scratch folder: {2}".format(self.scratch_path, destination, e), path=destination)
+            return
+        log.info("- Synced {0} files ({1} unchanged, {2} deleted)".format(copied, skipped, deleted))
+        self._known_file_hashes = hashes
+
+        self._export_records = [(self._get_destination_path(record[0]),) + tuple(record[1:]) for record in self._export_records]
+        self._moved_exports = [(self._get_destination_path(old_path), self._get_destination_path(new_path)) for old_path, new_path in self._moved_exports]
+        for rows in (self._mesh_statistics_rows, self._mesh_validation_rows, self._step_index_rows):
+            for path in list(rows.keys()):
+                row = rows.pop(path)
+                row["Path"] = self._get_destination_path(path)
+                rows[row["Path"]] = row
+
+    def _get_destination_path(self, path):
+        """Return where a path in the local scratch folder ends up at ``BaseExportPath``. Other paths are returned as-is."""
+        # type: (AlibreNeutralizer, str) -> str
+        if self.scratch_path is None:
+            return path
+        normalized_path = os.path.normcase(path)
+        normalized_scratch_path = os.path.normcase(self.scratch_path)
+        if normalized_path == normalized_scratch_path or normalized_path.startswith(normalized_scratch_path + os.sep):
+            return self._convert_base_path_to_absolute() + path[len(self.scratch_path):]
+        return path
+
+    def _write_build_plate_packages(self, merge_existing):
+        """Write a 3MF package for every group of parts, for each directive with ``package_path_expression`` set.
+        Each package contains every part in its group, with the quantity of each part from the whole assembly.
+
+        :param merge_existing: Only rewrite packages containing a part that was exported in this run, or whose parts or quantities changed
+            (used by selective exports and watch mode).
+        :type merge_existing: bool
+
+        :return: Paths of loose STLs that were packaged by directives that don't keep them, for the caller to delete.
+        :rtype: list[str]
+        """
+        # type: (AlibreNeutralizer, bool) -> list[str]
+        package_directives = [edir for edir in self.export_directives if edir.package_path_expression is not None]
+        if len(package_directives) == 0:
+            return []
+
+        index = DependencyIndex(self.root_component, self.component_filter)
+        quantities = index.get_quantities()
+        plan = self._build_export_plan(index)
+        exported_paths = set(os.path.normcase(export_path_abs) for export_path_abs, _, _ in self._export_records)
+        stl_paths_to_delete = []
+
+        for edir in package_directives:
+            # Group this directive's parts (but not assemblies) by package
+            groups = {} # package path -> list of (FileName, STL path)
+            for file_name, plan_edir, stl_path in plan:
+                if plan_edir is edir and file_name not in index.assemblies:
+                    groups.setdefault(self._get_package_path(edir, index.components[file_name]), []).append((file_name, stl_path))
+
+            for package_path in sorted(groups.keys()):
+                members = sorted(groups[package_path], key=lambda member: (edir.get_prettified_component_properties(index.components[member[0]])["Number"], member[0]))
+                contents = [(edir.get_prettified_component_properties(index.components[file_name])["Number"], quantities.get(file_name, 1)) for file_name, _ in members]
+                if (merge_existing and os.path.isfile(package_path)
+                        and not any(os.path.normcase(stl_path) in exported_paths for _, stl_path in members)
+                        and read_3mf_package_contents(package_path) == contents):
+                    continue # Nothing in this package changed (an assembly change can add or remove parts, or change quantities, without re-exporting any)
+
+                objects = []
+                for (file_name, stl_path), (number, quantity) in zip(members, contents):
+                    component = index.components[file_name]
+                    if not os.path.isfile(stl_path):
+                        # Its loose STL was deleted after it was packaged last time
+                        log.debug("- Exporting Part to STL for packaging: {0}".format(component.Name))
+                        self._export_with_directive(component, edir, stl_path)
+                    if os.path.isfile(stl_path):
+                        objects.append((number, stl_path, quantity))
+                        if not edir.keep_packaged_stls:
+                            stl_paths_to_delete.append(stl_path)
+
+                log.info("- Writing build-plate package: {0} ({1} parts)".format(package_path, len(objects)))
+                try:
+                    write_3mf_package(package_path, objects, edir.package_unit)
+                    self._export_records.append((package_path, None, "3MF"))
+                except Exception as e:
+                    log.error("There was a problem writing build-plate package {0}: {1}".format(package_path, e), path=package_path)
+
+        return stl_paths_to_delete
+
+    def _write_release_bundles(self):
+        """Write a release bundle for each directive with ``release_bundle_path`` set, with every file the directive produces
+        (whether or not it was exported in this run), named by its path relative to the base export path."""
+        # type: (AlibreNeutralizer) -> None
+        bundle_directives = [edir for edir in self.export_directives if edir.release_bundle_path is not None]
+        if len(bundle_directives) == 0:
+            return
+
+        index = DependencyIndex(self.root_component, self.component_filter)
+        plan = self._build_export_plan(index)
+        base_path = self._get_export_base_path()
+        for edir in bundle_directives:
+            paths = set()
+            for file_name, plan_edir, export_path_abs in plan:
+                if plan_edir is not edir:
+                    continue
+                candidates = [edir.get_compressed_export_path(export_path_abs) if edir.compress_output else export_path_abs]
+                candidates.extend(edir.get_lod_export_paths(export_path_abs))
+                if edir.package_path_expression is not None and file_name not in index.assemblies:
+                    candidates.append(self._get_package_path(edir, index.components[file_name]))
+                paths.update(path for path in candidates if os.path.isfile(path))
+
+            bundle_path = self._get_absolute_export_path(os.path.normpath(edir.release_bundle_path))
+            files = [(os.path.relpath(path, base_path).replace(os.sep, "/"), path) for path in paths]
+            log.info("- Writing release bundle: {0} ({1} files)".format(bundle_path, len(files)))
+            try:
+                write_release_bundle(bundle_path, files, edir.compression_level)
+                self._export_records.append((bundle_path, None, "Bundle"))
+            except Exception as e:
+                log.error("There was a problem writing release bundle {0}: {1}".format(bundle_path, e), path=bundle_path)
+
+    def _get_package_path(self, export_directive, component):
+        """Return the absolute path of the 3MF package ``component`` belongs in, for a directive with ``package_path_expression`` set."""
+        # type: (AlibreNeutralizer, ExportDirective, Part | AssembledPart) -> str
+        return self._get_absolute_export_path(export_directive.get_export_path(component, export_directive.package_path_expression))
+
+    def _write_manifest(self, merge_existing):
+        """Write a JSON manifest listing every exported file (path, size, SHA-256, and the native file it came from),
+        plus the size and SHA-256 of the native source files. The ``verify`` command checks a repository against this manifest.
+
+        Paths are stored relative to the manifest, with forward slashes, so the manifest can be checked on any OS.
+        Native files outside the manifest's directory are only recorded by name (we don't want to publish the structure of your filesystem).
+        Nothing here includes a timestamp, so the manifest only changes when the exports do.
+
+        :param merge_existing: Keep entries from the existing manifest for files we didn't export in this run (used by selective exports).
+        :type merge_existing: bool
+        """
+        # type: (AlibreNeutralizer, bool) -> None
+        if self.manifest_path is None:
+            return
+
+        manifest_dir = os.path.dirname(self.manifest_path)
+
+        def _relative_to_manifest(path):
+            try:
+                relative_path = os.path.relpath(path, manifest_dir)
+            except ValueError:
+                return None # Different drive on Windows
+            if relative_path.startswith(os.pardir):
+                return None
+            return relative_path.replace(os.sep, "/")
+
+        file_entries = {}
+        source_entries = {}
+        if merge_existing and os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, 'r') as manifest_file:
+                old_manifest = json.load(manifest_file)
+            moved_paths = dict((os.path.normcase(old_path), new_path) for old_path, new_path in self._moved_exports)
+            for entry in old_manifest.get("files", []):
+                path = os.path.normpath(os.path.join(manifest_dir, entry["path"]))
+                if os.path.normcase(path) in moved_paths and _relative_to_manifest(moved_paths[os.path.normcase(path)]) is not None:
+                    # Moved into a new shard directory. It's the same file, so only the path changes.
+                    entry["path"] = _relative_to_manifest(moved_paths[os.path.normcase(path)])
+                    path = moved_paths[os.path.normcase(path)]
+                if os.path.isfile(path):
+                    file_entries[entry["path"]] = entry
+            for entry in old_manifest.get("sources", []):
+                source_entries[entry["path"] or entry["name"]] = entry
+
+        # Work out which files need hashing in this run
+        to_hash = [] # (entry, absolute path)
+        for abs_path, source_file_name, export_type_string in self._export_records:
+            relative_path = _relative_to_manifest(abs_path)
+            if relative_path is None or not os.path.isfile(abs_path):
+                continue
+            entry = {
+                "path" : relative_path,
+                "export_type" : export_type_string,
+                "source" : os.path.basename(source_file_name) if source_file_name else None,
+            }
+            file_entries[relative_path] = entry
+            to_hash.append((entry, abs_path))
+
+        source_paths = set(source_file_name for _, source_file_name, _ in self._export_records if source_file_name)
+        source_paths = source_paths.union(self.manifest_extra_source_files)
+        for source_path in source_paths:
+            if not os.path.isfile(source_path):
+                continue
+            entry = {
+                "path" : _relative_to_manifest(source_path),
+                "name" : os.path.basename(source_path),
+            }
+            source_entries[entry["path"] or entry["name"]] = entry
+            to_hash.append((entry, source_path))
+
+        # Hash everything in parallel
+        def _hash_entry(entry_and_path):
+            entry, abs_path = entry_and_path
+            if os.path.normcase(abs_path) in self._known_file_hashes:
+                entry["size"], entry["sha256"] = self._known_file_hashes[os.path.normcase(abs_path)]
+                return
+            entry["size"] = os.path.getsize(abs_path)
+            entry["sha256"] = _sha256_of_file(abs_path)
+        _run_in_thread_pool(_hash_entry, to_hash)
+
+        manifest = {
+            "format_version" : 1,
+            "files" : [file_entries[key] for key in sorted(file_entries.keys())],
+            "sources" : [source_entries[key] for key in sorted(source_entries.keys())],
+        }
+
+        # Sharded directories, so other tools can work out where a file is without listing directories:
+        # a file that would be at "{directory}/{name}" is at "{directory}/{get_shard_name(name, prefix_length)}/{name}" instead
+        shards = []
+        for directory, prefix_length in sorted(self._get_shard_prefix_lengths().items()):
+            relative_directory = _relative_to_manifest(self._get_destination_path(directory))
+            if prefix_length > 0 and relative_directory is not None:
+                shards.append({"directory" : relative_directory, "prefix_length" : prefix_length, "hash" : "sha1-of-utf8-name"})
+        if len(shards) > 0:
+            manifest["shards"] = shards
+
+        # Write to a temporary file first, so an interrupted run never leaves a half-written manifest behind
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True, separators=(",", ": "))
+        _replace_file(temp_path, self.manifest_path)
+        log.info("Wrote manifest of {0} exported files to {1}".format(len(manifest["files"]), self.manifest_path))
 
     def _export_parts(self, assembly, export_directives, already_processed_files):
         """Given an Assembly (or AssembledSubAssembly), an ExportDirective, and a list of already-exported files to ignore,
@@ -357,6 +4792,12 @@ class AlibreNeutralizer:
         # type (AlibreNeutralizer, Assembly | AssembledSubAssembly, list[ExportDirective], set[str]) -> set[str]
 
         for part in assembly.Parts:
+            # Skip suppressed/hidden occurrences. We don't add them to the processed files, since the same part may be active somewhere else.
+            if not self.component_filter.is_active_occurrence(part, assembly):
+                continue
+            # Skip parts excluded by the global Include/Exclude rules
+            if not self.component_filter.is_included(part):
+                continue
             # First, make sure we haven't processed this one already
             if part.FileName not in already_processed_files:
                 # Run through all the export directives on this part
@@ -372,21 +4813,34 @@ class AlibreNeutralizer:
         # type (AlibreNeutralizer)
 
         for export_directive in self.export_directives:
-            if (export_directive.export_root_assembly == True):
-                # We need to export this root Assembly
-                print "- Exporting Root Assembly to {0}: {1}".format(ExportTypes.convert_to_string(export_directive.export_type), self.root_component.Name)
-                abs_export_path = self._get_absolute_export_path(
-                    export_directive.get_export_path(self.root_component)
-                )
-                print "- Path : {0}".format(abs_export_path)
-                self._export(
-                    self.root_component,
-                    export_directive.export_type,
-                    abs_export_path
-                )
+            self._export_root_assembly_with_directive(export_directive)
+
+    def _export_root_assembly_with_directive(self, export_directive):
+        """If the given Export Directive calls for it, export the Root Assembly (``self.root_component``)."""
+        # type (AlibreNeutralizer, ExportDirective)
+
+        self._metrics.components_seen.add(self.root_component.FileName)
+        if (export_directive.export_root_assembly == True) and export_directive.component_filter.is_included(self.root_component):
+            # We need to export this root Assembly
+            abs_export_path = self._get_directive_export_path(export_directive, self.root_component)
+            self._start_export("Root Assembly", self.root_component, export_directive, abs_export_path)
+
+    def _export_subassemblies_recursive(self, subassembly, export_directives, already_processed_files, parent_assembly):
+        # type (AlibreNeutralizer, AssembledSubAssembly, list[ExportDirective], set[str], Assembly | AssembledSubAssembly) -> set[str]
+
+        # Skip suppressed/hidden occurrences, and everything inside them. Like parts, we don't add them to the processed files.
+        if not self.component_filter.is_active_occurrence(subassembly, parent_assembly):
+            return already_processed_files
 
-    def _export_subassemblies_recursive(self, subassembly, export_directives, already_processed_files):
-        # type (AlibreNeutralizer, AssembledSubAssembly, list[ExportDirective], set[str]) -> set[str]
+        # Skip this subassembly, and everything inside it, if it's excluded by the global Include/Exclude rules
+        if not self.component_filter.is_included(subassembly):
+            return already_processed_files.union({subassembly.FileName})
+
+        # If this is a leaf subassembly, export it on its own, without descending into it
+        if self.component_filter.is_leaf(subassembly):
+            for edir in export_directives:
+                self._execute_single_export_directive(subassembly, edir)
+            return already_processed_files.union({subassembly.FileName})
 
         # Step 1 : Export parts
         # If the export directives have "Export Parts" set to False, this code won't do anything
@@ -404,7 +4858,7 @@ class AlibreNeutralizer:
         for subsubassy in subassembly.SubAssemblies:
             if subsubassy.FileName not in already_processed_files:
                 already_processed_files = already_processed_files.union(
-                    self._export_subassemblies_recursive(subsubassy, export_directives, already_processed_files)
+                    self._export_subassemblies_recursive(subsubassy, export_directives, already_processed_files, subassembly)
                 )
 
         return already_processed_files
@@ -418,12 +4872,7 @@ class AlibreNeutralizer:
             # Recursive purge files of type ".{fileExtension}" from self._convert_base_path_to_absolute() + export_directive.purge_before_export
 
             # Purge path = export_directive.purge_before_export, relative to self._convert_base_path_to_absolute()
-            purge_path = os.path.normpath(
-                os.path.join(
-                    self._convert_base_path_to_absolute(),
-                    os.path.normpath(export_directive.purge_before_export)
-                )
-            )
+            purge_path = self._get_purge_path(export_directive)
 
             # Recursively purge files of type fileExtension in purge_path and subdirectories
             for root, _, files in os.walk(purge_path):
@@ -434,7 +4883,7 @@ class AlibreNeutralizer:
                             # TODO: uncomment to do it for realsies
                             os.remove(file_path)
                         except OSError as e:
-                            print "ERROR: Could not delete {file_path} in pre-export purge: {e}".format(file_path=file_path, e=e)
+                            log.error("Could not delete {file_path} in pre-export purge: {e}".format(file_path=file_path, e=e), path=file_path)
 
     def _execute_single_export_directive(self, component, export_directive):
         """Given a ``Part`` or ``Assembly``, execute one ``ExportDirective`` against it. This function does NOT perform any deduplication checking."""
@@ -449,37 +4898,368 @@ class AlibreNeutralizer:
 
         if isinstance(export_directive, ExportDirective):
             # Confirmed: We have a valid ExportDirective.
+            self._metrics.components_seen.add(component.FileName)
+
+            # First, check this directive's own Include/Exclude rules
+            if not export_directive.component_filter.is_included(component):
+                return
+
             # Now we need to read that ExportDirective and compare it against the type of component we're dealing with.
             # This will dictate whether we actually need to export this component.
             if export_directive.export_parts == True and (isinstance(component, AssembledPart) or isinstance(component, Part)):
                 # We need to export this Part
-                print "- Exporting Part to {0}: {1}".format(ExportTypes.convert_to_string(export_directive.export_type), component.Name)
-                abs_export_path = self._get_absolute_export_path(
-                    export_directive.get_export_path(component)
-                )
-                print "- Path : {0}".format(abs_export_path)
-                self._export(
-                    component,
-                    export_directive.export_type,
-                    abs_export_path
-                )
+                abs_export_path = self._get_directive_export_path(export_directive, component)
+                self._start_export("Part", component, export_directive, abs_export_path)
             elif (export_directive.export_subassemblies == True) and isinstance(component, AssembledSubAssembly):
                 # We need to export this Subassembly
-                print "- Exporting Subassembly to {0}: {1}".format(ExportTypes.convert_to_string(export_directive.export_type), component.Name)
-                abs_export_path = self._get_absolute_export_path(
-                    export_directive.get_export_path(component)
-                )
-                print "- Path : {0}".format(abs_export_path)
-                self._export(
-                    component,
-                    export_directive.export_type,
-                    abs_export_path
-                )
+                abs_export_path = self._get_directive_export_path(export_directive, component)
+                self._start_export("Subassembly", component, export_directive, abs_export_path)
 
 
         else:
             raise Exception("Invalid argument - expected an ExportDirective.")
     
+    def _start_export(self, kind, component, export_directive, export_path_abs):
+        """Export ``component`` with ``export_directive``, or for GLB scenes and synthesized assembly STEP files, queue it up for ``_write_deferred_exports()``."""
+        # type: (AlibreNeutralizer, str, Part | Assembly, ExportDirective, str) -> None
+        is_assembly = isinstance(component, Assembly) or isinstance(component, AssembledSubAssembly)
+        if export_directive.export_type == ExportTypes.GLB or (export_directive.synthesize_assembly_step and is_assembly):
+            self._deferred_exports.append((kind, component, export_directive, export_path_abs))
+            return
+        self._log_export_start(kind, component, export_directive, export_path_abs)
+        self._export_with_directive(component, export_directive, export_path_abs)
+
+    def _write_deferred_exports(self):
+        """Export the GLB scenes and synthesized assembly STEP files queued up during the run. They're left until every other export is done,
+        so they can be built from part files written in this run instead of exporting the parts again
+        (see ``_get_glb_mesh_source()`` and ``_get_part_step_source()``)."""
+        # type: (AlibreNeutralizer) -> None
+        for kind, component, export_directive, export_path_abs in self._deferred_exports:
+            self._log_export_start(kind, component, export_directive, export_path_abs)
+            self._export_with_directive(component, export_directive, export_path_abs)
+        self._deferred_exports = []
+
+    def _log_export_start(self, kind, component, export_directive, export_path_abs):
+        """Log that an export is starting (at DEBUG, since there's one of these per export), and update the console's progress line."""
+        # type: (AlibreNeutralizer, str, Part | Assembly, ExportDirective, str) -> None
+        type_string = ExportTypes.convert_to_string(export_directive.export_type)
+        log.debug("- Exporting {0} to {1}: {2}".format(kind, type_string, component.Name), component=component.FileName, export_type=type_string, path=export_path_abs)
+        self._export_count += 1
+        log.progress("Exporting #{0}: {1} to {2}".format(self._export_count, component.Name, type_string))
+
+    def _export_with_directive(self, component, export_directive, export_path_abs):
+        """Export ``component`` as ``export_directive`` says, then run the directive's post-processing stages on the result.
+        How long that took, and whether it worked, goes in the run's metrics."""
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str) -> None
+        started = time.time()
+        succeeded = False
+        try:
+            succeeded = self._export_and_post_process(component, export_directive, export_path_abs)
+        finally:
+            self._metrics.record_export(
+                component.FileName, ExportTypes.convert_to_string(export_directive.export_type), time.time() - started, succeeded
+            )
+
+    def _export_and_post_process(self, component, export_directive, export_path_abs):
+        """The work behind ``_export_with_directive()``.
+
+        :return: True if the file was exported. An old file left at the path by a failed export doesn't count.
+        :rtype: bool
+        """
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str) -> bool
+
+        # Move the last export aside, so we can put it back if the geometry didn't really change
+        previous_path = None
+        moved_previous = False
+        if export_directive.keep_unchanged_geometry and os.path.isfile(export_path_abs):
+            previous_path = export_path_abs + ".neutralizer-previous"
+            _replace_file(export_path_abs, previous_path)
+            moved_previous = True
+        elif export_directive.keep_unchanged_geometry and export_directive.compress_output:
+            # The last export was compressed. If we keep the uncompressed file, compressing it again gives exactly the same bytes.
+            compressed_path = export_directive.get_compressed_export_path(export_path_abs)
+            if os.path.isfile(compressed_path):
+                previous_path = export_path_abs + ".neutralizer-previous"
+                gunzip_file(compressed_path, previous_path)
+        if previous_path is None and len(self._staging_directories) > 0 and os.path.isfile(export_path_abs):
+            # This is hard-linked to the live export tree. Writing over it would change the live file in place, so unlink it first.
+            os.remove(export_path_abs)
+
+        record_count = len(self._export_records)
+        try:
+            if not (self._split_from_assembly_step(component, export_directive, export_path_abs)
+                    or self._synthesize_assembly_step(component, export_directive, export_path_abs)):
+                self._export(component, export_directive.export_type, export_path_abs)
+            # Every way of writing the file records it when it works
+            normalized_path = os.path.normcase(export_path_abs)
+            if not any(os.path.normcase(record[0]) == normalized_path for record in self._export_records[record_count:]):
+                return False # The export failed, and we've already reported it
+
+            if export_directive.compact_step:
+                # Compacting a big STEP file takes a while, and neither it nor anything after it needs Alibre, so don't make the next export wait.
+                # The background task deletes the previous file when it's done with it.
+                self.background_tasks.submit(self._post_process_export, component, export_directive, export_path_abs, previous_path)
+                previous_path, moved_previous = None, False
+            else:
+                self._post_process_export(component, export_directive, export_path_abs, previous_path)
+            return True
+        finally:
+            if moved_previous and os.path.exists(previous_path) and not os.path.isfile(export_path_abs):
+                # The export failed, so put the last good file back rather than leaving nothing there
+                _replace_file(previous_path, export_path_abs)
+            elif previous_path is not None and os.path.exists(previous_path):
+                os.remove(previous_path)
+
+    def _split_from_assembly_step(self, component, export_directive, export_path_abs):
+        """For directives with ``split_assembly_step`` set, write ``component``'s STEP file by splitting it out of the root assembly's STEP file.
+
+        :return: True if the file was written, False if it should be exported the normal way.
+        :rtype: bool
+        """
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str) -> bool
+        if not export_directive.split_assembly_step or component.FileName == self.root_component.FileName:
+            return False
+        splitter = self._get_assembly_step_splitter(export_directive)
+        if splitter is None:
+            return False
+
+        # Alibre names STEP products after the file, but try the other names people use too
+        names = [
+            os.path.splitext(os.path.basename(component.FileName))[0],
+            re.sub(r"<[0-9]+>$", "", component.Name),
+            export_directive.get_prettified_component_properties(component)["Number"],
+        ]
+        product_id = splitter.find_product(names)
+        if product_id is None:
+            log.debug("- Not found in the root assembly's STEP file, exporting it separately")
+            return False
+        try:
+            splitter.write_product(product_id, export_path_abs)
+        except Exception as e:
+            log.error("There was a problem splitting {0} out of the root assembly's STEP file: {1}".format(component.FileName, e), component=component.FileName)
+            return False
+        log.debug("- Split from the root assembly's STEP file")
+        self._record_export(component, export_directive.export_type, export_path_abs)
+        return True
+
+    def _get_assembly_step_splitter(self, export_directive):
+        """Return a ``StepAssemblySplitter`` for the root assembly's STEP file, for one directive, or None if we couldn't get one.
+        If the directive already exported the root assembly in this run we use that file, otherwise we export one to a temporary folder."""
+        # type: (AlibreNeutralizer, ExportDirective) -> StepAssemblySplitter | None
+        if id(export_directive) in self._assembly_step_splitters:
+            return self._assembly_step_splitters[id(export_directive)]
+
+        self._wait_for_step_compaction()
+        step_path = self._get_directive_export_path(export_directive, self.root_component)
+        type_string = ExportTypes.convert_to_string(export_directive.export_type)
+        exported = any(
+            os.path.normcase(record[0]) == os.path.normcase(step_path) and record[2] == type_string
+            for record in self._export_records
+        )
+        splitter = None
+        try:
+            if not exported or not os.path.isfile(step_path):
+                if self._step_temp_dir is None:
+                    self._step_temp_dir = tempfile.mkdtemp(prefix="alibre-neutralizer-step-")
+                step_path = os.path.join(self._step_temp_dir, "{0}.stp".format(len(self._assembly_step_splitters)))
+                log.debug("- Exporting Root Assembly to {0}, to split it into components: {1}".format(type_string, self.root_component.Name))
+                if export_directive.export_type == ExportTypes.STEP203:
+                    self.root_component.ExportSTEP203(step_path)
+                else:
+                    self.root_component.ExportSTEP214(step_path)
+            splitter = StepAssemblySplitter(step_path)
+        except Exception as e:
+            log.error("There was a problem reading the root assembly's STEP file, exporting components separately instead: {0}".format(e))
+        self._assembly_step_splitters[id(export_directive)] = splitter
+        return splitter
+
+    def _synthesize_assembly_step(self, component, export_directive, export_path_abs):
+        """For directives with ``synthesize_assembly_step`` set, write an assembly's STEP file by placing copies of its parts' STEP files,
+        or write a part's STEP file by copying one we already exported (or had to export for an assembly) earlier in this run.
+
+        :return: True if the file was written, False if it should be exported the normal way.
+        :rtype: bool
+        """
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str) -> bool
+        if not export_directive.synthesize_assembly_step:
+            return False
+        self._wait_for_step_compaction()
+
+        is_assembly = isinstance(component, Assembly) or isinstance(component, AssembledSubAssembly)
+        if not is_assembly:
+            source_path = self._get_part_step_source(component, export_directive.export_type, export_if_missing=False)
+            if source_path is None or os.path.normcase(source_path) == os.path.normcase(export_path_abs):
+                return False
+            export_directory = os.path.dirname(export_path_abs)
+            if not os.path.exists(export_directory):
+                os.makedirs(export_directory)
+            shutil.copyfile(source_path, export_path_abs)
+            log.debug("- Copied from an earlier export in this run")
+            self._record_export(component, export_directive.export_type, export_path_abs)
+            return True
+
+        try:
+            occurrences = []
+            for part in self._iter_step_part_occurrences(component):
+                part_path = self._get_part_step_source(part, export_directive.export_type, export_if_missing=True)
+                occurrences.append((part_path, part.Name, get_occurrence_matrix(part)))
+            if len(occurrences) == 0:
+                return False
+            write_step_assembly(export_path_abs, os.path.splitext(os.path.basename(component.FileName))[0], occurrences)
+        except Exception as e:
+            log.error("There was a problem building {0} out of its parts' STEP files, exporting it normally instead: {1}".format(component.FileName, e), component=component.FileName)
+            return False
+        log.debug("- Built from {0} part STEP files".format(len(set(occurrence[0] for occurrence in occurrences))))
+        self._record_export(component, export_directive.export_type, export_path_abs)
+        return True
+
+    def _iter_step_part_occurrences(self, assembly):
+        """Yield every active part occurrence in an assembly, including the ones in its subassemblies.
+        Like Alibre's own STEP export, this includes components the Include/Exclude rules leave out of the export."""
+        # type: (AlibreNeutralizer, Assembly | AssembledSubAssembly) -> iterator[AssembledPart]
+        for part in assembly.Parts:
+            if self.component_filter.is_active_occurrence(part, assembly):
+                yield part
+        for subassembly in assembly.SubAssemblies:
+            if self.component_filter.is_active_occurrence(subassembly, assembly):
+                for part in self._iter_step_part_occurrences(subassembly):
+                    yield part
+
+    def _get_part_step_source(self, part, export_type, export_if_missing):
+        """Return the path of a STEP file of ``part`` written earlier in this run (by any directive), or in an earlier run if ``part``
+        isn't being re-exported in this one, or None if there isn't one. With ``export_if_missing``, export one to a temporary folder instead of returning None."""
+        # type: (AlibreNeutralizer, Part | AssembledPart, int, bool) -> str | None
+        key = (export_type, part.FileName)
+        if key in self._part_step_sources and os.path.isfile(self._part_step_sources[key]):
+            return self._part_step_sources[key]
+
+        type_string = ExportTypes.convert_to_string(export_type)
+        for export_path_abs, source_file_name, export_type_string in self._export_records:
+            if source_file_name == part.FileName and export_type_string == type_string and os.path.isfile(export_path_abs):
+                self._part_step_sources[key] = export_path_abs
+                return export_path_abs
+        export_path_abs = self._get_unchanged_export(part, export_type)
+        if export_path_abs is not None:
+            self._part_step_sources[key] = export_path_abs
+            return export_path_abs
+        if not export_if_missing:
+            return None
+
+        if self._step_temp_dir is None:
+            self._step_temp_dir = tempfile.mkdtemp(prefix="alibre-neutralizer-step-")
+        temp_path = os.path.join(self._step_temp_dir, "part{0}.stp".format(len(self._part_step_sources)))
+        log.debug("- Exporting Part to {0}, to build assemblies from: {1}".format(type_string, part.Name))
+        if export_type == ExportTypes.STEP203:
+            part.ExportSTEP203(temp_path)
+        else:
+            part.ExportSTEP214(temp_path)
+        self._part_step_sources[key] = temp_path
+        return temp_path
+
+    def _post_process_export(self, component, export_directive, export_path_abs, previous_path):
+        """Run the directive's post-processing stages on a freshly exported file. Problems are reported, but don't stop the export.
+        For directives that compact STEP files, this runs on a background thread.
+
+        :param previous_path: Where the previous export of this file was moved to, if the directive keeps unchanged geometry and there was one.
+            It's deleted once we're done with it.
+        :type previous_path: str | None
+        """
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str, str | None) -> None
+        try:
+            if export_directive.convert_stl_to_binary:
+                if convert_ascii_stl_to_binary(export_path_abs):
+                    log.debug("- Converted to binary STL")
+            if export_directive.compact_step:
+                entity_count, compacted_count = compact_step_file(export_path_abs)
+                log.debug("- Compacted STEP file: merged {0} duplicate entities, {1} left".format(entity_count - compacted_count, compacted_count))
+
+            # This has to come after the binary conversion and compaction, since the previous file went through them too
+            if previous_path is not None and geometry_files_match(previous_path, export_path_abs, export_directive.export_type, export_directive.geometry_tolerance):
+                _replace_file(previous_path, export_path_abs)
+                log.debug("- Geometry unchanged, kept the previous file")
+
+            if self.mesh_statistics_path is not None and export_directive.export_type == ExportTypes.STL:
+                statistics = compute_stl_statistics(export_path_abs)
+                row = dict((column, statistics.get(column)) for column in MESH_STATISTICS_COLUMNS)
+                row["Number"] = export_directive.get_prettified_component_properties(component)["Number"]
+                row["Path"] = export_path_abs
+                self._mesh_statistics_rows[export_path_abs] = row
+
+            if export_directive.validate_mesh:
+                result = validate_stl_mesh(export_path_abs, self.mesh_validation_tolerance)
+                row = dict((column, result.get(column)) for column in MESH_VALIDATION_COLUMNS)
+                row["Number"] = export_directive.get_prettified_component_properties(component)["Number"]
+                row["Path"] = export_path_abs
+                self._mesh_validation_rows[export_path_abs] = row
+                if result["TriangleCount"] == 0:
+                    log.warning("Mesh problems in {0}: the mesh has no triangles".format(export_path_abs), path=export_path_abs)
+                elif not result["Valid"]:
+                    log.warning("Mesh problems in {0}: {1} open edges, {2} non-manifold edges, {3} degenerate triangles, {4} inconsistently wound edges".format(
+                        export_path_abs, result["OpenEdges"], result["NonManifoldEdges"], result["DegenerateTriangles"], result["InconsistentWindingEdges"]
+                    ), path=export_path_abs)
+
+            # Decimation doesn't need Alibre, so don't make the next export wait for it
+            if len(export_directive.lod_resolutions) > 0:
+                self.background_tasks.submit(self._write_levels_of_detail, component, export_directive, export_path_abs)
+
+            # Neither does indexing STEP files
+            if self.step_index_path is not None and export_directive.export_type in (ExportTypes.STEP203, ExportTypes.STEP214):
+                self.background_tasks.submit(self._index_step_export, component, export_directive, export_path_abs)
+
+            # Or compressing. The uncompressed file is deleted once every background task is done with it (see _finish_run()).
+            if export_directive.compress_output:
+                self._compressed_export_paths[export_path_abs] = export_directive.get_compressed_export_path(export_path_abs)
+                self.background_tasks.submit(self._compress_export, component, export_directive, export_path_abs)
+        except Exception as e:
+            log.error("There was a problem post-processing {0}: {1}".format(export_path_abs, e), path=export_path_abs)
+        finally:
+            if previous_path is not None and os.path.exists(previous_path):
+                os.remove(previous_path)
+
+    def _index_step_export(self, component, export_directive, export_path_abs):
+        """Add an exported STEP file to the STEP index. This runs on a background thread."""
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str) -> None
+        try:
+            row = compute_step_index(export_path_abs)
+        except Exception as e:
+            log.error("There was a problem indexing {0}: {1}".format(export_path_abs, e), path=export_path_abs)
+            return None
+        row["Number"] = export_directive.get_prettified_component_properties(component)["Number"]
+        row["Path"] = export_path_abs
+        self._step_index_rows[export_path_abs] = row
+        return None
+
+    def _compress_export(self, component, export_directive, export_path_abs):
+        """Write a gzip-compressed copy of an exported file. This runs on a background thread.
+
+        :return: A list of ``(component, export type, absolute path)`` tuples for the files written, for the manifest.
+        :rtype: list[tuple]
+        """
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str) -> list[tuple]
+        compressed_path = export_directive.get_compressed_export_path(export_path_abs)
+        try:
+            gzip_file(export_path_abs, compressed_path, export_directive.compression_level)
+        except Exception as e:
+            log.error("There was a problem compressing {0}: {1}".format(export_path_abs, e), path=export_path_abs)
+            return []
+        return [(component, export_directive.export_type, compressed_path)]
+
+    def _write_levels_of_detail(self, component, export_directive, export_path_abs):
+        """Write every level of detail the directive asks for, from an exported STL. This runs on a background thread.
+
+        :return: A list of ``(component, export type, absolute path)`` tuples for the files written, for the manifest.
+        :rtype: list[tuple[Part | Assembly, int, str]]
+        """
+        # type: (AlibreNeutralizer, Part | Assembly, ExportDirective, str) -> list[tuple[Part | Assembly, int, str]]
+        written_files = []
+        for resolution, lod_path in zip(export_directive.lod_resolutions, export_directive.get_lod_export_paths(export_path_abs)):
+            try:
+                decimate_stl(export_path_abs, lod_path, resolution)
+                written_files.append((component, ExportTypes.STL, lod_path))
+            except Exception as e:
+                log.error("There was a problem writing level of detail {0}: {1}".format(lod_path, e), path=lod_path)
+        return written_files
+
     def _export(self, component, export_type, export_path_abs):
         """Given a Part or Assembly, export the specified file type to the specified absolute path."""
         # type: (AlibreNeutralizer, Part | Assembly, int, str) -> None
@@ -488,7 +5268,22 @@ class AlibreNeutralizer:
         export_directory = os.path.dirname(export_path_abs)
         if not os.path.exists(export_directory):
             os.makedirs(export_directory)
+        if len(self._staging_directories) > 0 and os.path.exists(export_path_abs):
+            # This may be hard-linked to the live export tree (see _begin_staging()), so unlink it before anything writes over it
+            os.remove(export_path_abs)
         
+        # If this exact part has been exported before (by any project on this machine), reuse that export instead of asking Alibre
+        cache_key = None
+        if self.export_cache is not None:
+            cache_key = self.export_cache.get_key(component, export_type, self._get_export_options(export_type))
+            if cache_key is not None and self.export_cache.fetch(cache_key, export_path_abs):
+                log.debug("- Reused from export cache")
+                self._record_export(component, export_type, export_path_abs)
+                return
+            if self.export_cache.use_hard_links and os.path.exists(export_path_abs):
+                # This may be hard-linked to a cache entry. Alibre would overwrite the entry in place, so unlink it first.
+                os.remove(export_path_abs)
+
         # TODO: Better error handling/logging than this.
         # This gets the job done for testing the path interpretations.
         try:
@@ -508,9 +5303,115 @@ class AlibreNeutralizer:
             elif export_type == ExportTypes.CSV_Parameters:
                 # Export Parameters (dimensions, equations, etc) to CSV
                 self._export_parameters_to_csv(component, export_path_abs)
+            elif export_type == ExportTypes.GLB:
+                # Instanced glTF scene, with each unique part mesh stored once
+                self._export_glb(component, export_path_abs)
+
+            if cache_key is not None and os.path.isfile(export_path_abs):
+                self.export_cache.store(cache_key, export_path_abs)
+            self._record_export(component, export_type, export_path_abs)
         except Exception as e:
-            print "ERROR: There was a problem exporting {0} to {1} format.".format(component.FileName, ExportTypes.convert_to_string(export_type))
+            log.error("There was a problem exporting {0} to {1} format: {2}".format(component.FileName, ExportTypes.convert_to_string(export_type), e), component=component.FileName, export_type=ExportTypes.convert_to_string(export_type), path=export_path_abs, error=str(e))
     
+    def _export_glb(self, component, export_path_abs):
+        """Export a Part or Assembly as a binary glTF (.glb) scene.
+
+        Every unique part (by FileName) is stored as one indexed mesh, and each occurrence of it is a node referencing that mesh,
+        so the file size scales with the number of unique parts, not the number of instances. The scene's node tree mirrors the assembly tree."""
+        # type: (AlibreNeutralizer, Part | Assembly, str) -> None
+        scene = GlbScene()
+        root_node = self._add_glb_node(scene, component, {}, None)
+        temp_path = export_path_abs + ".tmp"
+        scene.write(temp_path, [root_node])
+        _replace_file(temp_path, export_path_abs)
+
+    def _add_glb_node(self, scene, component, mesh_indexes, matrix):
+        """Add a node for ``component`` (and, for assemblies, everything in it) to a GLB scene, and return the node's index.
+
+        :param mesh_indexes: Meshes already added to this scene, keyed by FileName.
+        :type mesh_indexes: dict[str, int]
+        :param matrix: The node's placement in its parent, as a column-major 4x4 matrix, or None for no transformation.
+        :type matrix: list[float] | None
+        """
+        # type: (AlibreNeutralizer, GlbScene, Part | Assembly | AssembledPart | AssembledSubAssembly, dict[str, int], list[float] | None) -> int
+        is_assembly = isinstance(component, Assembly) or isinstance(component, AssembledSubAssembly)
+        if not is_assembly or self.component_filter.is_leaf(component):
+            if component.FileName not in mesh_indexes:
+                vertices = read_stl_vertices(self._get_glb_mesh_source(component))
+                mesh_name = os.path.splitext(os.path.basename(component.FileName))[0]
+                # glTF doesn't allow empty meshes, so a component with no geometry just gets an empty node
+                mesh_indexes[component.FileName] = scene.add_mesh(mesh_name, vertices) if len(vertices) > 0 else None
+            return scene.add_node(component.Name, mesh=mesh_indexes[component.FileName], matrix=matrix)
+
+        children = []
+        for part in component.Parts:
+            if self.component_filter.is_active_occurrence(part, component) and self.component_filter.is_included(part):
+                children.append(self._add_glb_node(scene, part, mesh_indexes, get_occurrence_matrix(part)))
+        for subassy in component.SubAssemblies:
+            if self.component_filter.is_active_occurrence(subassy, component) and self.component_filter.is_included(subassy):
+                # Alibre Script has no way to read a subassembly's placement, but its parts' placements are in root coordinates, so they carry it.
+                # That only works in the root assembly's scene, which is why GLB directives can't export subassemblies.
+                children.append(self._add_glb_node(scene, subassy, mesh_indexes, None))
+        return scene.add_node(component.Name, matrix=matrix, children=children)
+
+    def _get_glb_mesh_source(self, component):
+        """Return the path of an STL of ``component``, for building GLB scenes. If an STL directive already exported it in this run we use that.
+        Otherwise, we use an STL a directive exported in an earlier run (selective exports and watch mode only re-export the affected components),
+        and if there isn't one, we export one to a temporary folder (once per run)."""
+        # type: (AlibreNeutralizer, Part | Assembly | AssembledPart | AssembledSubAssembly) -> str
+        if component.FileName in self._glb_mesh_sources:
+            return self._glb_mesh_sources[component.FileName]
+
+        stl_type_string = ExportTypes.convert_to_string(ExportTypes.STL)
+        for export_path_abs, source_file_name, export_type_string in self._export_records:
+            if source_file_name == component.FileName and export_type_string == stl_type_string and os.path.isfile(export_path_abs):
+                self._glb_mesh_sources[component.FileName] = export_path_abs
+                return export_path_abs
+
+        export_path_abs = self._get_unchanged_export(component, ExportTypes.STL)
+        if export_path_abs is not None:
+            self._glb_mesh_sources[component.FileName] = export_path_abs
+            return export_path_abs
+
+        if self._glb_temp_dir is None:
+            self._glb_temp_dir = tempfile.mkdtemp(prefix="alibre-neutralizer-glb-")
+        temp_path = os.path.join(self._glb_temp_dir, "{0}.stl".format(len(self._glb_mesh_sources)))
+        component.ExportSTL(temp_path)
+        self._glb_mesh_sources[component.FileName] = temp_path
+        return temp_path
+
+    def _get_unchanged_export(self, component, export_type):
+        """If ``component`` isn't being re-exported in this run (in a selective export or watch mode), return the path of a file
+        a directive exported it to in an earlier run, or None if there isn't one. Since the component hasn't changed, that file is still good."""
+        # type: (AlibreNeutralizer, Part | AssembledPart | AssembledSubAssembly, int) -> str | None
+        if self._affected_file_names is None or component.FileName in self._affected_file_names:
+            return None
+        is_part = isinstance(component, AssembledPart) or isinstance(component, Part)
+        for edir in self.export_directives:
+            if edir.export_type != export_type or not edir.component_filter.is_included(component):
+                continue
+            if (is_part and edir.export_parts) or (not is_part and edir.export_subassemblies):
+                export_path_abs = self._get_directive_export_path(edir, component)
+                if os.path.isfile(export_path_abs):
+                    return export_path_abs
+        return None
+
+    def _record_export(self, component, export_type, export_path_abs):
+        """Remember a file we've written during this run, for the manifest."""
+        # type: (AlibreNeutralizer, Part | Assembly, int, str) -> None
+        if os.path.isfile(export_path_abs):
+            self._export_records.append(
+                (export_path_abs, getattr(component, "FileName", None), ExportTypes.convert_to_string(export_type))
+            )
+
+    def _get_export_options(self, export_type):
+        """Return a string describing any options passed to Alibre's export functions for ``export_type``.
+        These are part of the export cache key, so changing them invalidates old cache entries."""
+        # type: (AlibreNeutralizer, int) -> str
+        if export_type == ExportTypes.SAT:
+            return "ExportSAT(0, True)"
+        return ""
+
     def _convert_base_path_to_absolute(self):
         """Convert self.base_path to an absolute path, relative to the directory where the config file lives.
         In the rare case that self.base_path is already absolute, just return it as-is.
@@ -527,6 +5428,13 @@ class AlibreNeutralizer:
             )
             return os.path.normpath(os.path.join(root_assembly_dir, self.base_path))
     
+    def _get_export_base_path(self):
+        """Return the absolute path files are actually exported under: the local scratch folder if there is one, otherwise the same as ``_convert_base_path_to_absolute()``."""
+        # type: (AlibreNeutralizer) -> str
+        if self.scratch_path is not None:
+            return self.scratch_path
+        return self._convert_base_path_to_absolute()
+
     def _get_absolute_export_path(self, export_path_relative):
         """Combine a given relative export path with this ``AlibreNeutralizer``'s absolute ``base_path``, to give an absolute path."""
 
@@ -536,12 +5444,22 @@ class AlibreNeutralizer:
         pattern = r'[^\w_.: \-' + re.escape(os.sep) + r']'
         export_path_relative_sanitized = re.sub(pattern, '_', export_path_relative)
 
-        return os.path.normpath(
+        return self._get_staged_path(os.path.normpath(
             os.path.join(
-                self._convert_base_path_to_absolute(),
+                self._get_export_base_path(),
                 export_path_relative_sanitized
             )
-        )
+        ))
+
+    def _get_purge_path(self, export_directive):
+        """Return the absolute path of an Export Directive's purge directory (in its staging directory, during a staged export)."""
+        # type: (AlibreNeutralizer, ExportDirective) -> str
+        return self._get_staged_path(os.path.normpath(
+            os.path.join(
+                self._get_export_base_path(),
+                os.path.normpath(export_directive.purge_before_export)
+            )
+        ))
 
     def _export_properties_to_csv(self, component, export_path_abs):
         """Given a single Part or Assembly, export its Properties (Comment, Cost Center, Part Number, etc) to a CSV file at a specified path."""
@@ -617,6 +5535,65 @@ class AlibreNeutralizer:
             
 
 
+def verify_manifest(manifest_path, worker_count=None):
+    """Check a repository against a manifest written by Alibre Neutralizer. This doesn't need Alibre, so it can run on any CI runner.
+
+    Sizes are checked first, and files are only hashed when their size matches, so most problems are found without reading any file contents.
+
+    :param manifest_path: Path to the manifest JSON file.
+    :type manifest_path: str
+
+    :return: A list of human-readable problems. If it's empty, everything matches.
+    :rtype: list[str]
+    """
+    # type: (str, int | None) -> list[str]
+    with open(manifest_path, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    problems = []
+    to_hash = [] # (entry, absolute path, description)
+    checks = [(entry, "Exported file") for entry in manifest.get("files", [])]
+    checks += [(entry, "Native file") for entry in manifest.get("sources", []) if entry.get("path") is not None]
+    for entry, description in checks:
+        abs_path = os.path.join(manifest_dir, *entry["path"].split("/"))
+        if not os.path.isfile(abs_path):
+            problems.append("{0} is missing: {1}".format(description, entry["path"]))
+        elif os.path.getsize(abs_path) != entry["size"]:
+            problems.append("{0} has changed since the last export (size differs): {1}".format(description, entry["path"]))
+        else:
+            to_hash.append((entry, abs_path, description))
+
+    hashes = _run_in_thread_pool(lambda check: _sha256_of_file(check[1]), to_hash, worker_count)
+    for (entry, _, description), sha in zip(to_hash, hashes):
+        if sha != entry["sha256"]:
+            problems.append("{0} has changed since the last export (contents differ): {1}".format(description, entry["path"]))
+
+    return problems
+
+def verify_main(args):
+    """Command-line entry point for ``python alibre-neutralizer.py verify <manifest.json> [--json-lines <log.jsonl>]``. Returns the process exit code.
+    With ``--json-lines``, every message is also written to that file as JSON lines, for CI to parse."""
+    # type: (list[str]) -> int
+    if len(args) == 3 and args[1] == "--json-lines":
+        log.configure(sinks=[LogFileSink(args[2], LogLevels.INFO, json_lines=True)])
+        args = args[:1]
+    if len(args) != 1:
+        print("Usage: python alibre-neutralizer.py verify <path to manifest JSON> [--json-lines <path to log>]")
+        return 2
+
+    try:
+        problems = verify_manifest(args[0])
+        for problem in problems:
+            log.error(problem)
+        if problems:
+            log.info("Verification failed with {0} problems. Re-run Alibre Neutralizer and commit the results.".format(len(problems)))
+            return 1
+        log.info("All files match the manifest.")
+        return 0
+    finally:
+        log.close()
+
 def main():
     """This is the entry point of the program.
     Even though you don't HAVE to use a main function in Python scripts, I prefer it
@@ -634,15 +5611,27 @@ def main():
     # Create an instance using configuration from XML file
     neutralizer = AlibreNeutralizer(CurrentAssembly(), cfg_file_path)
 
+    # If a list of changed files is configured and present, we only export what those changes affect
+    changed_paths = None
+    selective_summary = ""
+    if neutralizer.changed_files_list_path is not None and os.path.isfile(neutralizer.changed_files_list_path):
+        with open(neutralizer.changed_files_list_path, 'r') as changed_list_file:
+            changed_paths = changed_list_file.readlines()
+        selective_summary = "Only components affected by the {n} files listed in {path} will be exported.".format(
+            n=len([path for path in changed_paths if path.strip() != ""]),
+            path=neutralizer.changed_files_list_path
+        )
+
     # Now that we've created an AlibreNeutralizer, give the user a quick summary of how we understood the config file
     # This is their last opportunity to cancel
     continue_window_prompt = """
     Successfully read the config file, which contains {edirs} export directives.
+    {selective_summary}
 
     Would you like to start Alibre Neutralizer's export process, following that configuration?
     
     THIS MAY DELETE FILES, if you've enabled the pre-export purge option on any of your export directives.
-    """.format(edirs=len(neutralizer.export_directives))
+    """.format(edirs=len(neutralizer.export_directives), selective_summary=selective_summary)
     continue_choice = Windows().QuestionDialog(
         continue_window_prompt,
         window_name
@@ -650,11 +5639,26 @@ def main():
 
     # If the user said yes, go
     if continue_choice == True:
-        neutralizer.export_all()
-        Windows().InfoDialog("The export process completed!", window_name)
+        try:
+            if changed_paths is not None:
+                neutralizer.export_selective(changed_paths)
+            else:
+                neutralizer.export_all()
+            if neutralizer.watch_mode_enabled:
+                Windows().InfoDialog("The export process completed! Alibre Neutralizer will now watch for changes to your native files, and re-export them as they're saved. Stop the script to exit watch mode.", window_name)
+                neutralizer.watch()
+            else:
+                Windows().InfoDialog("The export process completed!", window_name)
+        finally:
+            # Don't lose buffered log lines if something went wrong
+            log.close()
     else:
         Windows().InfoDialog("The export operation was cancelled. No files were modified. Alibre Neutralizer will now close.", window_name)
 
 # Start main
-main()
+# When run from a normal Python interpreter as ``python alibre-neutralizer.py verify <manifest>``, check the manifest instead
+if len(getattr(sys, "argv", [])) > 1 and sys.argv[1] == "verify":
+    sys.exit(verify_main(sys.argv[2:]))
+else:
+    main()
 